@@ -0,0 +1,71 @@
+'''
+    Inference engine comparison - Not used by the server
+    Loads every backend whose model file exists (see CHECKPOINTS) and runs Inference.detect on the images in utils/images
+    Reports load time, first call and per-image latency, and whether each backend picks the same image and box as the first one
+    Run from image_detection/: python benchmark_backends.py [--backends pytorch onnx] [--threads 4] [--repeat 20]
+'''
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+
+from config.config import CHECKPOINTS, INFERENCE_THREADS, INFERENCE_IMAGE_SIZE
+from inference import Inference
+
+def load_images(directory):
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+    # the server gets BGR frames, same as cv2.imread
+    return [(os.path.basename(path), cv2.imread(path)) for path in paths]
+
+def measure(inf, images, repeat):
+    first_time = time.perf_counter()
+    inf.detect(images[0][1], [])
+    first = time.perf_counter() - first_time
+
+    results, samples = {}, []
+    for _ in range(repeat):
+        for name, frame in images:
+            start_time = time.perf_counter()
+            label, cords, x_shape, y_shape, bbox = inf.detect(frame, [])
+            samples.append(time.perf_counter() - start_time)
+            results[name] = (label, bbox)
+    return first, sorted(samples), results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inference backend benchmark")
+    parser.add_argument('--backends', type=str, nargs='+', default=list(CHECKPOINTS.keys()), choices=CHECKPOINTS.keys())
+    parser.add_argument('--images', type=str, default="utils/images")
+    parser.add_argument('--threads', type=int, default=INFERENCE_THREADS)
+    parser.add_argument('--img_size', type=int, default=INFERENCE_IMAGE_SIZE)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    print(f"[Benchmark] {len(images)} images from {args.images}, {args.repeat} runs each")
+
+    reference = None
+    for backend in args.backends:
+        model_path = CHECKPOINTS[backend]
+        if not os.path.exists(model_path):
+            print(f"[Benchmark] {backend}: skipped, no {model_path}")
+            continue
+        try:
+            start_time = time.perf_counter()
+            inf = Inference(model_path, backend, threads=args.threads, image_size=args.img_size)
+            load = time.perf_counter() - start_time
+        except ImportError as e:
+            print(f"[Benchmark] {backend}: skipped, {e}")
+            continue
+
+        first, samples, results = measure(inf, images, args.repeat)
+        p50, p95 = samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        if reference is None:
+            reference, agreement = (backend, results), "reference"
+        else:
+            # same image id and a box within a few pixels of the reference backend
+            same = sum(results[name][0] == reference[1][name][0] and
+                       np.allclose(results[name][1], reference[1][name][1], atol=4) for name in results)
+            agreement = f"{same}/{len(results)} same as {reference[0]}"
+        print(f"[Benchmark] {backend:>11}: load {load:6.2f}s, first {first * 1000:7.1f} ms, "
+              f"p50 {p50 * 1000:7.1f} ms, p95 {p95 * 1000:7.1f} ms, mean {np.mean(samples) * 1000:7.1f} ms, {agreement}")
@@ -0,0 +1,67 @@
+'''
+    Microbenchmark for picking the detection out of the model output - Not used by the server
+    Compares the old per-row loop with Inference.candidates on synthetic outputs with many boxes,
+    and checks both pick the same detection
+    Run from image_detection/: python benchmark_selection.py
+'''
+import time
+import types
+import torch
+import numpy as np
+
+from config.config import IMAGE_IDS
+from inference import Inference
+
+X_SHAPE, Y_SHAPE = 1024, 768
+
+def synthetic_results(count, rng):
+    corners = rng.random((count, 2)) * 0.8
+    sizes = rng.random((count, 2)) * 0.2
+    conf = rng.uniform(0.5, 1.0, (count, 1))
+    cls = rng.integers(0, len(IMAGE_IDS), (count, 1))
+    rows = np.hstack([corners, corners + sizes, conf, cls]).astype(np.float32)
+    return types.SimpleNamespace(xyxyn=[torch.from_numpy(rows)])
+
+def legacy_select(inf, results, x_shape, y_shape, recognized_ids):
+    # run_inference's selection before it was vectorised
+    detected_img_id = "-1"
+    cords = []
+    bbox = []
+    labels, cord_thres = results.xyxyn[0][:, -1].numpy(), results.xyxyn[0][:, :-1].numpy()
+    if len(labels) > 0:
+        max_area = 0
+        for idx, detected in enumerate(cord_thres):
+            x1, y1, x2, y2 = int(detected[0]*x_shape), int(detected[1]*y_shape), int(detected[2]*x_shape), int(detected[3]*y_shape)
+            bbox = [x1, y1, x2, y2]
+            area = abs(x2-x1)*abs(y2-y1)
+            curr_id = inf.classes[int(labels[idx])]
+            if (area > max_area) and (curr_id not in recognized_ids) and (curr_id != "41"):
+                if detected[-1] >= 0.75:
+                    max_area = area
+                    detected_img_id = curr_id
+                    cords = detected
+    return detected_img_id, cords, x_shape, y_shape, bbox
+
+def measure(select, inf, results, recognized_ids, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        select(inf, results, X_SHAPE, Y_SHAPE, recognized_ids)
+    return (time.perf_counter() - start_time) / repeat
+
+if __name__ == "__main__":
+    # only the class names are needed, skip loading the model
+    inf = Inference.__new__(Inference)
+    inf.classes = {index: image_id for index, image_id in enumerate(IMAGE_IDS)}
+    inf.class_ids = np.array([inf.classes[index] for index in range(len(inf.classes))])
+    inf.excluded_key = inf.excluded = None
+    recognized_ids = ["11", "15", "20", "36"]
+    rng = np.random.default_rng(0)
+
+    for count in [5, 50, 500, 5000]:
+        results = synthetic_results(count, rng)
+        before, after = legacy_select(inf, results, X_SHAPE, Y_SHAPE, recognized_ids), Inference.select(inf, results, X_SHAPE, Y_SHAPE, recognized_ids)
+        assert before[0] == after[0] and before[4] == after[4] and np.array_equal(before[1], after[1]), (before, after)
+        repeat = max(20, 20000 // count)
+        legacy = measure(legacy_select, inf, results, recognized_ids, repeat)
+        vectorised = measure(Inference.select, inf, results, recognized_ids, repeat)
+        print(f"[Benchmark] {count:5d} boxes: loop {legacy * 1e6:9.1f} us, vectorised {vectorised * 1e6:8.1f} us ({legacy / vectorised:.1f}x)")
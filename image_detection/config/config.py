@@ -12,4 +12,49 @@ IMAGE_IDS = {
             "41": "Bulls eye"
         }
 
-MODEL_URL = "https://drive.google.com/uc?id=1EIWIDC2ntZ3D9DE9vWOip7c-6T_0YrT-"
\ No newline at end of file
+MODEL_URL = "https://drive.google.com/uc?id=1EIWIDC2ntZ3D9DE9vWOip7c-6T_0YrT-"
+
+# Frames waiting to be written by the image server before it blocks.
+IMAGE_WRITER_QUEUE_SIZE = 8
+
+# Detector settings for exported models, same as yolov5's AutoShape defaults.
+CONF_THRES = 0.25
+IOU_THRES = 0.45
+MAX_DET = 1000
+# Frame size from the RPi camera (height, width, channels), used for the warm-up pass.
+WARMUP_IMAGE_SHAPE = (768, 1024, 3)
+
+# CPU inference tuning, None keeps the torch default.
+INFERENCE_DEVICE = 'cpu'
+INFERENCE_THREADS = None
+INTEROP_THREADS = None
+INFERENCE_IMAGE_SIZE = 640
+AUTOTUNE_RUNS = 5
+
+# Inference engine: pytorch, torchscript or onnx, None picks torchscript when it has been exported, else pytorch.
+INFERENCE_BACKEND = None
+# Model file of each engine, exported next to the checkpoint with yolov5's export.py.
+CHECKPOINTS = {
+    "pytorch": "checkpoint/best_ckpt.pt",
+    "torchscript": "checkpoint/best_ckpt.torchscript",
+    "onnx": "checkpoint/best_ckpt.onnx",
+}
+
+# Image server workers, more than 1 runs them as separate processes behind an ImageBroker.
+IMAGE_SERVER_WORKERS = 1
+# Where the workers connect to the broker, and seconds between its per-worker stats reports.
+BROKER_BACKEND = "tcp://127.0.0.1:5556"
+BROKER_STATS_INTERVAL = 30.0
+# Seconds before a dead worker is started again, doubled for every death in a row without serving a request,
+# and the deaths in a row after which the broker gives up on it.
+BROKER_RESTART_BACKOFF = 0.5
+BROKER_RESTART_BACKOFF_MAX = 30.0
+BROKER_RESTART_LIMIT = 8
+
+# Detections of recent frames kept by the image server, a frame of the same image id whose grayscale thumbnail
+# (FRAME_THUMBNAIL_SIZE x FRAME_THUMBNAIL_SIZE of the centre FRAME_THUMBNAIL_CROP of the frame) is nowhere off by more than
+# FRAME_CACHE_THRESHOLD grey levels from a cached one reuses its detections, 0 entries turns the cache off.
+FRAME_CACHE_SIZE = 32
+FRAME_CACHE_THRESHOLD = 24
+FRAME_THUMBNAIL_SIZE = 32
+FRAME_THUMBNAIL_CROP = 0.5
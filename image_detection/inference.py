@@ -1,78 +1,203 @@
 import os
-import torch
 import cv2
 import time
+import torch
+import numpy as np
 
 # from image_detection.config.config import IMAGE_IDS
-from config.config import IMAGE_IDS
+from config.config import IMAGE_IDS, WARMUP_IMAGE_SHAPE, INFERENCE_DEVICE, INFERENCE_THREADS, INTEROP_THREADS, INFERENCE_IMAGE_SIZE, AUTOTUNE_RUNS, INFERENCE_BACKEND
+from model_loader import load_model
+from letterbox import original_shape, unletterbox_boxes
+
+def configure_threads(threads, interop_threads):
+    '''
+        One-time torch thread setup, interop threads can only be set before any parallel work has run
+    '''
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # already set, e.g. by an earlier Inference in this process
+            print("[Inference] Interop threads not changed:", e)
+    if threads:
+        torch.set_num_threads(threads)
+    print(f"[Inference] Torch threads: {torch.get_num_threads()}, interop threads: {torch.get_num_interop_threads()}")
 
 class Inference:
     '''
         Class to run inference
     '''
-    def __init__(self, model_path):
+    def __init__(self, model_path, backend=INFERENCE_BACKEND, device=INFERENCE_DEVICE, threads=INFERENCE_THREADS, interop_threads=INTEROP_THREADS, image_size=INFERENCE_IMAGE_SIZE, autotune=False):
+        start_time = time.time()
+        configure_threads(threads, interop_threads)
         self.model_path = model_path
-        self.model = torch.hub.load('ultralytics/yolov5', 'custom', path=self.model_path)
-        self.device = 'cpu'
+        # backend: pytorch, torchscript or onnx, picked from the file extension when None
+        self.model = load_model(self.model_path, backend, device, threads)
+        self.device = device
+        self.image_size = image_size
+        # move the model once, not on every request
+        self.model.to(self.device)
         self.classes = self.model.names
+        # class index -> image id, for looking up all detections at once
+        self.class_ids = np.array([self.classes[index] for index in range(len(self.classes))])
+        self.excluded_key = self.excluded = None
+        load_time = time.time() - start_time
+
+        # first forward pass is slow, do it now instead of on the first obstacle
+        blank = np.zeros(WARMUP_IMAGE_SHAPE, dtype=np.uint8)
+        self.detect(blank, [])
+        total_time = time.time() - start_time
+        print(f"[Inference] Model ready in {total_time:.2f}s (load {load_time:.2f}s, warm-up {total_time - load_time:.2f}s)")
+
+        if autotune:
+            self.autotune_threads(blank)
+
+    def forward(self, img):
+        # img: path or RGB array, no autograd bookkeeping needed
+        with torch.inference_mode():
+            return self.model(img, size=self.image_size)
+
+    def autotune_threads(self, img, runs=AUTOTUNE_RUNS):
+        '''
+            Times a forward pass for thread counts up to the number of cores and keeps the fastest
+        '''
+        cores = os.cpu_count() or 1
+        timings = {}
+        for threads in sorted({1, 2, 4, 6, 8, 12, 16, cores}):
+            if threads > cores:
+                continue
+            self.model.set_threads(threads)
+            self.forward(img)
+            samples = []
+            for _ in range(runs):
+                start_time = time.perf_counter()
+                self.forward(img)
+                samples.append(time.perf_counter() - start_time)
+            timings[threads] = sorted(samples)[len(samples) // 2]
+            print(f"[Inference] Autotune {threads} threads: {timings[threads] * 1000:.1f} ms")
+        best = min(timings, key=timings.get)
+        self.model.set_threads(best)
+        print(f"[Inference] Autotune picked {best} threads")
+        return best
 
     def run_inference(self, img_path, recognized_ids):
         print("------ Starting detection ------")
-        # default values
-        detected_img_id = "-1"
-        cords = []
-        thres = 0
-        bbox = []
-
         # Inference
-        self.model.to(self.device)
-        results = self.model(img_path)
-        
-        # get labels and coordinates
-        labels, cord_thres = results.xyxyn[0][:, -1].numpy(), results.xyxyn[0][:, :-1].numpy()
+        results = self.forward(img_path)
         
         # read image to get size of image
         img_taken = cv2.imread(img_path)
         x_shape, y_shape = img_taken.shape[1], img_taken.shape[0]
 
-        # if labels detected
-        if len(labels) > 0:
-            max_area = 0
-
-            # get bigger area
-            for idx, detected in enumerate(cord_thres):
-                # get coords 
-                x1, y1, x2, y2 = int(detected[0]*x_shape), int(detected[1]*y_shape), int(detected[2]*x_shape), int(detected[3]*y_shape)
-                bbox = [x1, y1, x2, y2]
-                # get area
-                x_len = abs(x2-x1)
-                y_len = abs(y2-y1)
-                area = x_len*y_len
-                # get label
-                curr_id = self.classes[int(labels[idx])]
-                
-                # if bigger than current, then reassign
-                if (area > max_area) and (curr_id not in recognized_ids) and (curr_id != "41"):
-                    thres = detected[-1]
-                    # only store if threshold bigger than 0.75
-                    if thres >= 0.75:
-                        max_area = area
-                        # get class
-                        detected_img_id = curr_id
-                        cords = detected
-        # if no labels detected
-        else:
-            detected_img_id = "-1"
-            cords = [] 
-        
+        return self.select(results, x_shape, y_shape, recognized_ids)
+
+    def detect(self, frame, recognized_ids):
+        '''
+            Same as run_inference, on a frame already in memory (BGR, as cv2 would write it to disk)
+        '''
+        print("------ Starting detection ------")
+        # Inference, model expects RGB
+        results = self.forward(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+        x_shape, y_shape = frame.shape[1], frame.shape[0]
+
+        return self.select(results, x_shape, y_shape, recognized_ids)
+
+    def detect_batch(self, frames, recognized_ids, letterboxes=None, cache=None, image_id=None):
+        '''
+            detect on a burst of frames (BGR) with one batched forward pass
+            letterboxes: per frame, metadata of the letterbox done on the RPi or None, results are mapped back to the captured frame
+            cache: FrameCache, frames close to one seen before for the same image_id reuse its detections instead of running the model
+            Returns the same as detect for the frame with the biggest valid detection, plus the index of that frame
+        '''
+        print(f"------ Starting detection on {len(frames)} frames ------")
+        letterboxes = letterboxes or [None] * len(frames)
+        keys = [cache.key(frame, image_id) for frame in frames] if cache is not None else []
+        # detections before the recognized ids filter, so cached ones stay valid as ids get recognized
+        detections_list = [cache.get(key) for key in keys] if cache is not None else [None] * len(frames)
+        missing = [index for index, detections in enumerate(detections_list) if detections is None]
+        if len(missing) < len(frames):
+            print(f"[Inference] Reused detections for {len(frames) - len(missing)} frame(s), cache: {cache.stats()}")
+
+        if missing:
+            results = self.forward([cv2.cvtColor(frames[index], cv2.COLOR_BGR2RGB) for index in missing])
+            for result_index, index in enumerate(missing):
+                detections = results.xyxyn[result_index].numpy()
+                if letterboxes[index] is not None:
+                    detections = unletterbox_boxes(detections, frames[index], letterboxes[index])
+                detections_list[index] = detections
+                if cache is not None:
+                    cache.put(keys[index], detections)
+        shapes = [original_shape(frame, letterbox) for frame, letterbox in zip(frames, letterboxes)]
+
+        # biggest candidate across the burst, first frame when nothing is found
+        best_index, best_area, ranked = 0, 0, []
+        for index, ((x_shape, y_shape), detections) in enumerate(zip(shapes, detections_list)):
+            boxes = self.pixel_boxes(detections, x_shape, y_shape)
+            order = self.rank(detections, boxes, recognized_ids)
+            ranked.append((boxes, order))
+            if len(order) > 0:
+                x1, y1, x2, y2 = boxes[order[0]]
+                area = abs(x2 - x1) * abs(y2 - y1)
+                if area > best_area:
+                    best_index, best_area = index, area
+
+        x_shape, y_shape = shapes[best_index]
+        return self.select_detections(detections_list[best_index], x_shape, y_shape, recognized_ids, ranked[best_index]) + (best_index,)
+
+    def pixel_boxes(self, detections, x_shape, y_shape):
+        # pixel coords, truncated like int()
+        return (detections[:, :4] * np.array([x_shape, y_shape, x_shape, y_shape])).astype(np.int64)
+
+    def rank(self, detections, boxes, recognized_ids):
+        # indices of the detections that can be the answer, biggest first
+        # conf >= 0.75, a non-empty box, and neither the bullseye nor already recognized
+        areas = np.abs(boxes[:, 2] - boxes[:, 0]) * np.abs(boxes[:, 3] - boxes[:, 1])
+        excluded = self.excluded_classes(recognized_ids)
+        keep = (detections[:, 4] >= 0.75) & (areas > 0) & ~excluded[detections[:, -1].astype(np.int64)]
+        # stable sort, equal areas keep the model's order
+        candidates = np.flatnonzero(keep)
+        return candidates[np.argsort(-areas[candidates], kind="stable")]
+
+    def excluded_classes(self, recognized_ids):
+        # one flag per class instead of comparing every detection's id, rebuilt only when recognized_ids changes
+        key = tuple(recognized_ids)
+        if key != self.excluded_key:
+            self.excluded_key = key
+            self.excluded = np.array([image_id == "41" or image_id in key for image_id in self.class_ids.tolist()])
+        return self.excluded
+
+    def select(self, results, x_shape, y_shape, recognized_ids, index=0):
+        # index: which image of the batch
+        return self.select_detections(results.xyxyn[index].numpy(), x_shape, y_shape, recognized_ids)
+
+    def select_detections(self, detections, x_shape, y_shape, recognized_ids, ranked=None):
+        # ranked: (boxes, order) already worked out for these detections
+        # default values
+        detected_img_id = "-1"
+        cords = []
+        bbox = []
+
+        if len(detections) > 0:
+            if ranked is None:
+                boxes = self.pixel_boxes(detections, x_shape, y_shape)
+                ranked = boxes, self.rank(detections, boxes, recognized_ids)
+            boxes, order = ranked
+            if len(order) > 0:
+                # get class of the biggest
+                detected_img_id = str(self.class_ids[int(detections[order[0], -1])])
+                cords = detections[order[0], :-1]
+            # box of the last detection, as before
+            bbox = boxes[-1].tolist()
+
         # return results
         return detected_img_id, cords, x_shape, y_shape, bbox
 
-    def draw_bounding(self, label, cord_thres, img_path, dir_path):
+    def draw_bounding(self, label, cord_thres, img, dir_path):
         id_dict = IMAGE_IDS
 
-        # read image
-        img_taken = cv2.imread(img_path)
+        # read image, or draw on a copy of the frame
+        img_taken = cv2.imread(img) if isinstance(img, str) else img.copy()
 
         # get x,y axes of bounding box
         x_shape, y_shape = img_taken.shape[1], img_taken.shape[0]
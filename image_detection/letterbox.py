@@ -0,0 +1,31 @@
+'''
+    Frames letterboxed on the RPi before sending (rpi/misc/image_codec.py), and mapping results back to the captured frame
+    letterbox metadata: {"gain": resize factor, "pad": [left, top] in pixels, "shape": [height, width] of the captured frame}
+'''
+import cv2
+import numpy as np
+
+def original_shape(frame, letterbox):
+    # (x_shape, y_shape) of the frame the RPi captured
+    if letterbox is None:
+        return frame.shape[1], frame.shape[0]
+    return letterbox["shape"][1], letterbox["shape"][0]
+
+def unletterbox_boxes(xyxyn, frame, letterbox):
+    # rows of (x1, y1, x2, y2, ...) normalised to the letterboxed frame -> normalised to the captured frame
+    xyxyn = np.array(xyxyn, dtype=np.float32)
+    left, top = letterbox["pad"]
+    height, width = letterbox["shape"]
+    gain = letterbox["gain"]
+    xyxyn[:, [0, 2]] = np.clip((xyxyn[:, [0, 2]] * frame.shape[1] - left) / gain, 0, width) / width
+    xyxyn[:, [1, 3]] = np.clip((xyxyn[:, [1, 3]] * frame.shape[0] - top) / gain, 0, height) / height
+    return xyxyn
+
+def restore_frame(frame, letterbox):
+    # crop the padding and scale back to the captured size, for saving and drawing
+    if letterbox is None:
+        return frame
+    left, top = letterbox["pad"]
+    height, width = letterbox["shape"]
+    new_w, new_h = round(width * letterbox["gain"]), round(height * letterbox["gain"])
+    return cv2.resize(frame[top:top + new_h, left:left + new_w], (width, height), interpolation=cv2.INTER_LINEAR)
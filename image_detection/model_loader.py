@@ -0,0 +1,235 @@
+import os
+import ast
+import json
+import torch
+import torchvision
+import cv2
+import numpy as np
+
+from config.config import CONF_THRES, IOU_THRES, MAX_DET, INFERENCE_IMAGE_SIZE
+
+class Detections:
+    '''
+        Minimal stand-in for yolov5's Detections, only xyxyn is used by Inference
+        xyxyn: one tensor per image, rows of (x1, y1, x2, y2, conf, cls) normalised to the image size
+    '''
+    def __init__(self, xyxyn):
+        self.xyxyn = xyxyn
+
+class Backend:
+    '''
+        Inference engine, called like the yolov5 hub model: backend(imgs, size) -> Detections
+        load: read the model and its class names
+        preprocess: images -> engine input, plus what postprocess needs to map boxes back
+        infer: engine input -> raw predictions
+        postprocess: raw predictions -> Detections
+    '''
+    def __init__(self, model_path, device='cpu', threads=None):
+        self.model_path = model_path
+        self.device = device
+        self.threads = threads
+        self.names = {}
+        self.load()
+
+    def load(self):
+        raise NotImplementedError
+
+    def preprocess(self, imgs, size):
+        raise NotImplementedError
+
+    def infer(self, inputs):
+        raise NotImplementedError
+
+    def postprocess(self, outputs, context):
+        raise NotImplementedError
+
+    def to(self, device):
+        self.device = device
+        return self
+
+    def set_threads(self, threads):
+        # intra-op threads, torch engines share the process-wide setting
+        torch.set_num_threads(threads)
+
+    def __call__(self, imgs, size=None):
+        inputs, context = self.preprocess(imgs, size)
+        return self.postprocess(self.infer(inputs), context)
+
+class PyTorchBackend(Backend):
+    '''
+        yolov5 checkpoint loaded through torch.hub, AutoShape does its own letterbox, NMS and scaling
+        Loads from a local yolov5 checkout (the hub cache by default) and only goes to GitHub without one
+    '''
+    def __init__(self, model_path, device='cpu', threads=None, yolov5_dir=None):
+        self.yolov5_dir = yolov5_dir or os.path.join(torch.hub.get_dir(), "ultralytics_yolov5_master")
+        super().__init__(model_path, device, threads)
+
+    def load(self):
+        if os.path.isdir(self.yolov5_dir):
+            self.model = torch.hub.load(self.yolov5_dir, 'custom', path=self.model_path, source='local')
+        else:
+            # no local copy, needs network
+            print(f"[Inference] No yolov5 code in {self.yolov5_dir}, downloading from GitHub")
+            self.model = torch.hub.load('ultralytics/yolov5', 'custom', path=self.model_path)
+        self.names = self.model.names
+
+    def to(self, device):
+        self.model.to(device)
+        return super().to(device)
+
+    def preprocess(self, imgs, size):
+        # AutoShape takes paths, arrays and lists of them as they are
+        return (imgs, size), None
+
+    def infer(self, inputs):
+        imgs, size = inputs
+        return self.model(imgs) if size is None else self.model(imgs, size=size)
+
+    def postprocess(self, outputs, context):
+        return outputs
+
+class ExportedBackend(Backend):
+    '''
+        Model exported with yolov5's export.py, does what AutoShape does around it: letterbox, NMS and scaling the boxes back
+        Subclasses load the model, set shape (height, width) and batch_size when the export fixes them, and run infer
+    '''
+    shape = None
+    batch_size = None
+
+    def preprocess(self, imgs, size):
+        # accept a path, an array or a list of them like the hub model, arrays are RGB
+        imgs = imgs if isinstance(imgs, list) else [imgs]
+        imgs = [cv2.cvtColor(cv2.imread(img), cv2.COLOR_BGR2RGB) if isinstance(img, str) else img for img in imgs]
+        # size only matters for exports with a dynamic input size
+        size = size or INFERENCE_IMAGE_SIZE
+        shape = self.shape or (size, size)
+        letterboxed = [self.letterbox(img, shape) for img in imgs]
+        x = np.stack([padded for padded, _, _ in letterboxed]).transpose(0, 3, 1, 2)
+        x = np.ascontiguousarray(x, dtype=np.float32) / 255
+        return x, [(img.shape, gain, pad) for img, (_, gain, pad) in zip(imgs, letterboxed)]
+
+    def chunks(self, x):
+        # the batch size can be fixed by the export, yield chunks of it and how many images each holds
+        # a short last chunk is padded, the padding's predictions are dropped
+        batch_size = self.batch_size or len(x)
+        for start in range(0, len(x), batch_size):
+            chunk = x[start:start + batch_size]
+            count = len(chunk)
+            if count < batch_size:
+                chunk = np.concatenate((chunk, np.zeros((batch_size - count,) + chunk.shape[1:], dtype=chunk.dtype)))
+            yield chunk, count
+
+    def postprocess(self, pred, context):
+        return Detections([self.normalise(self.nms(pred[index]), gain, pad, img_shape)
+                           for index, (img_shape, gain, pad) in enumerate(context)])
+
+    def letterbox(self, img, shape):
+        # resize keeping the aspect ratio, pad the rest with grey
+        height, width = shape
+        gain = min(height / img.shape[0], width / img.shape[1])
+        new_w, new_h = round(img.shape[1] * gain), round(img.shape[0] * gain)
+        pad_w, pad_h = (width - new_w) / 2, (height - new_h) / 2
+        # frames letterboxed on the RPi already have the input size
+        resized = img if (new_w, new_h) == (img.shape[1], img.shape[0]) else cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = round(pad_h - 0.1), round(pad_h + 0.1)
+        left, right = round(pad_w - 0.1), round(pad_w + 0.1)
+        padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return np.ascontiguousarray(padded), gain, (left, top)
+
+    def nms(self, pred):
+        # pred rows: cx, cy, w, h, objectness, class scores...
+        pred = pred[pred[:, 4] > CONF_THRES]
+        scores = pred[:, 5:] * pred[:, 4:5]
+        conf, cls = scores.max(1)
+        keep = conf > CONF_THRES
+        pred, conf, cls = pred[keep], conf[keep], cls[keep]
+        boxes = torch.cat((pred[:, :2] - pred[:, 2:4] / 2, pred[:, :2] + pred[:, 2:4] / 2), 1)
+        # offset boxes by class so classes are suppressed separately
+        keep = torchvision.ops.nms(boxes + cls[:, None].float() * 4096, conf, IOU_THRES)[:MAX_DET]
+        return torch.cat((boxes[keep], conf[keep, None], cls[keep, None].float()), 1)
+
+    def normalise(self, boxes, gain, pad, img_shape):
+        height, width = img_shape[:2]
+        boxes = boxes.cpu()
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / gain).clamp(0, width) / width
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / gain).clamp(0, height) / height
+        return boxes
+
+class TorchScriptBackend(ExportedBackend):
+    '''
+        `export.py --include torchscript`, needs neither the yolov5 code nor network access
+    '''
+    def load(self):
+        extra_files = {'config.txt': ''}
+        self.model = torch.jit.load(self.model_path, _extra_files=extra_files, map_location=self.device)
+        self.model.eval()
+        config = json.loads(extra_files['config.txt'])
+        # traced input shape (batch, channels, height, width), the model only supports this size
+        self.batch_size = config['shape'][0]
+        self.shape = config['shape'][2:]
+        self.stride = int(config['stride'])
+        # json turns the class index keys into strings
+        names = config['names']
+        self.names = {int(key): name for key, name in names.items()} if isinstance(names, dict) else names
+
+    def to(self, device):
+        self.model.to(device)
+        return super().to(device)
+
+    def infer(self, x):
+        preds = []
+        with torch.no_grad():
+            for chunk, count in self.chunks(x):
+                pred = self.model(torch.from_numpy(chunk).to(self.device))
+                preds.append((pred[0] if isinstance(pred, (list, tuple)) else pred)[:count])
+        return torch.cat(preds)
+
+class OnnxBackend(ExportedBackend):
+    '''
+        `export.py --include onnx` run by ONNX Runtime on the CPU, needs the onnxruntime package
+    '''
+    def load(self):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # dynamic axes are names instead of numbers
+        batch_size, _, height, width = model_input.shape
+        self.batch_size = batch_size if isinstance(batch_size, int) else None
+        self.shape = [height, width] if isinstance(height, int) and isinstance(width, int) else None
+        # export.py stores stride and names as strings in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.stride = int(metadata.get('stride', 32))
+        names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        self.names = dict(enumerate(names)) if isinstance(names, list) else names
+
+    def set_threads(self, threads):
+        # the session owns its thread pool, rebuild it with the new size
+        self.threads = threads
+        self.load()
+
+    def infer(self, x):
+        preds = [self.session.run(None, {self.input_name: chunk})[0][:count] for chunk, count in self.chunks(x)]
+        return torch.from_numpy(np.concatenate(preds))
+
+BACKENDS = {
+    "pytorch": PyTorchBackend,
+    "torchscript": TorchScriptBackend,
+    "onnx": OnnxBackend,
+}
+
+def load_model(model_path, backend=None, device='cpu', threads=None):
+    '''
+        Loads the detector with the given backend, picked from the file extension when not given
+        .torchscript: TorchScript, .onnx: ONNX Runtime, otherwise the PyTorch checkpoint through yolov5's hub code
+    '''
+    if backend is None:
+        extension = os.path.splitext(model_path)[1]
+        backend = {".torchscript": "torchscript", ".onnx": "onnx"}.get(extension, "pytorch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    print(f"[Inference] Loading {model_path} with the {backend} backend")
+    return BACKENDS[backend](model_path, device=device, threads=threads)
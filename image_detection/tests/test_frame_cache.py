@@ -0,0 +1,45 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# like the image server: the repo root and image_detection/ are importable
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "image_detection")]
+
+from image_detection.utils.frame_cache import FrameCache
+
+def scene(symbol, seed=0):
+    # the same cluttered background every time, a small white card with the symbol in the middle
+    rng = np.random.default_rng(seed)
+    frame = np.zeros((480, 640, 3), np.uint8)
+    frame[:] = np.linspace(60, 140, 640, dtype=np.uint8)[None, :, None]
+    for _ in range(30):
+        x, y = rng.integers(0, 640, dtype=int), rng.integers(0, 480, dtype=int)
+        cv2.circle(frame, (int(x), int(y)), int(rng.integers(10, 40)), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    cv2.rectangle(frame, (290, 210), (350, 270), (255, 255, 255), -1)
+    cv2.putText(frame, symbol, (300, 262), cv2.FONT_HERSHEY_SIMPLEX, 1.8, (0, 0, 0), 4)
+    return frame
+
+def noisy(frame, seed=1):
+    noise = np.random.default_rng(seed).integers(-12, 13, frame.shape)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def test_distinct_symbols_on_same_background_do_not_collide():
+    cache = FrameCache()
+    for first, second in [("1", "7"), ("3", "8"), ("A", "B"), ("0", "O"), ("C", "G")]:
+        cache.clear()
+        cache.put(cache.key(scene(first), "5"), first)
+        assert cache.get(cache.key(scene(second), "5")) is None
+
+def test_same_scene_with_sensor_noise_hits():
+    cache = FrameCache()
+    cache.put(cache.key(scene("7"), "5"), "7")
+    assert cache.get(cache.key(noisy(scene("7")), "5")) == "7"
+
+def test_other_image_id_never_hits():
+    cache = FrameCache()
+    cache.put(cache.key(scene("7"), "5"), "7")
+    assert cache.get(cache.key(scene("7"), "6")) is None
+    assert cache.misses == 1
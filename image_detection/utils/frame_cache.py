@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+
+from config.config import FRAME_CACHE_SIZE, FRAME_CACHE_THRESHOLD, FRAME_THUMBNAIL_SIZE, FRAME_THUMBNAIL_CROP
+
+class FrameCache:
+    '''
+        Detections of recently seen frames, so a near-identical frame (a retry where the scene hasn't changed) skips the model
+        Keyed by the image id of the request and a grayscale thumbnail of the frame's centre, where the symbol is
+        An entry of the same image id whose thumbnail is nowhere off by more than threshold grey levels is a hit
+        The least recently used entry is dropped once there are more than max_size
+    '''
+    def __init__(self, max_size=FRAME_CACHE_SIZE, threshold=FRAME_CACHE_THRESHOLD, thumbnail_size=FRAME_THUMBNAIL_SIZE, crop=FRAME_THUMBNAIL_CROP):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.crop = crop
+        # (image id, thumbnail bytes) -> detections, oldest first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, frame, image_id=None):
+        # thumbnail_size x thumbnail_size averages of the centre crop
+        # the whole frame is mostly background, there two cards on the same one barely differ
+        height, width = frame.shape[:2]
+        top, left = int(height * (1 - self.crop) / 2), int(width * (1 - self.crop) / 2)
+        # every 2nd pixel still leaves several per thumbnail pixel
+        gray = cv2.cvtColor(np.ascontiguousarray(frame[top:height - top:2, left:width - left:2]), cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (self.thumbnail_size, self.thumbnail_size), interpolation=cv2.INTER_AREA)
+        return image_id, small.tobytes()
+
+    def get(self, key):
+        # closest entry of the same image id within the threshold
+        image_id, thumbnail = key
+        thumbnail = np.frombuffer(thumbnail, dtype=np.uint8).astype(np.int16)
+        best, best_distance = None, self.threshold + 1
+        for cached in self.entries:
+            if cached[0] != image_id:
+                continue
+            # largest difference, sensor noise averages out in a thumbnail pixel while a different symbol stands out
+            distance = np.abs(np.frombuffer(cached[1], dtype=np.uint8) - thumbnail).max()
+            if distance < best_distance:
+                best, best_distance = cached, distance
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(best)
+        return self.entries[best]
+
+    def put(self, key, detections):
+        self.entries[key] = detections
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), {len(self.entries)} cached"
@@ -0,0 +1,39 @@
+import queue
+import threading
+
+from image_detection.config.config import IMAGE_WRITER_QUEUE_SIZE
+
+class ImageWriter:
+    '''
+        Background thread for disk work (saving frames, drawing bounding boxes)
+        submit() blocks once the queue is full, so a slow disk slows the server down instead of using up memory
+    '''
+    def __init__(self, max_size=IMAGE_WRITER_QUEUE_SIZE):
+        self.tasks = queue.Queue(maxsize=max_size)
+        self.thread = threading.Thread(target=self.run, name="[Image Writer]", daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args):
+        self.tasks.put((function, args))
+
+    # wait until every submitted task is done
+    def flush(self):
+        self.tasks.join()
+
+    def close(self):
+        self.flush()
+        self.tasks.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                function, args = task
+                function(*args)
+            except Exception as e:
+                print("[Image Writer] Failed to write image:", e)
+            finally:
+                self.tasks.task_done()
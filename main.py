@@ -1,11 +1,32 @@
-from rpi.etc import image_server
+import argparse
+
+from rpi.etc import image_server, image_broker
 from image_detection.utils import correction_helper
+from image_detection.config.config import INFERENCE_DEVICE, INFERENCE_THREADS, INTEROP_THREADS, INFERENCE_IMAGE_SIZE, INFERENCE_BACKEND, CHECKPOINTS, IMAGE_SERVER_WORKERS
+
+parser = argparse.ArgumentParser(description="Image Processing Server")
+parser.add_argument( '--backend', type=str, default=INFERENCE_BACKEND, required=False, choices=CHECKPOINTS.keys())
+parser.add_argument( '--device', type=str, default=INFERENCE_DEVICE, required=False,)
+parser.add_argument( '--threads', type=int, default=INFERENCE_THREADS, required=False,)
+parser.add_argument( '--interop_threads', type=int, default=INTEROP_THREADS, required=False,)
+parser.add_argument( '--img_size', type=int, default=INFERENCE_IMAGE_SIZE, required=False,)
+parser.add_argument( '--autotune', action='store_true', required=False,)
+parser.add_argument( '--workers', type=int, default=IMAGE_SERVER_WORKERS, required=False,)
 
 if __name__ == "__main__":
-    # start up server
-    image_hub = image_server.ImageProcessingServer()
+    args = parser.parse_args()
+    server_options = dict(
+        backend=args.backend,
+        device=args.device,
+        threads=args.threads,
+        interop_threads=args.interop_threads,
+        image_size=args.img_size,
+        autotune=args.autotune,
+        )
+    # start up server, several workers run behind a broker
+    if args.workers > 1:
+        image_hub = image_broker.ImageBroker(args.workers, **server_options)
+    else:
+        image_hub = image_server.ImageProcessingServer(**server_options)
     # # once completed, open up window displaying results
     image_hub.start()
-
-
-
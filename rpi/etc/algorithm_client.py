@@ -4,7 +4,8 @@ Testing Algorithm Socket Only - Not used in production.
 import queue
 import socket
 import threading
-from misc.config import FORMAT, ALGO_SOCKET_BUFFER_SIZE, WIFI_IP, PORT
+from misc.framing import FrameCodec
+from misc.config import FORMAT, ALGO_SOCKET_BUFFER_SIZE, ALGO_FRAMING, WIFI_IP, PORT
 
 class AlgoClient:
 
@@ -12,6 +13,7 @@ class AlgoClient:
         print("[Algo Client] Initilising Algo Client")
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client.connect((WIFI_IP, PORT))
+        self.codec = FrameCodec(ALGO_FRAMING)
         # self.incoming_message_queue = queue.Queue()
         self.message_sender = threading.Thread(target=self.message_sender_thread)
         self.message_receiver = threading.Thread(target=self.message_receiver_thread)
@@ -29,7 +31,7 @@ class AlgoClient:
                 message = msg.encode(FORMAT)
                 # Pad to Socket buffer size
                 #message += (ALGO_SOCKET_BUFFER_SIZE - len(message)) * b' ' 
-                self.client.send(message)
+                self.client.sendall(self.codec.encode(message))
                 print(f"[Algo Client] Message Sent: {msg}")
             except Exception as e:
                 print(e)
@@ -37,8 +39,9 @@ class AlgoClient:
     def message_receiver_thread(self) -> None:
         while True:
             try:
-                message = self.client.recv(ALGO_SOCKET_BUFFER_SIZE).decode(FORMAT)
-                print(message)
+                self.codec.feed(self.client.recv(ALGO_SOCKET_BUFFER_SIZE))
+                while self.codec.messages:
+                    print(self.codec.next().decode(FORMAT))
             except Exception as e:
                 print(e)
 
@@ -0,0 +1,153 @@
+"""
+Microbenchmark for message routing - Not used in production.
+Compares the old split-and-compare routing against the Router dispatch tables, in messages/sec.
+Both log through misc/logger.py at the same level (--log_level), the records go to os.devnull.
+Run from rpi/: python -m etc.benchmark_dispatch [--traffic FILE] [--repeat N] [--log_level info]
+FILE holds one recorded message per line, e.g. copied from the [Main] logs.
+"""
+import os
+import time
+import argparse
+
+from misc import logger
+from misc.config import LOG_LEVEL
+from misc.protocols import *
+from src.router import Router, log
+from src.robot_state import RobotState
+
+# Synthetic traffic in the shape of an exploration run, not a recording (use --traffic for one):
+# a START, manual moves and a STOP, a path with its ROBOT positions, and messages that are not forwarded
+# (STATUS/READY, DEBUG/...) to cover the fall-through path.
+SAMPLE_TRAFFIC = {
+    "android": [
+        b"START/EXPLORE/(R,02,02,0)/(00,10,09,0)/(01,16,03,90)/(02,05,15,180)/(03,15,15,-90)",
+        b"MOVE/F",
+        b"MOVE/BR",
+        b"STOP",
+        b"STATUS/READY",
+    ],
+    "algorithm": [
+        b"MOVEMENTS/10-9/B,B,B,FL,F,F,F,F,F,FL,B,B,F,F,F,BR,F,F,F",
+        b"ROBOT/10-9/(11.0, 2.0, -90)/(10.0, 2.0, -90)/(9.0, 2.0, -90)/(12.0, 5.0, 0)/(12.0, 6.0, 0)/(12.0, 7.0, 0)/(12.0, 8.0, 0)/(12.0, 9.0, 0)/(12.0, 10.0, 0)/(9.0, 13.0, 90)/(10.0, 13.0, 90)/(11.0, 13.0, 90)/(10.0, 13.0, 90)/(9.0, 13.0, 90)/(8.0, 13.0, 90)/(11.0, 16.0, 180)/(11.0, 15.0, 180)/(11.0, 14.0, 180)/(11.0, 13.0, 180)",
+        b"DEBUG/path planned",
+        b"OBSTACLE/3",
+    ],
+}
+
+class Sink:
+    # Stands in for the message queues.
+    def __init__(self) -> None:
+        self.count = 0
+
+    def put_nowait(self, message) -> None:
+        self.count += 1
+
+class BenchmarkRouter(Router):
+    def __init__(self) -> None:
+        self.stm = self.android = self.algorithm = True
+        self.state = RobotState()
+        self.to_stm_message_queue = Sink()
+        self.to_android_message_queue = Sink()
+        self.to_algo_message_queue = Sink()
+        self.build_dispatch_tables()
+
+    def restart_explore(self) -> None:
+        pass
+
+    def capture_obstacle(self, obstacle_id) -> None:
+        pass
+
+    """
+    Routing before the dispatch tables, kept here as the baseline.
+    Its prints are the Router's log calls and it keeps the same RobotState, so only the routing differs.
+    """
+    def legacy_android(self, message: bytes) -> None:
+        if not len(message):
+            return
+        if message in AndroidToSTM.MESSAGES:
+            if self.stm is None:
+                log.warning("No Forwarding, as STM is not set-up.")
+                return
+            self.state.mode = 0
+            self.to_stm_message_queue.put_nowait(AndroidToSTM.MESSAGES[message])
+            return
+        elif message == AndroidToRPI.STOP:
+            self.restart_explore()
+            return
+        message_list = message.split(SLASH_SEPARATOR)
+        if len(message_list) > 1 and message_list[0] == AndroidToRPI.START and message_list[1] == AndroidToAlgorithm.EXPLORE:
+            if self.algorithm is None:
+                log.warning("No Forwarding, as Algo is not set-up.")
+                return
+            log.info("=============== Starting Exploration ===============")
+            self.state.mode = 1
+            self.state.image_count = len(message_list) - 3
+            self.to_algo_message_queue.put_nowait(ANDROID_HEADER + message)
+        else:
+            log.warning("No Forwarding : Message from Android: %s", message)
+
+    def legacy_algorithm(self, raw: bytes) -> None:
+        message = raw.split(SLASH_SEPARATOR)
+        if message[0] in AlgorithmToSTM.MESSAGES:
+            if self.stm is None:
+                log.warning("No forwarding, as STM is not set-up.")
+                return
+            if message[0] == AlgorithmToSTM.MOVEMENTS:
+                self.state.obstacle = message[1]
+                log.info("Current Target Obstacle: %s", message[1])
+                self.to_stm_message_queue.put_nowait(message[2].split(COMMA_SEPARATOR))
+            else:
+                log.warning("Algorithm To STM Command Type not recognised.")
+        elif message[0] in AlgorithmToAndroid.MESSAGES:
+            if self.android is None:
+                log.warning("No forwarding, as Android is not set-up.")
+                return
+            if message[0] == AlgorithmToAndroid.ROBOT:
+                self.state.target = message[-1]
+                self.to_android_message_queue.put_nowait(AND_HEADER + ALGORITHM_HEADER + raw)
+        elif message[0] == AlgorithmToRPI.OBSTACLE:
+            self.capture_obstacle(message[1])
+        else:
+            log.warning("No forwarding, command not recognised.")
+
+def measure(route, messages: list, repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            route(message)
+    return repeat * len(messages) / (time.perf_counter() - start_time)
+
+def load_traffic(path: str) -> dict:
+    # Algorithm messages are recognised by their header, everything else came from Android.
+    algorithm_headers = tuple(AlgorithmToSTM.MESSAGES) + tuple(AlgorithmToAndroid.MESSAGES) + tuple(AlgorithmToRPI.MESSAGES)
+    traffic = {"android": [], "algorithm": []}
+    with open(path, "rb") as file:
+        for line in file:
+            message = line.strip()
+            if len(message) > 0:
+                traffic["algorithm" if message.startswith(algorithm_headers) else "android"].append(message)
+    return traffic
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Routing microbenchmark")
+    parser.add_argument('--traffic', type=str, default=None, required=False)
+    parser.add_argument('--repeat', type=int, default=20000, required=False)
+    parser.add_argument('--log_level', type=str.upper, default=LOG_LEVEL, required=False, choices=list(logger.LEVEL.BY_NAME))
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic) if args.traffic is not None else SAMPLE_TRAFFIC
+    # Same logging for both, written to os.devnull to keep the console quiet while measuring.
+    logger.set_level(args.log_level)
+    logger.buffer.path = os.devnull
+
+    router = BenchmarkRouter()
+    results = {
+        "android": (measure(router.legacy_android, traffic["android"], args.repeat),
+                    measure(router.handle_android_message, traffic["android"], args.repeat)),
+        "algorithm": (measure(router.legacy_algorithm, traffic["algorithm"], args.repeat),
+                      measure(router.handle_algorithm_message, traffic["algorithm"], args.repeat)),
+    }
+    router.state.close(unlink=True)
+    logger.flush()
+    for link, (before, after) in results.items():
+        print(f"[Benchmark] {link}: before {before:,.0f} msg/s, after {after:,.0f} msg/s ({after / before:.2f}x)")
@@ -0,0 +1,181 @@
+"""
+Image server latency benchmark - Not used in production.
+Runs the frames in the given directories through ImageProcessingServer's request path, the same calls as start()
+without the socket, and times every stage of each request:
+  decode: frame as sent by the RPi (raw or JPEG, optionally letterboxed) back to an array
+  preprocess, forward, postprocess: the inference backend's own steps (AutoShape does its pre and post inside forward)
+  selection: the rest of detect_batch, colour conversion, frame cache, picking the detection
+  correction: distance from the bounding box (CorrectionHelper)
+  annotation: saving the frames and drawing the bounding box, normally on the image writer thread
+Reports p50/p95/p99/mean per stage and requests per second, --json writes them out, --baseline compares with an earlier run.
+Recognized ids are cleared before every request so each one goes through the whole path.
+Run from the repository root: python -m rpi.etc.benchmark_server [--images rpi/etc/images image_detection/utils/images]
+    [--backend torchscript] [--transport jpeg] [--letterbox 640] [--burst 3] [--repeat 5] [--json results.json]
+"""
+import os
+import io
+import time
+import json
+import argparse
+import tempfile
+import contextlib
+import cv2
+import numpy as np
+
+from rpi.misc.config import *
+from rpi.misc.image_codec import TRANSPORTS, encode_jpeg, letterbox, decode_frame
+from rpi.etc.image_server import ImageProcessingServer
+from image_detection.config.config import INFERENCE_DEVICE, INFERENCE_THREADS, INFERENCE_IMAGE_SIZE, INFERENCE_BACKEND, CHECKPOINTS
+
+STAGES = ("decode", "preprocess", "forward", "postprocess", "selection", "correction", "annotation")
+
+def load_frames(directories: list) -> list:
+    paths = []
+    for directory in directories:
+        paths += sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+    return [cv2.imread(path) for path in paths]
+
+# What the RPi's ImageClient puts on the wire for a frame: metadata and buffer.
+def encode(frame: np.ndarray, transport: str, quality: int, size: int) -> tuple:
+    metadata = {}
+    if size > 0:
+        frame, metadata["letterbox"] = letterbox(frame, size)
+    if transport == "jpeg":
+        return metadata, encode_jpeg(frame, quality).tobytes()
+    metadata.update(dtype=str(frame.dtype), shape=frame.shape)
+    return metadata, frame.tobytes()
+
+# Wraps a method so the time spent in it is added to timings[stage].
+def timed(timings: dict, stage: str, function):
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start_time
+    return wrapper
+
+def run_request(server: ImageProcessingServer, timings: dict, request: list) -> None:
+    start_time = time.perf_counter()
+    frames = [decode_frame(metadata, buffer) for metadata, buffer in request]
+    letterboxes = [metadata.get("letterbox") for metadata, _ in request]
+    if all(box is None for box in letterboxes):
+        letterboxes = None
+    timings["decode"] += time.perf_counter() - start_time
+
+    server.recognized_ids[:] = []
+    start_time = time.perf_counter()
+    server.handle_request("benchmark", frames, letterboxes)
+    timings["correction"] += time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    server.save_images("benchmark", "benchmark", frames, server.frame_index, server.label, server.cord_thres, letterboxes)
+    timings["annotation"] += time.perf_counter() - start_time
+
+def measure(server: ImageProcessingServer, requests: list, repeat: int) -> tuple:
+    timings = dict.fromkeys(STAGES + ("batch",), 0.0)
+    model = server.inf.model
+    # Instance attributes shadow the methods, Backend.__call__ and detect_batch pick them up.
+    model.preprocess = timed(timings, "preprocess", model.preprocess)
+    model.infer = timed(timings, "forward", model.infer)
+    model.postprocess = timed(timings, "postprocess", model.postprocess)
+    server.inf.detect_batch = timed(timings, "batch", server.inf.detect_batch)
+
+    # One request first, the first pass of each stage allocates.
+    run_request(server, timings, requests[0])
+    samples = {stage: [] for stage in STAGES + ("total",)}
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for request in requests:
+            for stage in timings:
+                timings[stage] = 0.0
+            run_request(server, timings, request)
+            # Stages nested in another one are taken out of it.
+            timings["selection"] = timings["batch"] - timings["preprocess"] - timings["forward"] - timings["postprocess"]
+            timings["correction"] -= timings["batch"]
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+            samples["total"].append(sum(timings[stage] for stage in STAGES))
+    return samples, time.perf_counter() - start_time
+
+def summarise(samples: dict, elapsed: float) -> dict:
+    stats = {}
+    for stage, values in samples.items():
+        values = np.array(values) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        stats[stage] = {
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "mean_ms": float(values.mean()),
+            # requests per second if this stage was all there was
+            "throughput": float(len(values) / max(values.sum() / 1000, 1e-9)),
+        }
+    stats["total"]["throughput"] = len(samples["total"]) / elapsed
+    return stats
+
+def report(stats: dict, baseline: dict = None) -> None:
+    print(f"[Benchmark] {'stage':>11}  {'p50':>8}  {'p95':>8}  {'p99':>8}  {'mean':>8}  {'req/s':>8}" + ("  p50 vs baseline" if baseline else ""))
+    for stage, stage_stats in stats.items():
+        line = (f"[Benchmark] {stage:>11}  {stage_stats['p50_ms']:8.2f}  {stage_stats['p95_ms']:8.2f}  {stage_stats['p99_ms']:8.2f}  "
+                f"{stage_stats['mean_ms']:8.2f}  {stage_stats['throughput']:8.1f}")
+        if baseline and stage in baseline:
+            before = baseline[stage]["p50_ms"]
+            change = (stage_stats["p50_ms"] - before) / before * 100 if before else 0.0
+            line += f"  {before:8.2f} ms ({change:+.0f}%)"
+        print(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Image server latency benchmark")
+    parser.add_argument('--images', type=str, nargs='+', default=["rpi/etc/images", "image_detection/utils/images"], required=False)
+    parser.add_argument('--backend', type=str, default=INFERENCE_BACKEND, required=False, choices=CHECKPOINTS.keys())
+    parser.add_argument('--model', type=str, default=None, required=False) # Model file other than the backend's checkpoint.
+    parser.add_argument('--device', type=str, default=INFERENCE_DEVICE, required=False,)
+    parser.add_argument('--threads', type=int, default=INFERENCE_THREADS, required=False,)
+    parser.add_argument('--img_size', type=int, default=INFERENCE_IMAGE_SIZE, required=False,)
+    parser.add_argument('--transport', type=str, default=IMAGE_TRANSPORT, required=False, choices=TRANSPORTS)
+    parser.add_argument('--quality', type=int, default=JPEG_QUALITY, required=False,)
+    parser.add_argument('--letterbox', type=int, default=IMAGE_LETTERBOX, required=False,)
+    parser.add_argument('--burst', type=int, default=IMAGE_BURST_FRAMES, required=False,)
+    parser.add_argument('--repeat', type=int, default=3, required=False,)
+    parser.add_argument('--cache', action='store_true', required=False,) # Keep the frame cache, repeats then hit it.
+    parser.add_argument('--verbose', action='store_true', required=False,) # Keep the server's prints.
+    parser.add_argument('--json', type=str, default=None, required=False,)
+    parser.add_argument('--baseline', type=str, default=None, required=False,) # --json output of an earlier run.
+    args = parser.parse_args()
+
+    frames = load_frames(args.images)
+    # Consecutive frames make up a burst, like the RPi's retries at one obstacle.
+    requests = [[encode(frame, args.transport, args.quality, args.letterbox) for frame in frames[start:start + args.burst]]
+                for start in range(0, len(frames), args.burst)]
+    print(f"[Benchmark] {len(frames)} frames in {len(requests)} requests of up to {args.burst}, "
+          f"{args.transport}{'' if args.transport == 'raw' else f' q{args.quality}'}"
+          f"{f', letterboxed to {args.letterbox}' if args.letterbox else ''}, {args.repeat} runs")
+
+    # Any free port, nothing connects to it.
+    server = ImageProcessingServer(args.backend, open_port='tcp://127.0.0.1:*', model_path=args.model,
+                                   device=args.device, threads=args.threads, image_size=args.img_size)
+    if not args.cache:
+        server.cache = None
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        # Saved and annotated frames go to a scratch directory.
+        server.dir_path = dir_path
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            samples, elapsed = measure(server, requests, args.repeat)
+    server.writer.close()
+
+    stats = summarise(samples, elapsed)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["stages"]
+    report(stats, baseline)
+    if server.cache is not None:
+        print(f"[Benchmark] Frame cache: {server.cache.stats()}")
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump({"config": vars(args), "frames": len(frames), "requests": len(samples["total"]), "stages": stats}, file, indent=2)
+        print(f"[Benchmark] Results written to {args.json}")
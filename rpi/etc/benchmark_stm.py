@@ -0,0 +1,114 @@
+"""
+STM link benchmark against the simulator - Not used in production.
+Drives STM and STMFlowControl the way send_to_stm / recv_from_stm do, against etc/stm_simulator.py on a pty in this process:
+  throughput: commands per second and command-to-DONE latency, the board taking --sim_delay per command
+  ack handling: the same with --drop of the DONEs lost, counting watchdog timeouts and commands released without DONE
+  reconnection: the board hangs up, time until the port is reopened and the next command is acknowledged
+Run from rpi/: python -m etc.benchmark_stm [--commands 200] [--command_delay 0] [--sim_delay 0.005] [--drop 0.1] [--reconnects 5]
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from misc.config import *
+from misc.protocols import STM_PROTOCOL
+from src.stm import STM
+from src.flow_control import STMFlowControl
+from etc.stm_simulator import STMSimulator
+
+# Setup, straight and turn commands, as sent during exploration.
+COMMANDS = [b"I0900x0100", b"P1200x2100", b"W0013x0000", b"I0900x0100", b"P1200x2300", b"S0013x0000", b"Q0122x2620"]
+
+# recv_from_stm, on a thread until stop is set.
+def recv_loop(stm: STM, flow: STMFlowControl, stop: threading.Event) -> None:
+    while not stop.is_set():
+        if stm.recv() == STM_PROTOCOL.DONE:
+            flow.acknowledge()
+
+def start_recv(stm: STM, flow: STMFlowControl) -> tuple:
+    stop = threading.Event()
+    thread = threading.Thread(target=recv_loop, args=(stm, flow, stop), daemon=True)
+    thread.start()
+    return thread, stop
+
+def stop_recv(thread: threading.Thread, stop: threading.Event) -> None:
+    stop.set()
+    thread.join()
+
+def run_commands(stm: STM, flow: STMFlowControl, count: int) -> tuple:
+    latencies, released = [], 0
+    start_time = time.perf_counter()
+    for index in range(count):
+        sent_at = time.perf_counter()
+        if not flow.send(stm, COMMANDS[index % len(COMMANDS)]):
+            released += 1
+        latencies.append(time.perf_counter() - sent_at - flow.command_delay)
+    return time.perf_counter() - start_time, sorted(latencies), released
+
+def report(name: str, count: int, elapsed: float, latencies: list) -> None:
+    p50, p99 = latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"[Benchmark] {name}: {count} commands in {elapsed:.2f}s, {count / elapsed:.1f} commands/s, "
+          f"DONE after p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="STM link benchmark against the simulator")
+    parser.add_argument('--commands', type=int, default=200, required=False,)
+    parser.add_argument('--command_delay', type=float, default=0.0, required=False,) # STM_COMMAND_DELAY on the robot.
+    parser.add_argument('--sim_delay', type=float, default=0.005, required=False,) # Seconds the board takes per command.
+    parser.add_argument('--jitter', type=float, default=STM_SIMULATOR_JITTER, required=False,)
+    parser.add_argument('--drop', type=float, default=0.1, required=False,)
+    parser.add_argument('--ack_timeout', type=float, default=0.5, required=False,)
+    parser.add_argument('--reconnects', type=int, default=5, required=False,)
+    args = parser.parse_args()
+
+    link = os.path.join(tempfile.mkdtemp(), "stm-sim")
+    delays = {command_type: args.sim_delay for command_type in STM_SIMULATOR_DELAYS}
+    simulator = STMSimulator(link, delays, args.jitter, seed=0)
+    simulator.open()
+    stop_simulator = threading.Event()
+    threading.Thread(target=simulator.serve, args=(stop_simulator,), daemon=True).start()
+
+    stm = STM([link])
+    stm.connect()
+    flow = STMFlowControl(ack_timeout=args.ack_timeout, command_delay=args.command_delay)
+    recv = start_recv(stm, flow)
+
+    # Throughput, every DONE arrives.
+    elapsed, latencies, _ = run_commands(stm, flow, args.commands)
+    report("throughput", args.commands, elapsed, latencies)
+
+    # Ack handling, the watchdog resends setup commands and releases the rest.
+    simulator.drop = args.drop
+    elapsed, latencies, released = run_commands(stm, flow, args.commands)
+    report(f"{args.drop:.0%} DONE lost", args.commands, elapsed, latencies)
+    print(f"[Benchmark] {simulator.dropped} DONE lost, {flow.timeouts.value} watchdog timeouts, {released} commands released without DONE")
+    simulator.drop = 0.0
+
+    # Reconnection, like reconnect_stm: stop reading, reopen the port, read again.
+    reconnects = []
+    for _ in range(args.reconnects):
+        stop_recv(*recv)
+        disconnects = simulator.disconnects
+        simulator.hangup_requested.set()
+        while simulator.disconnects == disconnects:
+            time.sleep(0.01)
+        start_time = time.perf_counter()
+        stm.disconnect()
+        stm.connect()
+        recv = start_recv(stm, flow)
+        flow.reset()
+        flow.send(stm, COMMANDS[0])
+        reconnects.append(time.perf_counter() - start_time)
+    if reconnects:
+        print(f"[Benchmark] reconnection: {len(reconnects)} times, mean {sum(reconnects) / len(reconnects) * 1000:.1f} ms, "
+              f"max {max(reconnects) * 1000:.1f} ms until the first DONE")
+
+    stop_recv(*recv)
+    stm.disconnect()
+    stop_simulator.set()
+    flow.histogram.report()
+    simulator.report()
+    shutil.rmtree(os.path.dirname(link))
@@ -0,0 +1,74 @@
+"""
+Transport benchmark for camera frames - Not used in production.
+Sends the frames in etc/images raw and as JPEG at several qualities, reports bytes on the wire and round trip latency.
+Without --server a local hub on this machine decodes the frames and replies, so only encode/decode/copy costs show up;
+--bandwidth adds the time the frame would take on a Wi-Fi link of that many Mbit/s.
+Run from rpi/: python -m etc.benchmark_transport [--server tcp://192.168.12.29:5555] [--qualities 50 70 90]
+"""
+import time
+import argparse
+import json
+import threading
+import zmq
+
+from misc.config import *
+from misc.image_codec import decode_frame
+from src.camera import FileCameraBackend
+from src.image_client import ImageClient
+
+LOCAL_HUB = "tcp://127.0.0.1:5599"
+
+# Stands in for the Image Processing Server: decode the frame and reply NIL.
+def local_hub(stop: threading.Event) -> None:
+    context = zmq.Context()
+    socket = context.socket(zmq.ROUTER)
+    socket.bind(LOCAL_HUB)
+    while not stop.is_set():
+        if not socket.poll(100):
+            continue
+        identity, delimiter, metadata, buffer = socket.recv_multipart(copy=False)
+        metadata = json.loads(metadata.bytes)
+        decode_frame(metadata, buffer.buffer)
+        socket.send_multipart([identity, delimiter, str(metadata["id"]).encode(), b"NIL"])
+    socket.close()
+    context.term()
+
+def measure(server: str, frames: list, transport: str, quality: int, repeat: int) -> tuple:
+    image_client = ImageClient(server, transport=transport, quality=quality)
+    sizes, latencies = [], []
+    for _ in range(repeat):
+        for index, frame in enumerate(frames):
+            start_time = time.perf_counter()
+            image_client.send(str(index), frame)
+            latencies.append(time.perf_counter() - start_time)
+            sizes.append(image_client.last_size)
+    image_client.close()
+    return sum(sizes) / len(sizes), sorted(latencies)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Image transport benchmark")
+    parser.add_argument('--server', type=str, default=None, required=False)
+    parser.add_argument('--qualities', type=int, nargs='+', default=[50, 70, 80, 90, 95], required=False)
+    parser.add_argument('--repeat', type=int, default=3, required=False)
+    parser.add_argument('--bandwidth', type=float, default=20.0, required=False) # Mbit/s
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    server = args.server
+    if server is None:
+        server = LOCAL_HUB
+        threading.Thread(target=local_hub, args=(stop,), daemon=True).start()
+
+    camera = FileCameraBackend(framerate=1000)
+    camera.open()
+    frames = [camera.capture() for _ in camera.paths]
+
+    print(f"[Benchmark] {len(frames)} frames of {IMAGE_WIDTH}x{IMAGE_HEIGHT} to {server}")
+    for transport, quality in [("raw", 0)] + [("jpeg", quality) for quality in args.qualities]:
+        size, latencies = measure(server, frames, transport, quality, args.repeat)
+        median = latencies[len(latencies) // 2]
+        wire = size * 8 / (args.bandwidth * 1e6)
+        name = transport if transport == "raw" else f"{transport} q{quality}"
+        print(f"[Benchmark] {name:>8}: {size / 1024:8.1f} KiB/frame, round trip p50 {median * 1000:6.1f} ms, "
+              f"max {latencies[-1] * 1000:6.1f} ms, +{wire * 1000:6.1f} ms at {args.bandwidth:g} Mbit/s")
+    stop.set()
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import zmq
+from collections import deque
+from multiprocessing import Manager, Process
+
+from image_detection.config.config import IMAGE_SERVER_WORKERS, BROKER_BACKEND, BROKER_STATS_INTERVAL, \
+    BROKER_RESTART_BACKOFF, BROKER_RESTART_BACKOFF_MAX, BROKER_RESTART_LIMIT
+from rpi.etc.image_server import ImageProcessingServer
+
+
+def run_worker(identity, connect_to, recognized_ids, server_options):
+    """Worker process: an ImageProcessingServer with its own model, serving requests handed out by the broker."""
+    server = ImageProcessingServer(connect_to=connect_to, identity=identity, recognized_ids=recognized_ids, **server_options)
+    server.start()
+
+
+def is_reset(frames):
+    """Whether a client request is the reset of a new run, image id 0. Metadata follows the envelope's empty frame."""
+    split = next(index for index, frame in enumerate(frames) if len(frame) == 0)
+    return json.loads(frames[split + 1].bytes).get('msg') == 0
+
+
+class WorkerStats:
+    """Requests served by one worker, measured by the broker from hand-out to reply."""
+    def __init__(self):
+        self.served = 0
+        self.busy = 0.0
+        self.slowest = 0.0
+        self.restarts = 0
+        self.lost = 0
+        self.failures = 0 # Deaths since the worker last served a request.
+
+    def add(self, seconds):
+        self.served += 1
+        self.failures = 0
+        self.busy += seconds
+        self.slowest = max(self.slowest, seconds)
+
+    def format(self, elapsed):
+        mean = self.busy / self.served * 1000 if self.served else 0.0
+        return (f"{self.served} served, mean {mean:.0f} ms, max {self.slowest * 1000:.0f} ms, "
+                f"busy {self.busy / max(elapsed, 1e-9) * 100:.0f}%, {self.restarts} restarts, {self.lost} lost")
+
+
+class ImageBroker:
+    """Load balancing broker in front of several ImageProcessingServer worker processes.
+    The RPi connects to it exactly as to a single server. Each request goes to an idle worker,
+    and waits in a queue while every worker is busy, so bursts and several robots are served in parallel.
+    Every worker loads its own model. A worker which dies is started again, and the request it was
+    working on goes to the next idle worker once; if that one dies too the request is dropped and the
+    RPi's request deadline takes over. A worker that keeps dying before it serves a request is started
+    again later each time, and given up on after BROKER_RESTART_LIMIT deaths in a row.
+    The reset of a new run (image id 0) is served by one worker, the others are told to drop their frame caches.
+    """
+    def __init__(self, workers=IMAGE_SERVER_WORKERS, open_port='tcp://*:5555', backend_address=BROKER_BACKEND, **server_options):
+        self.workers = workers
+        self.backend_address = backend_address
+        # Split the cores between the workers unless told otherwise.
+        if server_options.get('threads') is None:
+            server_options['threads'] = max(1, (os.cpu_count() or 1) // workers)
+        self.server_options = server_options
+
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind(open_port)
+        self.backend = self.context.socket(zmq.ROUTER)
+        # A restarted worker reconnects with the same identity.
+        self.backend.setsockopt(zmq.ROUTER_HANDOVER, 1)
+        self.backend.bind(backend_address)
+
+        # Recognized ids are shared so no worker reports an image another one has already found.
+        self.manager = Manager()
+        self.recognized_ids = self.manager.list()
+        self.processes = {} # Worker identity -> Process.
+        self.stats = {}  # Worker identity -> WorkerStats.
+        self.idle = deque() # Workers waiting for a request.
+        self.requests = deque() # [client frames, retried] waiting for a worker.
+        self.in_flight = {} # Worker identity -> [client frames, retried, time handed out].
+        self.restart_at = {} # Dead worker identity -> time it is started again.
+        self.started_at = self.reported_at = time.monotonic()
+        self.replies = self.reported_replies = 0 # Reports only when something was served since the last one.
+
+    def spawn(self, identity):
+        process = Process(target=run_worker, args=(identity.decode('utf-8'), self.backend_address, self.recognized_ids, self.server_options),
+                          name=f"[Image Worker {identity.decode('utf-8')}]", daemon=True)
+        process.start()
+        self.processes[identity] = process
+
+    def start(self):
+        print(f'[Image Broker] Starting {self.workers} workers with {self.server_options["threads"]} threads each')
+        for index in range(self.workers):
+            identity = f"worker-{index}".encode('utf-8')
+            self.stats[identity] = WorkerStats()
+            self.spawn(identity)
+
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        while True:
+            try:
+                # Time out to look after the workers.
+                events = dict(poller.poll(500))
+                if self.backend in events:
+                    self.recv_worker()
+                if self.frontend in events:
+                    # Frames are passed on without copying the image buffers.
+                    self.requests.append([self.frontend.recv_multipart(copy=False), False])
+                self.dispatch()
+                self.check_workers()
+                if time.monotonic() - self.reported_at >= BROKER_STATS_INTERVAL and self.replies != self.reported_replies:
+                    self.report()
+            except KeyboardInterrupt:
+                print("[Image Broker] Ctrl-C")
+                break
+        self.end()
+
+    def recv_worker(self):
+        identity, *message = self.backend.recv_multipart()
+        if message != [b'READY']:
+            # Reply: client envelope, request id and reply, goes back as it is.
+            request = self.in_flight.pop(identity, None)
+            if request is not None:
+                self.stats[identity].add(time.monotonic() - request[2])
+            self.frontend.send_multipart(message)
+            self.replies += 1
+        else:
+            print(f"[Image Broker] {identity.decode('utf-8')} is ready")
+        if identity not in self.idle:
+            self.idle.append(identity)
+
+    def dispatch(self):
+        while self.idle and self.requests:
+            identity = self.idle.popleft()
+            frames, retried = self.requests.popleft()
+            self.backend.send_multipart([identity] + frames, copy=False)
+            self.in_flight[identity] = [frames, retried, time.monotonic()]
+            if is_reset(frames):
+                # Each worker caches frames of its own, all of them start the new run afresh.
+                for other in self.processes:
+                    if other != identity:
+                        self.backend.send_multipart([other, b'RESET'])
+
+    def check_workers(self):
+        now = time.monotonic()
+        for identity, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if identity in self.restart_at:
+                if now >= self.restart_at[identity]:
+                    del self.restart_at[identity]
+                    self.spawn(identity)
+                continue
+            stats = self.stats[identity]
+            stats.failures += 1
+            if identity in self.idle:
+                self.idle.remove(identity)
+            request = self.in_flight.pop(identity, None)
+            if request is not None:
+                frames, retried, _ = request
+                if retried:
+                    stats.lost += 1
+                else:
+                    # Next in line, it has waited long enough.
+                    self.requests.appendleft([frames, True])
+            if stats.failures >= BROKER_RESTART_LIMIT:
+                # Crash looping, it gets no more requests.
+                print(f"[Image Broker] {identity.decode('utf-8')} died with exit code {process.exitcode}, "
+                      f"{stats.failures} times in a row, giving up on it")
+                del self.processes[identity]
+                if not self.processes:
+                    print("[Image Broker] No workers left, requests wait until the RPi gives up on them")
+                continue
+            backoff = min(BROKER_RESTART_BACKOFF * 2 ** (stats.failures - 1), BROKER_RESTART_BACKOFF_MAX)
+            print(f"[Image Broker] {identity.decode('utf-8')} died with exit code {process.exitcode}, restarting it in {backoff:.1f} s")
+            stats.restarts += 1
+            self.restart_at[identity] = now + backoff
+
+    def report(self):
+        now = time.monotonic()
+        self.reported_at = now
+        self.reported_replies = self.replies
+        print(f"[Image Broker] {len(self.requests)} queued, {len(self.in_flight)} in progress, {len(self.idle)} idle")
+        for identity, stats in self.stats.items():
+            print(f"[Image Broker] {identity.decode('utf-8')}: {stats.format(now - self.started_at)}")
+
+    def end(self):
+        print('[Image Broker] Stopping workers')
+        for process in self.processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.report()
+        self.frontend.close()
+        self.backend.close()
+        self.context.term()
+        self.manager.shutdown()
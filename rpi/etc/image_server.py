@@ -1,118 +1,233 @@
 
 import os, shutil
 import time
+import json
 import cv2
+import zmq
 from imagezmq import ImageHub
 from datetime import datetime
 
 from rpi.misc.config import *
+from rpi.misc.image_codec import decode_frame
 from image_detection import inference
+from image_detection.config.config import CHECKPOINTS, INFERENCE_BACKEND, FRAME_CACHE_SIZE
 from image_detection.utils import file_helper, display_images, correction_helper
+from image_detection.letterbox import restore_frame
+from image_detection.utils.image_writer import ImageWriter
+from image_detection.utils.frame_cache import FrameCache
 
 
 class CustomImageHub(ImageHub):
+    """ROUTER socket instead of imagezmq's REP, so replies carry the request id back.
+    Serves the RPi's DEALER ImageClient as well as plain imagezmq ImageSenders (REQ).
+    With connect_to, it is a broker worker instead: a DEALER connected to the ImageBroker's backend,
+    which passes the client's frames through unchanged, envelope included.
+    """
+    def __init__(self, open_port='tcp://*:5555', connect_to=None, identity=None):
+        self.REQ_REP = True
+        self.zmq_context = zmq.Context()
+        if connect_to is None:
+            self.zmq_socket = self.zmq_context.socket(zmq.ROUTER)
+            self.zmq_socket.bind(open_port)
+        else:
+            self.zmq_socket = self.zmq_context.socket(zmq.DEALER)
+            # Fixed identity, so a restarted worker takes over its old slot in the broker.
+            self.zmq_socket.setsockopt(zmq.IDENTITY, identity.encode('utf-8'))
+            self.zmq_socket.connect(connect_to)
+        self.connect_to = connect_to
+        # Routing frames and request id of the frame being processed.
+        self.envelope = []
+        self.request_id = None
+
+    def ready(self):
+        """Tells the broker this worker can take requests, nothing to do for a bound hub."""
+        if self.connect_to is not None:
+            self.zmq_socket.send_multipart([b'READY'])
+
     def send_reply(self, reply_message):
-        """Sends the zmq REP reply message.
+        """Sends the reply message to the sender of the last frame.
         Arguments:
           reply_message: reply message text, often just string 'OK'
         """
         reply_message = reply_message.encode('utf-8')
-        self.zmq_socket.send(reply_message)
+        request_id = [] if self.request_id is None else [str(self.request_id).encode('utf-8')]
+        self.zmq_socket.send_multipart(self.envelope + request_id + [reply_message])
+
+    def recv_frame(self):
+        """Receives a frame sent with either send_image or send_jpg.
+        Returns:
+          msg: text message, often image name
+          frame: decoded image array, the first one of a burst
+        """
+        msg, images, _ = self.recv_frames()
+        return msg, images[0]
+
+    def recv_frames(self):
+        """Receives a single frame, or a burst of frames sent in one request by the RPi's ImageClient.
+        A burst's metadata has a "frames" list with the dtype and shape (raw) or nothing (JPEG) of each buffer.
+        Frames letterboxed by the RPi carry "letterbox" metadata to map results back to the captured frame.
+        Returns:
+          msg: text message, often image name
+          images: list of decoded image arrays
+          letterboxes: per image, its letterbox metadata or None
+        A broker's RESET, sent when another worker got the reset of a new run, comes back as msg None and no images.
+        """
+        frames = self.zmq_socket.recv_multipart(copy=False)
+        if len(frames) == 1 and frames[0].bytes == b'RESET':
+            return None, [], []
+        # Envelope is everything up to the empty delimiter frame.
+        split = next(index for index, frame in enumerate(frames) if len(frame) == 0)
+        self.envelope = [frame.bytes for frame in frames[:split + 1]]
+        metadata = json.loads(frames[split + 1].bytes)
+        self.request_id = metadata.get('id')
+        buffers = frames[split + 2:]
+        frames_metadata = metadata.get('frames', [metadata])
+        images = [decode_frame(frame_metadata, buffer.buffer) for frame_metadata, buffer in zip(frames_metadata, buffers)]
+        return metadata['msg'], images, [frame_metadata.get('letterbox') for frame_metadata in frames_metadata]
 
 
 class ImageProcessingServer:
-    def __init__(self):
+    def __init__(self, backend=INFERENCE_BACKEND, connect_to=None, identity=None, recognized_ids=None, open_port='tcp://*:5555', model_path=None, **inference_options):
 
-        # initialize the ImageHub object
-        self.image_hub = CustomImageHub()
+        # initialize the ImageHub object, connect_to: broker backend when running as an ImageBroker worker
+        self.image_hub = CustomImageHub(open_port, connect_to=connect_to, identity=identity)
+        self.identity = identity
+        # keep track of recognized ids, shared between the workers of an ImageBroker
+        self.recognized_ids = [] if recognized_ids is None else recognized_ids
         self.dir_path = os.path.dirname(os.path.realpath(__file__))
-        self.ckpt_path = os.path.join(self.dir_path, "checkpoint/best_ckpt.pt")
+        if backend is None:
+            # exported TorchScript model starts faster and doesn't need the yolov5 code
+            exported = os.path.exists(os.path.join(self.dir_path, CHECKPOINTS["torchscript"]))
+            backend = "torchscript" if exported else "pytorch"
+        # model_path: a model file other than the backend's checkpoint
+        self.ckpt_path = model_path or os.path.join(self.dir_path, CHECKPOINTS[backend])
         # download model if not downloaded
         # file_helper.ModelDownload(self.ckpt_path)
         # initialize inference class
-        self.inf = inference.Inference(self.ckpt_path)
+        # inference_options: device, threads, interop_threads, image_size, autotune
+        self.inf = inference.Inference(self.ckpt_path, backend, **inference_options)
+        # saves and annotates frames after the reply is sent
+        self.writer = ImageWriter()
+        # detections of recent frames, retries of an unchanged scene skip the model
+        self.cache = FrameCache() if FRAME_CACHE_SIZE > 0 else None
         # self.prev = 0
         
     def start(self):
-        # keep track of recognized ids
-        self.recognized_ids = []
-        print('[Image Server] Started image processing server')
+        self.image_hub.ready()
+        print('[Image Server] Started image processing server' + ('' if self.identity is None else f' as {self.identity}'))
         
         while True:
             try:
                 print('[Image Server] Waiting for image from RPi')
 
-                # receive RPi name and frame from the RPi and acknowledge the receipt
-                rpi_reply, frame = self.image_hub.recv_image()
-                print('[Image Server] Connected and received frame at time: ' + str(datetime.now()))
-
-                
+                # receive RPi name and frames from the RPi and acknowledge the receipt
+                rpi_reply, frames, letterboxes = self.image_hub.recv_frames()
+                if rpi_reply is None:
+                    # no reply, the worker which got the reset clears the shared ids and shows the results
+                    self.reset(shared=False)
+                    continue
+                print(f'[Image Server] Connected and received {len(frames)} frame(s) at time: ' + str(datetime.now()))
 
                 print("Recognized IDS:", self.recognized_ids)
-                identifier = str(time.time()).split('.')[0]
-                # form image file path for saving
-                raw_image_name = "img_" + identifier + ".jpg"
-                raw_image_path = os.path.join(self.dir_path, "images", raw_image_name)
-
-                # check if images folder exists
-                directory_images = os.path.join(self.dir_path, "images")
-                if not os.path.exists(directory_images):
-                    os.makedirs(directory_images)
-
-                # delete files if new run
-                # if rpi_reply != "calibrate":
-                #     if self.prev < int(rpi_reply):
-                #         self.delete_files(self.dir_path)
-                #     else:
-                #         self.prev = int(rpi_reply)
-                # save raw image
-                cv2.imwrite(raw_image_path, frame)
-
-                if rpi_reply != "calibrate":
-                    # run inference
-                    self.label, self.cord_thres, x_shape, y_shape, bbox = self.inf.run_inference(raw_image_path, self.recognized_ids) 
-                else:
-                    # run inference
-                    self.label, self.cord_thres, x_shape, y_shape, bbox = self.inf.run_inference(raw_image_path, []) 
-
-                # draw bounding box if image detected
-                if self.label != "-1" and self.label != "41":
-                    if rpi_reply != "calibrate":
-                        # add to recognized ids
-                        self.recognized_ids.append(self.label)
-                        print(f"Detect Image ID: {self.label}")
-                        self.inf.draw_bounding(self.label, self.cord_thres, raw_image_path, self.dir_path)
-
-                        # check distance
-                        ch = correction_helper.CorrectionHelper(x_shape, y_shape, bbox[0], bbox[2], bbox[1], bbox[3])
-                        dist = ch.calc_dist()
-                        post = ch.calc_position()
-                        print("img_server dist: ", dist)
-                        reply = f"{self.label}/{dist}"
-                    else:
-                        # check position after adjusting distance
-                        ch = correction_helper.CorrectionHelper(x_shape, y_shape, bbox[0], bbox[2], bbox[1], bbox[3])
-                        post = ch.calc_position()
-                        print(f"Coord Difference: {post}")
-                        reply = post 
-                else:
-                    if self.label == "41":
-                        print("Detected Bullseye")
-                    else:
-                        print("No image is being detected")
-                    reply = "NIL"
-                
+                reply = self.handle_request(rpi_reply, frames, letterboxes)
                 self.image_hub.send_reply(reply)
 
+                # save images in the background once the RPi has its reply
+                identifier = str(time.time()).split('.')[0]
+                if self.identity is not None:
+                    # workers can save in the same second
+                    identifier += "_" + self.identity
+                self.writer.submit(self.save_images, identifier, rpi_reply, frames, self.frame_index, self.label, self.cord_thres, letterboxes)
+
                 # if last obstacle detected, reset recognized list and display images
                 if (rpi_reply == 1 and self.label != "-1") or (rpi_reply == 0):
-                    self.recognized_ids = []
-                    display_images.get_results(self.dir_path)
+                    self.reset()
 
             except KeyboardInterrupt as e:
                 print("[Image Server] Ctrl-C")
+                if self.cache is not None:
+                    print(f"[Image Server] Frame cache: {self.cache.stats()}")
                 break
 
+        # write out frames still waiting
+        self.writer.close()
+
+    def reset(self, shared=True):
+        """Starts a new run: forgets the cached frames and writes out the frames still waiting.
+        shared: also clear the recognized ids and display the results, done once per run by the worker that got the request.
+        """
+        if shared:
+            # in place, the list can be shared with other workers
+            self.recognized_ids[:] = []
+        # new run, new scene
+        if self.cache is not None:
+            print(f"[Image Server] Frame cache: {self.cache.stats()}")
+            self.cache.clear()
+        self.writer.flush()
+        if shared:
+            # results are read back from disk
+            display_images.get_results(self.dir_path)
+
+    def handle_request(self, rpi_reply, frames, letterboxes=None):
+        """Runs inference on the frames in memory, batched, and returns the reply for the RPi.
+        The biggest detection across a burst is the answer.
+        Results of letterboxed frames are in pixels of the captured frame, so the distance is unchanged.
+        Returns:
+          "<id>/<distance>" when an image is detected, the position when calibrating, else "NIL"
+        """
+        if rpi_reply != "calibrate":
+            # run inference, on a copy of the ids as other workers may add to them meanwhile
+            self.label, self.cord_thres, x_shape, y_shape, bbox, self.frame_index = self.inf.detect_batch(frames, self.recognized_ids[:], letterboxes, self.cache, rpi_reply) 
+        else:
+            # run inference
+            self.label, self.cord_thres, x_shape, y_shape, bbox, self.frame_index = self.inf.detect_batch(frames, [], letterboxes, self.cache, rpi_reply) 
+
+        if self.label != "-1" and self.label != "41":
+            if rpi_reply != "calibrate":
+                # add to recognized ids
+                self.recognized_ids.append(self.label)
+                print(f"Detect Image ID: {self.label}")
+
+                # check distance
+                ch = correction_helper.CorrectionHelper(x_shape, y_shape, bbox[0], bbox[2], bbox[1], bbox[3])
+                dist = ch.calc_dist()
+                post = ch.calc_position()
+                print("img_server dist: ", dist)
+                return f"{self.label}/{dist}"
+            # check position after adjusting distance
+            ch = correction_helper.CorrectionHelper(x_shape, y_shape, bbox[0], bbox[2], bbox[1], bbox[3])
+            post = ch.calc_position()
+            print(f"Coord Difference: {post}")
+            return post 
+        if self.label == "41":
+            print("Detected Bullseye")
+        else:
+            print("No image is being detected")
+        return "NIL"
+
+    def save_images(self, identifier, rpi_reply, frames, frame_index, label, cord_thres, letterboxes=None):
+        """Saves the raw frames, and the frame the image was detected in with its bounding box.
+        Letterboxed frames are scaled back to the captured size first, cord_thres is relative to it.
+        Runs on the image writer thread.
+        """
+        if letterboxes is not None:
+            frames = [restore_frame(frame, letterbox) for frame, letterbox in zip(frames, letterboxes)]
+        # check if images folder exists
+        directory_images = os.path.join(self.dir_path, "images")
+        if not os.path.exists(directory_images):
+            os.makedirs(directory_images)
+
+        for index, frame in enumerate(frames):
+            # form image file path for saving, frames of a burst are numbered
+            raw_image_name = "img_" + identifier + ("" if len(frames) == 1 else f"_{index}") + ".jpg"
+            raw_image_path = os.path.join(directory_images, raw_image_name)
+            # save raw image
+            cv2.imwrite(raw_image_path, frame)
+
+        # draw bounding box if image detected
+        if label != "-1" and label != "41" and rpi_reply != "calibrate":
+            self.inf.draw_bounding(label, cord_thres, frames[frame_index], self.dir_path)
+
     def end(self):
         print('[Image Server] Stopping image processing server')
         self.image_hub.send_reply('Done')
@@ -0,0 +1,202 @@
+"""
+Replays a link log recorded with main.py --record - Not used in production.
+The recorded STM, Android, Algorithm and Image Server messages are played back by stand-in devices
+through AsyncGateway, so routing, STM flow control and the image handling run exactly as on the robot
+(frames come from the file camera, the image server's replies from the log).
+Every incoming message waits for what caused it: the messages the RPi sent on that link before it in the recording
+(the STM's DONE after its command, the next path after its request), then for the recorded gap, divided by --speed.
+--fast skips the gaps, only the RPi's own delays (e.g. STM_COMMAND_DELAY) remain.
+The replay is recorded too, and the end-to-end latency of every obstacle is compared with the recording.
+Run from rpi/: python -m etc.replay run.log [--speed 1] [--fast] [--output replay.log]
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import Counter, deque
+
+from misc.config import *
+from misc.recorder import LINK, DIRECTION, RecordedLink, encode_payload, read_log, obstacle_latencies
+from src.async_gateway import AsyncGateway
+
+class ReplaySchedule:
+    """
+    Incoming messages of a log per link, in the recorded order, and the outgoing ones to compare the replay with.
+    Shared by the stand-in devices, which run on the gateway's executor threads.
+    """
+    def __init__(self, records: list, speed: float) -> None:
+        self.speed = speed # 0 -> no gaps.
+        self.condition = threading.Condition()
+        self.incoming = {link: deque() for link in LINK.NAMES} # [(messages sent before it, gap, payload)]
+        self.expected = {link: [] for link in LINK.NAMES} # Payloads the RPi sent in the recording.
+
+        sent, last = Counter(), {}
+        start = records[0].time_ns if records else 0
+        for record in records:
+            if record.direction == DIRECTION.OUT:
+                sent[record.link] += 1
+                self.expected[record.link].append(record.payload)
+            else:
+                gap = (record.time_ns - last.get(record.link, start)) / 1e9
+                self.incoming[record.link].append((sent[record.link], gap, record.payload))
+            last[record.link] = record.time_ns
+
+        self.sent = Counter() # Messages the RPi has sent per link in the replay.
+        self.delivered = 0
+        self.mismatches = 0 # Sent messages which differ from the recording.
+        self.started = self.progress = time.monotonic()
+        self.last = {} # Link -> time of its last message in the replay.
+
+    def remaining(self) -> int:
+        return sum(len(incoming) for incoming in self.incoming.values())
+
+    def sent_message(self, link: int, payload) -> None:
+        payload = encode_payload(payload)
+        with self.condition:
+            index = self.sent[link]
+            self.sent[link] += 1
+            expected = self.expected[link]
+            if index >= len(expected) or expected[index] != payload:
+                self.mismatches += 1
+                print(f"[Replay] {LINK.NAMES[link]}: sent {payload} instead of {expected[index] if index < len(expected) else 'nothing'}")
+            self.last[link] = self.progress = time.monotonic()
+            self.condition.notify_all()
+
+    # Next incoming message of a link once it is due, None if it isn't within timeout.
+    def next_message(self, link: int, timeout: float):
+        deadline = time.monotonic() + timeout
+        incoming = self.incoming[link]
+        with self.condition:
+            while not incoming or self.sent[link] < incoming[0][0]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            _, gap, payload = incoming[0]
+            due = self.last.get(link, self.started) + gap / self.speed if self.speed else 0.0
+
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            if time.monotonic() < due:
+                return None
+
+        with self.condition:
+            incoming.popleft()
+            self.delivered += 1
+            self.last[link] = self.progress = time.monotonic()
+        return payload
+
+class StandInLink:
+    """Plays the device of one link: recv hands out the log's messages, send is checked against the log."""
+    def __init__(self, schedule: ReplaySchedule, link: int, timeout: float = QUEUE_TIMEOUT) -> None:
+        self.schedule = schedule
+        self.link = link
+        self.timeout = timeout
+
+    def connect(self) -> None:
+        pass
+
+    def disconnect(self) -> None:
+        pass
+
+    disconnect_all = disconnect_client = disconnect
+
+    def recv(self):
+        return self.schedule.next_message(self.link, self.timeout)
+
+    def send(self, message) -> None:
+        self.schedule.sent_message(self.link, message)
+
+class StandInImageClient(StandInLink):
+    """Image Processing Server from the log, replies like ImageClient.send and times out like it."""
+    last_size = 0
+
+    def send(self, image_id, image=None, timeout: float = None) -> bytes:
+        super().send(image_id)
+        reply = self.schedule.next_message(self.link, IMAGE_REQUEST_TIMEOUT if timeout is None else timeout)
+        if reply is None:
+            raise TimeoutError(f"No reply in the log for image {image_id}.")
+        return reply
+
+    def close(self) -> None:
+        pass
+
+class ReplayGateway(AsyncGateway):
+    """AsyncGateway with stand-in devices, recording the replay to output."""
+    def __init__(self, schedule: ReplaySchedule, settings: dict, output: str) -> None:
+        # Image processing on, with the file camera, the address is never connected to.
+        super().__init__("replay", False, False, False, settings.get("env", "outdoor"), camera="file",
+                         pipeline=settings.get("pipeline", PIPELINED_EXPLORATION), burst=settings.get("burst", IMAGE_BURST_FRAMES),
+                         letterbox=settings.get("letterbox", IMAGE_LETTERBOX))
+        self.schedule = schedule
+        self.stm = StandInLink(schedule, LINK.STM, STM_READ_TIMEOUT)
+        self.android = StandInLink(schedule, LINK.ANDROID)
+        self.algorithm = StandInLink(schedule, LINK.ALGORITHM)
+        self.record_links(output, dict(settings, replay=True))
+        # The links exist now, route to them.
+        self.build_dispatch_tables()
+
+    def open_image_client(self, **kwargs):
+        return RecordedLink(StandInImageClient(self.schedule, LINK.IMAGE), self.recorder, LINK.IMAGE)
+
+def run_gateway(gateway: ReplayGateway) -> None:
+    try:
+        gateway.start()
+    except asyncio.CancelledError:
+        pass
+
+def report(recorded: list, replayed: list) -> None:
+    print(f"[Replay] {'obstacle':>8}  {'recorded':>9}  {'replayed':>9}  {'requests':>9}  reply")
+    for index in range(max(len(recorded), len(replayed))):
+        before = recorded[index] if index < len(recorded) else None
+        after = replayed[index] if index < len(replayed) else None
+        seconds = lambda obstacle: f"{obstacle['seconds']:8.3f}s" if obstacle else f"{'-':>9}"
+        requests = f"{before['requests'] if before else '-'}/{after['requests'] if after else '-'}"
+        replies = f"{before['reply'] if before else '-'} / {after['reply'] if after else '-'}"
+        print(f"[Replay] {index + 1:>8}  {seconds(before)}  {seconds(after)}  {requests:>9}  {replies}")
+    for name, obstacles in [("recorded", recorded), ("replayed", replayed)]:
+        if obstacles:
+            total = sum(obstacle["seconds"] for obstacle in obstacles)
+            print(f"[Replay] {name}: {len(obstacles)} obstacles, mean {total / len(obstacles):.3f}s, total {total:.3f}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded link log through the router")
+    parser.add_argument('log', type=str)
+    parser.add_argument('--speed', type=float, default=1.0, required=False,) # Recorded gaps are divided by it.
+    parser.add_argument('--fast', action='store_true', required=False,) # No gaps at all.
+    parser.add_argument('--output', type=str, default=None, required=False,) # Log of the replay, a temporary file by default.
+    parser.add_argument('--settle', type=float, default=2.0, required=False,) # Seconds to wait for the last messages once the log is played.
+    parser.add_argument('--stall', type=float, default=30.0, required=False,) # Seconds without progress before giving up.
+    args = parser.parse_args()
+
+    settings, records = read_log(args.log)
+    print(f"[Replay] {len(records)} messages over {(records[-1].time_ns - records[0].time_ns) / 1e9 if records else 0:.1f}s, settings {settings}")
+    schedule = ReplaySchedule(records, 0.0 if args.fast else args.speed)
+    output = args.output
+    if output is None:
+        descriptor, output = tempfile.mkstemp(suffix=".log")
+        os.close(descriptor)
+
+    gateway = ReplayGateway(schedule, settings, output)
+    thread = threading.Thread(target=run_gateway, args=(gateway,), daemon=True)
+    start_time = time.monotonic()
+    thread.start()
+    while True:
+        time.sleep(0.1)
+        idle = time.monotonic() - schedule.progress
+        if schedule.remaining() == 0 and idle >= args.settle:
+            break
+        if idle >= args.stall:
+            print(f"[Replay] Stalled for {args.stall:g}s with {schedule.remaining()} messages left, the replay has diverged from the recording.")
+            break
+    elapsed = time.monotonic() - start_time
+    gateway.loop.call_soon_threadsafe(gateway.end)
+    thread.join(timeout=PROCESS_JOIN_TIMEOUT)
+
+    print(f"[Replay] Played {schedule.delivered} messages in {elapsed:.1f}s, {schedule.mismatches} sent messages differ from the recording")
+    report(obstacle_latencies(records), obstacle_latencies(read_log(output)[1]))
+    if args.output is None:
+        os.remove(output)
@@ -0,0 +1,152 @@
+"""
+STM board simulator on a pseudo-terminal - Not used in production.
+Speaks the 10 byte command format and answers STM_PROTOCOL.DONE like the board, so MultiProcessing, AsyncGateway
+and SpeedRun can run on a plain Linux box. The slave end of the pty is linked from a fixed path:
+    python -m etc.stm_simulator [--link /tmp/stm-sim] [--delay W=0.5 TURN=1.5] [--jitter 0.1] [--drop 0.05] [--disconnect_every 50]
+    python main.py --serial /tmp/stm-sim ...
+Run from rpi/.
+"""
+import os
+import tty
+import time
+import heapq
+import random
+import select
+import argparse
+import threading
+from collections import Counter
+
+from misc.config import *
+from misc.protocols import STM_PROTOCOL
+
+class STMSimulator:
+    """
+    Executes commands one at a time like the board: each answers STM_PROTOCOL.DONE once the previous one is done
+    and the delay of its type (W, S, I, P, TURN, L) has passed, give or take jitter (a fraction of the delay).
+    Any other letter is a turn. U frames (ultrasonic distance, Task 2) are taken without a reply,
+    L (start Task 2) answers DONE when the run would be over.
+    drop: chance of a DONE getting lost, for the ack watchdog.
+    disconnect_every: hang up after that many commands and come back on a new pty behind the same link, for reconnection.
+    """
+    def __init__(self, link: str = STM_SIMULATOR_LINK, delays: dict = None, jitter: float = STM_SIMULATOR_JITTER,
+                 drop: float = 0.0, disconnect_every: int = 0, seed: int = None) -> None:
+        self.link = link
+        self.delays = dict(STM_SIMULATOR_DELAYS, **(delays or {}))
+        self.jitter = jitter
+        self.drop = drop
+        self.disconnect_every = disconnect_every
+        self.random = random.Random(seed)
+
+        self.master = self.slave = None
+        self.buffer = b"" # Bytes of a command that is still arriving.
+        self.replies = [] # Heap of (time due, reply).
+        self.busy_until = 0.0 # The board finishes one command before starting the next.
+        self.distance = None # Last ultrasonic distance.
+        self.commands = Counter()
+        self.dones = self.dropped = self.disconnects = 0
+        self.hangup_requested = threading.Event() # Set from another thread to hang up, done by serve().
+
+    @staticmethod
+    def command_type(command: bytes) -> str:
+        header = command[:1].decode(FORMAT, errors="replace")
+        return header if header in ("W", "S", "I", "P", "U", "L") else "TURN"
+
+    # New pty, the link is swapped atomically so a client never sees it missing.
+    def open(self) -> None:
+        self.master, self.slave = os.openpty()
+        # No echo or line editing, bytes go through as they are.
+        tty.setraw(self.slave)
+        temporary = self.link + ".new"
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        os.symlink(os.ttyname(self.slave), temporary)
+        os.replace(temporary, self.link)
+        self.buffer = b""
+        print(f"[STM Simulator] Listening on {os.ttyname(self.slave)} linked from {self.link}")
+
+    def close(self) -> None:
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+        # Commands in progress die with the connection.
+        self.replies = []
+        self.busy_until = 0.0
+
+    # Hang up on the client and come back on a new pty.
+    def hangup(self) -> None:
+        print("[STM Simulator] Hanging up")
+        self.disconnects += 1
+        self.close()
+        self.open()
+
+    def handle(self, command: bytes) -> None:
+        command_type = self.command_type(command)
+        self.commands[command_type] += 1
+        if command_type == "U":
+            # U0000x0123 -> 123 cm.
+            self.distance = int(command[6:]) if command[6:].isdigit() else None
+            return
+        delay = self.delays[command_type]
+        delay = max(0.0, delay * (1 + self.random.uniform(-self.jitter, self.jitter)))
+        self.busy_until = max(time.monotonic(), self.busy_until) + delay
+        if self.random.random() < self.drop:
+            self.dropped += 1
+            return
+        heapq.heappush(self.replies, (self.busy_until, STM_PROTOCOL.DONE))
+
+    def serve(self, stop: threading.Event = None) -> None:
+        if self.master is None:
+            self.open()
+        while stop is None or not stop.is_set():
+            if self.hangup_requested.is_set():
+                self.hangup_requested.clear()
+                self.hangup()
+            now = time.monotonic()
+            while self.replies and self.replies[0][0] <= now:
+                _, reply = heapq.heappop(self.replies)
+                os.write(self.master, reply)
+                self.dones += 1
+            wait = min(self.replies[0][0] - now, QUEUE_TIMEOUT) if self.replies else QUEUE_TIMEOUT
+            if not select.select([self.master], [], [], max(wait, 0))[0]:
+                continue
+            self.buffer += os.read(self.master, 1024)
+            while len(self.buffer) >= STM_MESSAGE_SIZE:
+                command, self.buffer = self.buffer[:STM_MESSAGE_SIZE], self.buffer[STM_MESSAGE_SIZE:]
+                self.handle(command)
+                if self.disconnect_every and sum(self.commands.values()) % self.disconnect_every == 0:
+                    self.hangup()
+                    break
+
+    def report(self) -> None:
+        commands = ", ".join(f"{command_type}: {count}" for command_type, count in sorted(self.commands.items()))
+        print(f"[STM Simulator] {sum(self.commands.values())} commands ({commands}), {self.dones} DONE sent, "
+              f"{self.dropped} dropped, {self.disconnects} disconnects")
+
+# --delay W=0.5 TURN=1.5 -> {"W": 0.5, "TURN": 1.5}
+def parse_delays(values: list) -> dict:
+    delays = {}
+    for value in values:
+        command_type, seconds = value.split("=")
+        delays[command_type.upper()] = float(seconds)
+    return delays
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="STM simulator on a pseudo-terminal")
+    parser.add_argument('--link', type=str, default=STM_SIMULATOR_LINK, required=False,)
+    parser.add_argument('--delay', type=str, nargs='+', default=[], required=False,) # TYPE=SECONDS, e.g. W=0.5 TURN=1.5.
+    parser.add_argument('--jitter', type=float, default=STM_SIMULATOR_JITTER, required=False,)
+    parser.add_argument('--drop', type=float, default=0.0, required=False,)
+    parser.add_argument('--disconnect_every', type=int, default=0, required=False,)
+    parser.add_argument('--seed', type=int, default=None, required=False,)
+    args = parser.parse_args()
+
+    simulator = STMSimulator(args.link, parse_delays(args.delay), args.jitter, args.drop, args.disconnect_every, args.seed)
+    try:
+        simulator.serve()
+    except KeyboardInterrupt:
+        print("[STM Simulator] Ctrl-C")
+    simulator.report()
+    simulator.close()
+    if os.path.islink(args.link):
+        os.remove(args.link)
@@ -1,8 +1,10 @@
 import os
 import argparse
 from src.speedrun_rpi import SpeedRun
+from src.async_gateway import AsyncGateway
 from src.multi_processing import MultiProcessing
-from misc.config import IMAGE_PROCESSING_SERVER_URLS
+from misc.logger import set_level, LEVEL
+from misc.config import LOG_LEVEL, IMAGE_PROCESSING_SERVER_URLS, STM_ACK_TIMEOUT, CAMERA_BACKEND, PIPELINED_EXPLORATION, IMAGE_BURST_FRAMES, IMAGE_LETTERBOX, RECORD_LOG, SERIAL_PORT, METRICS_PORT
 
 parser = argparse.ArgumentParser(description="Main Process For RPI")
 
@@ -19,20 +21,43 @@ parser.add_argument( '--android', type=bool, default=True, required=False,)
 parser.add_argument( '--us', type=bool, default=True, required=False,)
 parser.add_argument( '--env', type=str, default="outdoor", required=False,)
 parser.add_argument( '--mode', type=int, default=1, required=False,)
+parser.add_argument( '--runtime', type=str, default="process", required=False, choices=["process", "async"])
+parser.add_argument( '--ack_timeout', type=float, default=STM_ACK_TIMEOUT, required=False,)
+parser.add_argument( '--camera', type=str, default=CAMERA_BACKEND, required=False, choices=["picamera", "file"])
+parser.add_argument( '--pipeline', action='store_true', default=PIPELINED_EXPLORATION, required=False,)
+parser.add_argument( '--burst', type=int, default=IMAGE_BURST_FRAMES, required=False,)
+parser.add_argument( '--letterbox', type=int, default=IMAGE_LETTERBOX, required=False,)
+parser.add_argument( '--record', type=str, default=RECORD_LOG, required=False,)
+parser.add_argument( '--serial', type=str, nargs='+', default=SERIAL_PORT, required=False,) # e.g. the pty of etc/stm_simulator.py.
+parser.add_argument( '--metrics_port', type=int, default=METRICS_PORT, required=False,) # Prometheus endpoint, 0 for off.
+parser.add_argument( '--log_level', type=str.upper, default=LOG_LEVEL, required=False, choices=list(LEVEL.BY_NAME)) # debug shows every link message.
 def init():
     multi_process = None
     args = parser.parse_args()
+    set_level(args.log_level)
     os.system("sudo hciconfig hci0 piscan")
     try:
         # Task 1
         if args.mode == 0:
             server_host = IMAGE_PROCESSING_SERVER_URLS[args.img_server] if args.img_server in IMAGE_PROCESSING_SERVER_URLS else None
-            multi_process = MultiProcessing(
+            # Single event loop or one process per link.
+            runtime = AsyncGateway if args.runtime == "async" else MultiProcessing
+            # Metrics are kept by the process runtime only.
+            options = {"metrics_port": args.metrics_port or None} if runtime is MultiProcessing else {}
+            multi_process = runtime(
                 image_processing_server=server_host, 
                 android_on=args.android, 
                 stm_on=args.stm,
                 algo_on=args.algo, 
                 env=args.env,
+                ack_timeout=args.ack_timeout,
+                camera=args.camera,
+                pipeline=args.pipeline,
+                burst=args.burst,
+                letterbox=args.letterbox,
+                record=args.record,
+                serial_port=args.serial,
+                **options,
                 )
             multi_process.start()
         # Task 2
@@ -42,6 +67,8 @@ def init():
                 stm_on=args.stm,
                 ultrasonic_on=args.us,
                 env=args.env,
+                serial_port=args.serial,
+                metrics_port=args.metrics_port or None,
             )
             multi_process.start()
     except Exception as error:
@@ -4,6 +4,33 @@ FORMAT = "utf-8"
 # STM
 SERIAL_PORT = ['/dev/ttyUSB0', '/dev/ttyUSB1']
 BAUD_RATE = 115200
+STM_READ_TIMEOUT = 0.5 # Seconds a serial read blocks before giving up.
+STM_MESSAGE_SIZE = 10
+STM_COMMAND_DELAY = 0.25 # Seconds between DONE and the next command.
+STM_ACK_TIMEOUT = 15.0 # Seconds to wait for DONE before the watchdog fires.
+STM_ACK_RESENDS = 1
+STM_RESEND_TYPES = ("I", "P") # Only setup commands are safe to resend.
+STM_READ_BACKOFF = 0.5 # Seconds recv_from_stm waits after a failed read, doubled per failure in a row.
+STM_READ_BACKOFF_MAX = 8.0
+STM_LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0] # Seconds.
+
+# STM Simulator (etc/stm_simulator.py)
+STM_SIMULATOR_LINK = "/tmp/stm-sim" # Stable path to the simulator's pty, for --serial.
+STM_SIMULATOR_DELAYS = {"W": 1.0, "S": 1.0, "I": 0.02, "P": 0.02, "TURN": 2.0, "L": 30.0} # Seconds until DONE per command type.
+STM_SIMULATOR_JITTER = 0.1 # Fraction of the delay, either way.
+
+# Process Settings
+QUEUE_TIMEOUT = 0.5 # Seconds a worker blocks on its queue before checking for shutdown.
+PROCESS_CHECK_INTERVAL = 1.0
+PROCESS_JOIN_TIMEOUT = 2.0
+
+# Socket Framing -> "raw" (one recv is one message), "delimiter" or "length" (4 byte prefix).
+# Both ends of a link must use the same framing. Opt-in: "raw" is what the Android app and the Algorithm server speak today,
+# it still splits or glues messages on partial reads, switch a link once its peer frames the same way.
+FRAME_DELIMITER = "\n".encode()
+MAX_FRAME_SIZE = 65536
+ANDROID_FRAMING = "raw"
+ALGO_FRAMING = "raw"
 
 # Bluetooth Settings / # Hua Wei Phone
 # RFCOMM_CHANNEL = 12
@@ -27,4 +54,33 @@ IMAGE_PROCESSING_SERVER_URLS = {
     "jacob" : f"{BASE_SERVER_PATH}29:{str(IMAGE_SERVER_PORT)}",
     "guanwei": f"{BASE_SERVER_PATH}25:{str(IMAGE_SERVER_PORT)}",
 }
+IMAGE_TRANSPORT = "raw" # raw, jpeg
+JPEG_QUALITY = 90
+IMAGE_REQUEST_TIMEOUT = 5.0 # seconds before a frame is given up and the socket reset
+IMAGE_BURST_FRAMES = 1 # Consecutive frames sent per request, the server runs them as one batch.
+IMAGE_LETTERBOX = 0 # Letterbox frames to the model input size (640) before sending, 0 sends them as captured.
+IMAGE_RTT_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0] # Seconds, image server round trip for the metrics.
+
+# Camera Service
+CAMERA_BACKEND = "picamera" # picamera, file
+CAMERA_FILE_DIR = "etc/images" # Served by the file backend, relative to rpi/.
+CAMERA_FRAMERATE = 15
+CAMERA_RING_SLOTS = 3
+CAMERA_WARMUP = 0.2 # seconds
+CAMERA_FRAME_TIMEOUT = 2.0 # seconds to wait for a fresh frame
+
+# Exploration
+PIPELINED_EXPLORATION = False # Capture/upload overlaps the STM correction and the next path request.
+
+# Record & Replay
+RECORD_LOG = None # Path of a log of every link message (etc/replay.py), None for off.
+
+# Metrics, Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108 # None for off.
 
+# Logging
+LOG_LEVEL = "INFO" # DEBUG, INFO, WARNING (or WARN), ERROR, OFF, in any case. DEBUG includes every message on the links.
+LOG_BUFFER_SIZE = 4096 # Records per process waiting for the writer, the oldest are dropped beyond it.
+LOG_FLUSH_INTERVAL = 0.1 # Seconds between writes.
+LOG_FILE = None # Append to this file instead of stdout.
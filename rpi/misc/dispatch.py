@@ -0,0 +1,36 @@
+from .protocols import SLASH_SEPARATOR
+
+class Dispatcher:
+    """
+    Dispatch table from message header to handler, built once from the protocol classes.
+    A message is matched on its full contents first (e.g. MOVE/F), then on its header,
+    the bytes before the first SLASH_SEPARATOR (e.g. ROBOT), without splitting the rest of the payload.
+    """
+    def __init__(self, default) -> None:
+        self.exact = {}
+        self.headers = {}
+        self.default = default
+
+    def on_message(self, messages, handler) -> None:
+        for message in messages:
+            self.exact[message] = handler
+
+    def on_header(self, headers, handler) -> None:
+        for header in headers:
+            self.headers[header] = handler
+
+    # Freeze the table into a single function, table lookups become closure variables.
+    def compile(self):
+        exact, headers, default = dict(self.exact), dict(self.headers), self.default
+
+        # partition is a single C call, cheaper than find and slicing on short messages.
+        def dispatch_header(message: bytes):
+            return headers.get(message.partition(SLASH_SEPARATOR)[0], default)(message)
+
+        def dispatch(message: bytes):
+            handler = exact.get(message)
+            if handler is not None:
+                return handler(message)
+            return headers.get(message.partition(SLASH_SEPARATOR)[0], default)(message)
+
+        return dispatch if exact else dispatch_header
@@ -0,0 +1,86 @@
+import struct
+from collections import deque
+
+from .config import FRAME_DELIMITER, MAX_FRAME_SIZE
+
+class FRAMING:
+    RAW = "raw" # Every recv is one message (legacy).
+    DELIMITER = "delimiter" # Messages end with FRAME_DELIMITER.
+    LENGTH = "length" # Messages start with a 4 byte big-endian length.
+    MODES = {RAW, DELIMITER, LENGTH}
+
+class FrameCodec:
+    """
+    Incremental framing codec for stream sockets.
+    Bytes from recv are fed in as they arrive, complete messages come out in order
+    no matter how the stream was split or glued together by the transport.
+    """
+    LENGTH_HEADER = struct.Struct(">I")
+
+    def __init__(self, mode: str = FRAMING.RAW, delimiter: bytes = FRAME_DELIMITER, max_size: int = MAX_FRAME_SIZE) -> None:
+        if mode not in FRAMING.MODES:
+            raise ValueError(f"Unknown framing mode: {mode}")
+        self.mode = mode
+        self.delimiter = delimiter
+        self.max_size = max_size
+        self.buffer = bytearray() # Reused across reads, holds the incomplete tail.
+        self.messages = deque()
+
+    # Drop any partial message, e.g. after the peer reconnects.
+    def reset(self) -> None:
+        self.buffer.clear()
+        self.messages.clear()
+
+    def encode(self, message: bytes) -> bytes:
+        if self.mode == FRAMING.DELIMITER:
+            return message + self.delimiter
+        if self.mode == FRAMING.LENGTH:
+            return self.LENGTH_HEADER.pack(len(message)) + message
+        return message
+
+    # Feed received bytes, returns the number of complete messages now waiting.
+    def feed(self, data: bytes) -> int:
+        if self.mode == FRAMING.RAW:
+            message = data.strip()
+            if len(message) > 0:
+                self.messages.append(message)
+            return len(self.messages)
+
+        self.buffer += data
+        if self.mode == FRAMING.DELIMITER:
+            self.split_delimited()
+        else:
+            self.split_length_prefixed()
+        if len(self.buffer) > self.max_size:
+            self.buffer.clear()
+            raise ValueError(f"Frame exceeds {self.max_size} bytes, receive buffer dropped.")
+        return len(self.messages)
+
+    def split_delimited(self) -> None:
+        start = 0
+        while True:
+            end = self.buffer.find(self.delimiter, start)
+            if end < 0:
+                break
+            message = bytes(self.buffer[start:end]).strip()
+            if len(message) > 0:
+                self.messages.append(message)
+            start = end + len(self.delimiter)
+        del self.buffer[:start]
+
+    def split_length_prefixed(self) -> None:
+        start, header_size = 0, self.LENGTH_HEADER.size
+        while len(self.buffer) - start >= header_size:
+            (length,) = self.LENGTH_HEADER.unpack_from(self.buffer, start)
+            if length > self.max_size:
+                self.buffer.clear()
+                raise ValueError(f"Frame of {length} bytes exceeds {self.max_size} bytes, receive buffer dropped.")
+            if len(self.buffer) - start - header_size < length:
+                break
+            self.messages.append(bytes(self.buffer[start + header_size:start + header_size + length]))
+            start += header_size + length
+        del self.buffer[:start]
+
+    # Next complete message, or None if there is none yet.
+    def next(self) -> bytes:
+        return self.messages.popleft() if self.messages else None
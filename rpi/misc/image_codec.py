@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+from .config import JPEG_QUALITY
+
+TRANSPORTS = ("raw", "jpeg")
+
+# Compress a frame for send_jpg, the array keeps its channel order.
+def encode_jpeg(image: np.ndarray, quality: int = JPEG_QUALITY) -> np.ndarray:
+    success, buffer = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not success:
+        raise ValueError("JPEG encoding failed.")
+    return buffer
+
+# Scale a frame to fit size x size keeping its aspect ratio and pad the rest with grey, like yolov5's letterbox.
+# The metadata lets the server map boxes back to the captured frame.
+def letterbox(image: np.ndarray, size: int) -> tuple:
+    height, width = image.shape[:2]
+    gain = min(size / height, size / width)
+    new_w, new_h = round(width * gain), round(height * gain)
+    pad_w, pad_h = (size - new_w) / 2, (size - new_h) / 2
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    top, bottom = round(pad_h - 0.1), round(pad_h + 0.1)
+    left, right = round(pad_w - 0.1), round(pad_w + 0.1)
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return padded, {"gain": gain, "pad": [left, top], "shape": [height, width]}
+
+# Rebuild a frame sent with either send_image (metadata has dtype and shape) or send_jpg.
+def decode_frame(metadata: dict, buffer) -> np.ndarray:
+    if "dtype" in metadata:
+        return np.frombuffer(buffer, dtype=metadata["dtype"]).reshape(metadata["shape"])
+    return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
@@ -0,0 +1,174 @@
+import os
+import sys
+import atexit
+import signal
+import time
+import threading
+from collections import deque
+from multiprocessing import util
+
+from .config import LOG_LEVEL, LOG_BUFFER_SIZE, LOG_FLUSH_INTERVAL, LOG_FILE
+
+class LEVEL:
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    OFF = 100
+    NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+    # Names accepted for LOG_LEVEL and --log_level, case-insensitive, WARN as it is printed.
+    BY_NAME = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "WARN": WARNING, "ERROR": ERROR, "OFF": OFF}
+
+    @classmethod
+    def parse(cls, name: str) -> int:
+        try:
+            return cls.BY_NAME[name.upper()]
+        except KeyError:
+            raise ValueError(f"Unknown log level {name!r}, one of {', '.join(cls.BY_NAME)}") from None
+
+class LogBuffer:
+    """
+    Per-process ring buffer of log records, written out by a background thread.
+    A call on the hot path only appends a tuple: formatting and the write to stdout (slow over SSH)
+    happen on the writer thread. When the writer falls behind, the oldest records are dropped and counted,
+    the caller never waits.
+    Forked processes (MultiProcessing's link workers) start with an empty buffer and their own writer,
+    and flush it when they exit, also when reconnecting terminate()s them (SIGTERM).
+    Records are still lost when a process is killed with SIGKILL or dies in C code.
+    """
+    def __init__(self, size: int = LOG_BUFFER_SIZE, interval: float = LOG_FLUSH_INTERVAL, path: str = LOG_FILE) -> None:
+        self.size = size
+        self.interval = interval
+        self.path = path
+        self.start()
+
+    def start(self) -> None:
+        self.records = deque(maxlen=self.size)
+        self.dropped = 0 # Records pushed out of the full buffer before they were written.
+        # Serialises writers, flush() can run next to the writer thread.
+        # Reentrant for flush_and_terminate, which can interrupt a flush on the same thread.
+        self.lock = threading.RLock()
+        self.writer = threading.Thread(target=self.run, name="[Log Writer]", daemon=True)
+        self.writer.start()
+
+    def append(self, record: tuple) -> None:
+        if len(self.records) == self.size:
+            self.dropped += 1
+        self.records.append(record)
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    # Write out everything buffered, also called at exit.
+    def flush(self) -> None:
+        with self.lock:
+            lines = []
+            while True:
+                try:
+                    at, level, tag, message, args, fields = self.records.popleft()
+                except IndexError:
+                    break
+                lines.append(format_record(at, level, tag, message, args, fields))
+            if self.dropped:
+                lines.append(format_record(time.monotonic(), LEVEL.WARNING, "Log", "%d records dropped, the writer fell behind", (self.dropped,), None))
+                self.dropped = 0
+            if not lines:
+                return
+            text = "\n".join(lines) + "\n"
+            if self.path is None:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            else:
+                with open(self.path, "a") as file:
+                    file.write(text)
+
+# "<monotonic seconds> LEVEL [Tag] message key=value ...", the message is %-formatted with args only now.
+# e.g. log.info("Obstacle Stages", capture=0.068, total=0.442) -> "... INFO  [Main] Obstacle Stages capture=0.068000 total=0.442000"
+def format_record(at: float, level: int, tag: str, message: str, args: tuple, fields: dict) -> str:
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError):
+            message = f"{message} {args}"
+    if fields:
+        message += " " + " ".join(f"{key}={value:.6f}" if isinstance(value, float) else f"{key}={value}" for key, value in fields.items())
+    return f"{at:.6f} {LEVEL.NAMES[level]:<5} [{tag}] {message}"
+
+def disabled(*args, **fields) -> None:
+    pass
+
+class Logger:
+    """
+    Logger for one tag (a link or a component, e.g. STM, Android, Main).
+    log.info("Message to STM: %s", message) stores the arguments, they are only formatted when written.
+    Extra keyword arguments are appended as key=value fields.
+    Levels below the threshold are replaced by a function that does nothing, so a disabled call costs only the call.
+    """
+    def __init__(self, tag: str) -> None:
+        self.tag = tag
+        self.configure(threshold)
+
+    def configure(self, level: int) -> None:
+        for method_level, name in ((LEVEL.DEBUG, "debug"), (LEVEL.INFO, "info"), (LEVEL.WARNING, "warning"), (LEVEL.ERROR, "error")):
+            if method_level >= level:
+                # Drop the no-op bound on the instance, back to the class method.
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, disabled)
+
+    def log(self, level: int, message: str, args: tuple, fields: dict) -> None:
+        buffer.append((time.monotonic(), level, self.tag, message, args, fields))
+
+    def debug(self, message: str, *args, **fields) -> None:
+        self.log(LEVEL.DEBUG, message, args, fields)
+
+    def info(self, message: str, *args, **fields) -> None:
+        self.log(LEVEL.INFO, message, args, fields)
+
+    def warning(self, message: str, *args, **fields) -> None:
+        self.log(LEVEL.WARNING, message, args, fields)
+
+    def error(self, message: str, *args, **fields) -> None:
+        self.log(LEVEL.ERROR, message, args, fields)
+
+threshold = LEVEL.parse(LOG_LEVEL)
+loggers = {} # Tag -> Logger.
+buffer = LogBuffer()
+
+def get_logger(tag: str) -> Logger:
+    if tag not in loggers:
+        loggers[tag] = Logger(tag)
+    return loggers[tag]
+
+# Change the level of every logger, e.g. from main.py --log_level.
+def set_level(level) -> None:
+    global threshold
+    threshold = LEVEL.parse(level) if isinstance(level, str) else level
+    for logger in loggers.values():
+        logger.configure(threshold)
+
+def flush() -> None:
+    buffer.flush()
+
+def after_fork() -> None:
+    # The parent writes what was buffered before the fork, the writer thread didn't survive it.
+    buffer.start()
+
+# multiprocessing ends its children with os._exit, which skips atexit,
+# and clears the finalizers of the parent once forked, so this is registered in the child.
+def register_flush(buffer: LogBuffer) -> None:
+    util.Finalize(None, flush, exitpriority=0)
+    # Process.terminate() (reconnect_stm, reconnect_android, ...) sends SIGTERM, which ends the process without either.
+    signal.signal(signal.SIGTERM, flush_and_terminate)
+
+# Write out what the process buffered, then terminate as SIGTERM would have.
+def flush_and_terminate(signum: int, frame) -> None:
+    flush()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+os.register_at_fork(after_in_child=after_fork)
+util.register_after_fork(buffer, register_flush)
+atexit.register(flush)
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import struct
+from collections import namedtuple
+
+from .protocols import RPI_HEADER, RPIToAlgorithm, RPIToAndroid
+from .config import FORMAT
+
+class LINK:
+    STM = 0
+    ANDROID = 1
+    ALGORITHM = 2
+    IMAGE = 3 # Image id sent, reply received, the frames themselves are not kept.
+    NAMES = {STM: "stm", ANDROID: "android", ALGORITHM: "algorithm", IMAGE: "image"}
+
+class DIRECTION:
+    IN = 0 # Device -> RPi.
+    OUT = 1 # RPi -> device.
+
+Record = namedtuple("Record", ["time_ns", "link", "direction", "payload"])
+
+# Messages are bytes, except image ids which can be text or a number.
+def encode_payload(payload) -> bytes:
+    if isinstance(payload, bytes):
+        return payload
+    return str(payload).encode(FORMAT)
+
+class Recorder:
+    """
+    Append-only binary log of every message crossing the RPi's links.
+    File: MAGIC, a length-prefixed JSON header with the run's settings, then one record per message:
+    monotonic time (ns), link, direction, payload length and payload.
+    Each record is a single write on an O_APPEND descriptor, so the link processes of MultiProcessing,
+    which inherit it, can log concurrently without locking or interleaving.
+    """
+    MAGIC = b"MDPLOG1\n"
+    HEADER = struct.Struct(">I")
+    RECORD = struct.Struct(">QBBI")
+
+    def __init__(self, path: str, settings: dict = None) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        header = json.dumps(settings or {}).encode(FORMAT)
+        os.write(self.fd, self.MAGIC + self.HEADER.pack(len(header)) + header)
+
+    # Processes started with spawn reopen the log instead of inheriting the descriptor.
+    def __getstate__(self) -> dict:
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.path = state["path"]
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def record(self, link: int, direction: int, payload) -> None:
+        payload = encode_payload(payload)
+        os.write(self.fd, self.RECORD.pack(time.monotonic_ns(), link, direction, len(payload)) + payload)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class RecordedLink:
+    """
+    Wraps a device (STM, Android, Algorithm or ImageClient) and logs what goes through recv and send.
+    A reply returned by send (the image server's) is logged as an incoming message.
+    Everything else is passed through to the device.
+    """
+    def __init__(self, device, recorder: Recorder, link: int) -> None:
+        self.device = device
+        self.recorder = recorder
+        self.link = link
+
+    def __getattr__(self, name: str):
+        # Not found on the wrapper, e.g. connect -> device.connect.
+        if name == "device":
+            raise AttributeError(name)
+        return getattr(self.device, name)
+
+    def recv(self, *args, **kwargs):
+        message = self.device.recv(*args, **kwargs)
+        if message is not None:
+            self.recorder.record(self.link, DIRECTION.IN, message)
+        return message
+
+    def send(self, message, *args, **kwargs):
+        self.recorder.record(self.link, DIRECTION.OUT, message)
+        reply = self.device.send(message, *args, **kwargs)
+        if reply is not None:
+            self.recorder.record(self.link, DIRECTION.IN, reply)
+        return reply
+
+# Settings from the header and the records of a log.
+def read_log(path: str) -> tuple:
+    with open(path, "rb") as file:
+        data = file.read()
+    if not data.startswith(Recorder.MAGIC):
+        raise ValueError(f"{path} is not a link log.")
+    offset = len(Recorder.MAGIC)
+    (length,) = Recorder.HEADER.unpack_from(data, offset)
+    offset += Recorder.HEADER.size
+    settings = json.loads(data[offset:offset + length])
+    offset += length
+
+    records = []
+    # A record cut short by a crash is dropped.
+    while len(data) - offset >= Recorder.RECORD.size:
+        time_ns, link, direction, length = Recorder.RECORD.unpack_from(data, offset)
+        offset += Recorder.RECORD.size
+        if len(data) - offset < length:
+            break
+        records.append(Record(time_ns, link, direction, data[offset:offset + length]))
+        offset += length
+    # Processes append in the order they write, which can differ slightly from the time order.
+    records.sort(key=lambda record: record.time_ns)
+    return settings, records
+
+# Image id 0 resets the image server at the end of exploration (restart_explore).
+def is_reset(record: Record) -> bool:
+    return record.link == LINK.IMAGE and record.direction == DIRECTION.OUT and record.payload == b"0"
+
+# End of an obstacle: next path requested from Algorithm, or exploration finished.
+# restart_explore flushes the queued FINISH/EXPLORE, so the image server reset ends the last obstacle.
+def ends_obstacle(record: Record) -> bool:
+    if record.direction != DIRECTION.OUT:
+        return False
+    if is_reset(record):
+        return True
+    if record.link == LINK.ALGORITHM:
+        return record.payload.startswith(RPI_HEADER + RPIToAlgorithm.REQUEST_ROBOT_NEXT)
+    return record.link == LINK.ANDROID and record.payload.endswith(RPIToAndroid.FINISH_EXPLORE)
+
+def obstacle_latencies(records: list) -> list:
+    """
+    Per obstacle: from the STM DONE or Algorithm message that led to the first image request,
+    to the next path request (or the end of exploration), with the number of image requests and the last reply.
+    Returns a list of dicts with seconds, requests and reply.
+    """
+    obstacles, current, last_trigger = [], None, None
+    for record in records:
+        if record.direction == DIRECTION.IN and record.link in (LINK.STM, LINK.ALGORITHM):
+            last_trigger = record.time_ns
+        if record.link == LINK.IMAGE and not is_reset(record):
+            if record.direction == DIRECTION.OUT:
+                if current is None:
+                    current = {"start": record.time_ns if last_trigger is None else last_trigger, "requests": 0, "reply": None}
+                current["requests"] += 1
+            elif current is not None:
+                current["reply"] = record.payload.decode(FORMAT, errors="replace")
+        elif current is not None and ends_obstacle(record):
+            obstacles.append({"seconds": (record.time_ns - current["start"]) / 1e9, "requests": current["requests"], "reply": current["reply"]})
+            current = None
+    # An obstacle still open at the end of the log, e.g. the image server reset, has no end.
+    return obstacles
@@ -0,0 +1,40 @@
+import time
+
+from .logger import get_logger
+
+class StageTimer:
+    """
+    Splits the time spent on one obstacle into named stages, e.g. capture -> detect -> correction.
+    start() marks the beginning (defaults to now), every stage() records the time since the previous mark.
+    Per-process, only the image worker uses it.
+    """
+    def __init__(self) -> None:
+        self.samples = {}
+        self.current = {}
+        self.mark = None
+
+    def start(self, at: float = None) -> None:
+        self.current = {}
+        self.mark = time.monotonic() if at is None else at
+
+    def stage(self, name: str) -> float:
+        now = time.monotonic()
+        # A stage which is entered twice (e.g. detect on retries) adds up.
+        self.current[name] = self.current.get(name, 0.0) + now - self.mark
+        self.mark = now
+        return self.current[name]
+
+    # Store the stages of this obstacle and return them with the total.
+    def finish(self) -> dict:
+        stages = dict(self.current)
+        stages["total"] = sum(self.current.values())
+        for name, seconds in stages.items():
+            self.samples.setdefault(name, []).append(seconds)
+        self.current = {}
+        return stages
+
+    def report(self, tag: str = "Main") -> None:
+        log = get_logger(tag)
+        log.info("Time per obstacle by stage (mean / max):")
+        for name, samples in self.samples.items():
+            log.info("  %s: n=%s %.3fs / %.3fs", name, len(samples), sum(samples) / len(samples), max(samples))
@@ -1,9 +1,13 @@
 import socket
-from misc.config import ALGO_SOCKET_BUFFER_SIZE, WIFI_IP, PORT, FORMAT
+from misc.framing import FrameCodec
+from misc.config import ALGO_SOCKET_BUFFER_SIZE, ALGO_FRAMING, WIFI_IP, PORT, FORMAT
+from misc.logger import get_logger
+
+log = get_logger("Algo")
 
 class Algorithm:
-    def __init__(self, host=WIFI_IP, port=PORT):
-        print("[Algo] Initialising Algorithm Process")
+    def __init__(self, host=WIFI_IP, port=PORT, framing=ALGO_FRAMING):
+        log.info("Initialising Algorithm Process")
         
         self.host = host
         self.port = port
@@ -11,39 +15,41 @@ class Algorithm:
         self.address = None
         self.client_socket = None
         self.server_socket = None
+        self.codec = FrameCodec(framing)
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen()
-        print(f"[Algo] Server Address at: {self.host}:{self.port}")
+        log.info("Server Address at: %s:%s", self.host, self.port)
     
     # Set-up connection for Algo client.
     def connect(self):
         while True:
             try:
-                print(f'[Algo] Accepting Connection to: {self.host}:{self.port}]')
+                log.info('Accepting Connection to: %s:%s]', self.host, self.port)
                 if self.client_socket is None:
                     self.client_socket, self.address = self.server_socket.accept()
-                    print(f'[Algo] Connected to Algo Server at {self.host}:{self.port}')
+                    self.codec.reset()
+                    log.info('Connected to Algo Server at %s:%s', self.host, self.port)
                     break
             except Exception as error:
-                print(f'[Algo] Failed to setup connection for Algorithm Server at {self.host}:{self.port}')
+                log.error('Failed to setup connection for Algorithm Server at %s:%s', self.host, self.port)
                 self.error_message(error)
                 if self.client_socket is not None:
                     self.client_socket.close()
                     self.client_socket = None
-            print(f'[Algo] Retrying for a connection to {self.host}:{self.port}')
+            log.warning('Retrying for a connection to %s:%s', self.host, self.port)
 
     def disconnect(self):
         try:
             if self.client_socket is not None:
                 self.client_socket.close()
                 self.client_socket = None
-            print(f'[Algo] Disconnected Algorithm Client from Server')
+            log.info('Disconnected Algorithm Client from Server')
 
         except Exception as error:
-            print(f'[[Algo] Failed to disconnect Algorithm Client from Server')
+            log.error('Failed to disconnect Algorithm Client from Server')
             self.error_message(error)
 
     def disconnect_all(self):
@@ -54,35 +60,38 @@ class Algorithm:
             if self.server_socket is not None:
                 self.server_socket.close()
                 self.server_socket = None
-            print(f'[Algo] Disconnected Algorithm sockets')
+            log.info('Disconnected Algorithm sockets')
         except Exception as error:
-            print(f'[Algo] Failed to disconnect Algorithm sockets')
+            log.error('Failed to disconnect Algorithm sockets')
             self.error_message(error)
 
+    # Returns one complete message, reading from the socket until one has arrived.
     def recv(self):
         try:
-            message = self.client_socket.recv(ALGO_SOCKET_BUFFER_SIZE).strip()
-            if len(message) > 0:
-                # print(f'[Algo] Receive Message from Algo Client: {message}')
-                return message
-            return None
+            while not self.codec.messages:
+                data = self.client_socket.recv(ALGO_SOCKET_BUFFER_SIZE)
+                if len(data) == 0:
+                    return None
+                self.codec.feed(data)
+            # log.info(f'Receive Message from Algo Client: {message}')
+            return self.codec.next()
         except Exception as error:
-            print("[Algo] Failed to receive message from Algo Client.")
+            log.error("Failed to receive message from Algo Client.")
             self.error_message(error)
             raise error
 
     def send(self, message):
         try:
-            print(f'[Algo] Message to Algo Client: {message}')
-            self.client_socket.send(message)
+            log.debug('Message to Algo Client: %s', message)
+            self.client_socket.sendall(self.codec.encode(message))
 
         except Exception as error:
-            print("[Algo] Failed to send to Algo Client.")
+            log.error("Failed to send to Algo Client.")
             self.error_message(error)
             raise error
 
     def error_message(self, message):
-        print(f"[Error Message]: {message}")
+        log.error("%s", message)
 
 if __name__ == '__main__':
     server = Algorithm()
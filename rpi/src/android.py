@@ -2,13 +2,18 @@
 import os
 from bluetooth import *
 from misc.status import *
-from misc.config import ANDROID_SOCKET_BUFFER_SIZE, UUID
+from misc.framing import FrameCodec
+from misc.config import ANDROID_SOCKET_BUFFER_SIZE, ANDROID_FRAMING, UUID
+from misc.logger import get_logger
+
+log = get_logger("Android")
 
 class Android:
-    def __init__(self) -> None:
-        print("[Android] Initialising Android Process")
+    def __init__(self, framing=ANDROID_FRAMING) -> None:
+        log.info("Initialising Android Process")
         self.server_socket = None
         self.client_socket = None
+        self.codec = FrameCodec(framing)
         os.system("sudo hciconfig hci0 piscan")
         self.server_socket = BluetoothSocket(RFCOMM)
         self.server_socket.bind(("", PORT_ANY))
@@ -22,22 +27,23 @@ class Android:
             profiles=[SERIAL_PORT_PROFILE],
             protocols = [ OBEX_UUID ]
         )
-        print(f'[Android] Server Bluetooth Socket: {str(self.server_socket)}')
+        log.info('Server Bluetooth Socket: %s', self.server_socket)
     
     def connect(self) -> None:
         retry = True
         while retry:
             try:
-                print(f"[Android] Listening on RFCOMM channel: {self.port}...")
+                log.info("Listening on RFCOMM channel: %s...", self.port)
                 if self.client_socket == None:
                     self.client_socket, client_addr = self.server_socket.accept()
-                    print(f"[Android] Bluetooth established connection at address: {str(client_addr)}")
+                    self.codec.reset()
+                    log.info("Bluetooth established connection at address: %s", client_addr)
                     retry = False
             except Exception as error:
-                print(f"[Android] Failed to establish Bluetooth Connection: {str(error)}")
+                log.error("Failed to establish Bluetooth Connection: %s", error)
                 self.disconnect_client()
                 retry = True
-                print(f"[Android] Retrying Bluetooth Connection...")
+                log.warning("Retrying Bluetooth Connection...")
 
     def disconnect_client(self) -> None:
         try:
@@ -45,7 +51,7 @@ class Android:
                 self.client_socket.close()
                 self.client_socket = None
         except Exception as error:	
-            print(f"[Android] Fail to disconnect Client Socket: {str(error)}")
+            log.error("Fail to disconnect Client Socket: %s", error)
 
     def disconnect_server(self) -> None:
         try:
@@ -53,32 +59,32 @@ class Android:
                 self.server_socket.close()
                 self.server_socket = None
         except Exception as error:	
-            print(f"[Android] Fail to disconnect Server Socket: {str(error)}")
+            log.error("Fail to disconnect Server Socket: %s", error)
 
     def disconnect_all(self) -> None:
         self.disconnect_client()
         self.disconnect_server()
 
-    # Receive from Android Interface
+    # Receive one complete message from Android Interface
     def recv(self) -> None:
         try:
-            message = self.client_socket.recv(ANDROID_SOCKET_BUFFER_SIZE).strip()
-            if message is None:
-                return None
-            if len(message) > 0:
-                return message
-            return None
+            while not self.codec.messages:
+                data = self.client_socket.recv(ANDROID_SOCKET_BUFFER_SIZE)
+                if data is None or len(data) == 0:
+                    return None
+                self.codec.feed(data)
+            return self.codec.next()
         except Exception as error:
-            print(f"[Android] Fail to recieve message from Android {str(error)}")
+            log.error("Fail to recieve message from Android %s", error)
             raise error
     
     # Send To Android Interface
     def send(self, message) -> None:
         try:
-            print(f'[Android] Message to Android: {message}')
-            self.client_socket.send(message)
+            log.debug('Message to Android: %s', message)
+            self.client_socket.sendall(self.codec.encode(message))
         except Exception as error:	
-            print(f"[Android] Fail to send {str(error)}")
+            log.error("Fail to send %s", error)
             raise error
 
 # Standalone testing.
@@ -0,0 +1,315 @@
+# Stuff
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Configuration + Protocols
+from misc.config import *
+from misc.protocols import *
+from misc.calibration import *
+from misc.timing import StageTimer
+from misc.logger import get_logger
+
+# Interfaces
+from .stm import STM
+from .android import Android
+from .algorithm import Algorithm
+from .router import Router
+from .robot_state import RobotState
+from .flow_control import AsyncSTMFlowControl
+from .camera import CameraService, CAMERA_BACKENDS
+
+log = get_logger("Main")
+
+class AsyncGateway(Router):
+    """
+    Single process alternative to MultiProcessing.
+    Drives STM, Android, Algorithm and the Image Processing Server from one asyncio event loop.
+    Blocking device reads run on the loop's default executor, routing is shared with MultiProcessing.
+    """
+    def __init__(self, image_processing_server: str, android_on: bool, stm_on: bool, algo_on: bool, env : str, ack_timeout: float = STM_ACK_TIMEOUT, camera: str = CAMERA_BACKEND, pipeline: bool = PIPELINED_EXPLORATION, burst: int = IMAGE_BURST_FRAMES, letterbox: int = IMAGE_LETTERBOX, record: str = RECORD_LOG, serial_port: list = SERIAL_PORT) -> None:
+
+        log.info("__init__ Async Gateway Communication")
+        self.calibration = Calibration(env) # Set calibration mode.
+        self.ack_timeout = ack_timeout
+        # Pipelined: the image worker captures, and correction overlaps the next path request.
+        self.pipeline = pipeline
+        self.burst = burst # Frames per detection request.
+        self.letterbox = letterbox # Model input size to letterbox frames to before sending, 0 for off.
+        self.stage_timer = StageTimer()
+        log.info("Running Environment: %s", env)
+
+        # Mode, image count, coordinates for correction and STM readiness.
+        self.state = RobotState()
+        self.stm = self.android = self.algorithm = self.camera = None
+        self.image_processing_server = image_processing_server
+        self.loop = self.executor = self.stm_flow = self.tasks = self.stm_task = self.stm_read = None
+
+        if stm_on:
+            log.info("Running with STM interface.")
+            self.stm = STM(serial_port, env=env)
+        if android_on:
+            log.info("Running with Android interface.")
+            self.android = Android()
+        if algo_on:
+            log.info("Running with Algorithm interface.")
+            self.algorithm = Algorithm()
+        if image_processing_server is not None:
+            log.info("Running with Image Processing.")
+            # Capture thread instead of a process, to stay in one process.
+            self.camera = CameraService(CAMERA_BACKENDS[camera](), use_process=False)
+
+        # Log of every link message, replayed by etc/replay.py.
+        self.recorder = self.metrics = None
+        if record is not None:
+            self.record_links(record, {"env": env, "pipeline": pipeline, "burst": burst, "letterbox": letterbox})
+
+        self.build_dispatch_tables()
+
+    # Start the event loop -> Called from main.py
+    def start(self) -> None:
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        # Queues and events are bound to the running loop, so create them here.
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(thread_name_prefix="[Async Gateway]")
+        self.loop.set_default_executor(self.executor)
+        self.stm_flow = AsyncSTMFlowControl(ack_timeout=self.ack_timeout)
+        self.to_stm_message_queue = asyncio.Queue()
+        self.to_android_message_queue = asyncio.Queue()
+        self.to_algo_message_queue = asyncio.Queue()
+        self.image_queue = asyncio.Queue()
+
+        try:
+            workers = []
+            if self.stm is not None:
+                await self.blocking(self.stm.connect)
+                workers.append(self.stm_link)
+            if self.android is not None:
+                await self.blocking(self.android.connect)
+                workers += [self.recv_from_android, self.send_to_android]
+            if self.algorithm is not None:
+                await self.blocking(self.algorithm.connect)
+                workers += [self.recv_from_algorithm, self.send_to_algorithm]
+            if self.image_processing_server is not None:
+                self.camera.start()
+                workers.append(self.image_processing)
+
+            self.tasks = [asyncio.ensure_future(worker()) for worker in workers]
+            if self.stm is not None:
+                self.stm_task = self.tasks[workers.index(self.stm_link)]
+            log.info('Async Gateway Communication has successfully started.')
+            # restart_explore replaces the STM link's task, so wait on whichever tasks are current.
+            while True:
+                pending = [task for task in self.tasks if not task.done()]
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+        finally:
+            # asyncio.run waits for the executor, whose threads block in recv until the links are closed.
+            self.close_links()
+
+    # Shut down all links -> Called from main.py
+    def end(self) -> None:
+        self.close_links()
+        if self.stm_flow is not None: self.stm_flow.histogram.report()
+        self.state.close(unlink=True)
+        if self.recorder is not None: self.recorder.close()
+        log.info("Async Gateway Communication has successfully ended.")
+
+    # Cancel the workers and close every link, safe to call more than once.
+    def close_links(self) -> None:
+        for task in self.tasks or []:
+            task.cancel()
+        if self.stm is not None: self.stm.disconnect()
+        if self.android is not None: self.android.disconnect_all()
+        if self.algorithm is not None: self.algorithm.disconnect_all()
+        if self.camera is not None: self.camera.stop()
+
+    # Run a blocking device call without blocking the event loop.
+    def blocking(self, function, *args):
+        return self.loop.run_in_executor(None, function, *args)
+
+    # Restart exploration, called from the routing handlers.
+    def restart_explore(self) -> None:
+        log.info("============= Restarting Exploration =============")
+        for message_queue in [self.to_stm_message_queue, self.to_algo_message_queue, self.to_android_message_queue, self.image_queue]:
+            while not message_queue.empty():
+                message_queue.get_nowait()
+        log.info("Message Queues have been flushed.")
+        if self.stm is not None:
+            # Stop the path being sent and reconnect, like MultiProcessing's reconnect_stm.
+            # Cancelled here so that a second STOP cancels the reconnection instead of starting another link.
+            task = self.stm_task
+            task.cancel()
+            self.stm_task = asyncio.ensure_future(self.reconnect_stm(task))
+            self.tasks[self.tasks.index(task)] = self.stm_task
+        if self.image_processing_server is not None:
+            # Reset Image detected in the Image Server.
+            asyncio.ensure_future(self.reset_image_server())
+        log.info("==================================================")
+
+    # Reconnect STM once the cancelled link has stopped, then reset the flow control and run the link again.
+    async def reconnect_stm(self, task: asyncio.Task) -> None:
+        # Waits without raising the task's CancelledError, a STOP cancelling this reconnection still raises here.
+        await asyncio.wait([task])
+        # The read in flight keeps its thread until STM_READ_TIMEOUT, don't close the port under it.
+        if self.stm_read is not None:
+            await self.blocking(wait, [self.stm_read])
+        log.info("Disconnecting STM.")
+        await self.blocking(self.stm.disconnect)
+        await self.blocking(self.stm.connect)
+        # DONEs of the old link are gone with it.
+        self.stm_flow.reset()
+        self.stm_flow.histogram.report()
+        log.info("STM has been Reconnected")
+        await self.stm_link()
+
+    async def reset_image_server(self) -> None:
+        image = await self.blocking(self.take_picture)
+        log.info("Taking Picture of Restarting Exploration.")
+        image_client = self.open_image_client(metered=False)
+        try:
+            await self.blocking(image_client.send, 0, image)
+        except TimeoutError as error:
+            self.error_message(error)
+        image_client.close()
+
+    # Take picture of obstacle manually.
+    def capture_obstacle(self, obstacle_id: bytes) -> None:
+        asyncio.ensure_future(self.queue_picture(obstacle_id))
+
+    async def queue_picture(self, image_id) -> None:
+        requested_at = time.monotonic()
+        if self.pipeline:
+            self.image_queue.put_nowait([None, image_id, requested_at])
+            return
+        frames = await self.blocking(self.take_burst)
+        log.info('RPI Picture Taken')
+        self.image_queue.put_nowait([frames, image_id, requested_at])
+
+    """
+    1. Android (Recv, Send)
+    """
+    async def recv_from_android(self) -> None:
+        while True:
+            try:
+                raw_message = await self.blocking(self.android.recv)
+                if raw_message is None:
+                    continue
+                for message in raw_message.split(MESSAGE_SEPARATOR):
+                    self.handle_android_message(message)
+            except Exception as error:
+                # Peer has reset bluetooth network -> Restart now.
+                log.error("Reading android has failed")
+                self.error_message(error)
+                self.android.disconnect_client()
+                await self.blocking(self.android.connect)
+
+    async def send_to_android(self) -> None:
+        while True:
+            message = await self.to_android_message_queue.get()
+            try:
+                self.android.send(message)
+            except Exception as error:
+                log.error('send_to_android has failed')
+                self.error_message(error)
+
+    """
+    2. Algorithm (Recv, Send)
+    """
+    async def recv_from_algorithm(self) -> None:
+        while True:
+            try:
+                raw_message = await self.blocking(self.algorithm.recv)
+                if raw_message is None:
+                    continue
+                for raw in raw_message.split(MESSAGE_SEPARATOR):
+                    self.handle_algorithm_message(raw)
+            except Exception as error:
+                log.error("Error Reading Algorithm")
+                self.error_message(error)
+                self.algorithm.disconnect()
+                await self.blocking(self.algorithm.connect)
+
+    async def send_to_algorithm(self) -> None:
+        while True:
+            message = await self.to_algo_message_queue.get()
+            try:
+                self.algorithm.send(message)
+            except Exception as error:
+                log.error('send_to_algorithm has failed')
+                self.error_message(error)
+
+    """
+    3. STM (Recv, Send)
+    """
+    # Both directions of the STM link, one task so that restart_explore cancels them together.
+    async def stm_link(self) -> None:
+        await asyncio.gather(self.recv_from_stm(), self.send_to_stm())
+
+    async def recv_from_stm(self) -> None:
+        backoff = STM_READ_BACKOFF
+        while True:
+            try:
+                # Kept, so that reconnect_stm can wait for the read after cancelling this worker.
+                self.stm_read = self.executor.submit(self.stm.recv)
+                raw_message = await asyncio.wrap_future(self.stm_read)
+                backoff = STM_READ_BACKOFF
+                if raw_message is None:
+                    continue
+                for message in raw_message.split(MESSAGE_SEPARATOR):
+                    if self.handle_stm_message(message):
+                        self.stm_flow.acknowledge()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                # A closed or failing port raises at once, back off instead of spinning on it.
+                log.error('STM Read Error, retrying in %ss', backoff)
+                self.error_message(error)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, STM_READ_BACKOFF_MAX)
+
+    async def send_to_stm(self) -> None:
+        while True:
+            message = await self.to_stm_message_queue.get()
+            try:
+                await self.execute_stm_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                log.error('send_to_stm has failed')
+                self.error_message(error)
+
+    """
+    4. Image Processing
+    """
+    async def image_processing(self) -> None:
+        # initialize the ImageClient object with the socket address of the server
+        image_client = self.open_image_client(letterbox=self.letterbox)
+        while True:
+            # [frames, image id, time of the request], frames is None when this worker has to capture them.
+            frames, image_id, requested_at = await self.image_queue.get()
+            try:
+                await self.process_image(image_client, frames, image_id, requested_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                log.error('Error - Image processing failed')
+                self.error_message(error)
+
+    """
+    5. Hooks of the shared STM and image steps (Router), awaited on the event loop.
+    """
+    # Queue a move and sleep until send_to_stm has executed it.
+    async def move(self, message) -> None:
+        self.stm_flow.move_done.clear()
+        self.to_stm_message_queue.put_nowait(message)
+        await self.stm_flow.move_done.wait()
+
+    async def send_command(self, command: bytes) -> None:
+        await self.stm_flow.send(self.stm, command)
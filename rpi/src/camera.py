@@ -0,0 +1,165 @@
+import os
+import cv2
+import time
+import threading
+import numpy as np
+from multiprocessing import Process, Condition, Event, RawArray, RawValue
+from multiprocessing.shared_memory import SharedMemory
+
+from misc.config import *
+from misc.logger import get_logger
+
+log = get_logger("Camera")
+
+class CameraBackend:
+    """
+    Source of frames for CameraService. capture() returns one BGR frame of IMAGE_HEIGHT x IMAGE_WIDTH x 3.
+    """
+    def open(self) -> None:
+        pass
+
+    def capture(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class PiCameraBackend(CameraBackend):
+    # Keeps the sensor open and streams from the video port.
+    def __init__(self, framerate: int = CAMERA_FRAMERATE) -> None:
+        self.framerate = framerate
+        self.camera = self.stream = self.raw_capture = None
+
+    def open(self) -> None:
+        from picamera import PiCamera
+        from picamera.array import PiRGBArray
+        self.camera = PiCamera(resolution=(IMAGE_WIDTH, IMAGE_HEIGHT), framerate=self.framerate)
+        self.camera.rotation = 0
+        # camera.brightness = 50
+        self.camera.iso = 700
+        self.raw_capture = PiRGBArray(self.camera, size=(IMAGE_WIDTH, IMAGE_HEIGHT))
+        # allow the camera to warmup
+        time.sleep(CAMERA_WARMUP)
+        self.stream = self.camera.capture_continuous(self.raw_capture, format=IMAGE_FORMAT, use_video_port=True)
+
+    def capture(self) -> np.ndarray:
+        self.raw_capture.truncate(0)
+        return next(self.stream).array
+
+    def close(self) -> None:
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+
+class FileCameraBackend(CameraBackend):
+    # Serves the images in a directory in a loop, for testing without a camera.
+    def __init__(self, directory: str = CAMERA_FILE_DIR, framerate: int = CAMERA_FRAMERATE) -> None:
+        self.directory = directory
+        self.interval = 1 / framerate
+        self.paths = []
+        self.index = 0
+
+    def open(self) -> None:
+        self.paths = sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.lower().endswith((".jpg", ".jpeg", ".png")))
+        if not self.paths:
+            raise IOError(f"No images in {self.directory}")
+
+    def capture(self) -> np.ndarray:
+        time.sleep(self.interval)
+        image = cv2.imread(self.paths[self.index % len(self.paths)])
+        self.index += 1
+        return cv2.resize(image, (IMAGE_WIDTH, IMAGE_HEIGHT))
+
+CAMERA_BACKENDS = {
+    "picamera": PiCameraBackend,
+    "file": FileCameraBackend,
+}
+
+class CameraService:
+    """
+    Long-lived camera which keeps the sensor open and fills a small ring buffer of frames in shared memory.
+    take_picture() copies the freshest frame out of the ring instead of opening the camera for every shot.
+    The capture loop runs in its own process, or in a thread for the single process runtime.
+    """
+    def __init__(self, backend: CameraBackend, slots: int = CAMERA_RING_SLOTS, use_process: bool = True) -> None:
+        self.backend = backend
+        self.slots = slots
+        self.use_process = use_process
+        self.shape = (IMAGE_HEIGHT, IMAGE_WIDTH, 3)
+        self.frame_size = IMAGE_HEIGHT * IMAGE_WIDTH * 3
+        self.memory = SharedMemory(create=True, size=self.frame_size * slots)
+
+        # Per slot: capture time and a generation which is odd while the slot is being written.
+        self.timestamps = RawArray('d', slots)
+        self.generations = RawArray('L', slots)
+        self.latest = RawValue('i', -1)
+        self.new_frame = Condition()
+        self.stopped = Event()
+        self.worker = None
+
+    def start(self) -> None:
+        target, name = self.capture_loop, "[Camera Process]"
+        self.worker = Process(target=target, name=name) if self.use_process else threading.Thread(target=target, name=name, daemon=True)
+        self.worker.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.worker is not None:
+            self.worker.join(timeout=PROCESS_JOIN_TIMEOUT)
+            if self.use_process and self.worker.is_alive():
+                self.worker.terminate()
+        self.memory.close()
+        self.memory.unlink()
+
+    def frame(self, slot: int) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.memory.buf, offset=slot * self.frame_size)
+
+    def capture_loop(self) -> None:
+        try:
+            self.backend.open()
+            log.info("Camera service started with %s.", type(self.backend).__name__)
+            slot = 0
+            while not self.stopped.is_set():
+                image = self.backend.capture()
+                timestamp = time.monotonic()
+                self.generations[slot] += 1
+                self.frame(slot)[:] = image
+                self.generations[slot] += 1
+                with self.new_frame:
+                    self.timestamps[slot] = timestamp
+                    self.latest.value = slot
+                    self.new_frame.notify_all()
+                slot = (slot + 1) % self.slots
+        except Exception as error:
+            log.error("Camera service failed: %s", error)
+        finally:
+            self.backend.close()
+
+    # count consecutive frames, the first one captured at or after fresh_after.
+    def take_burst(self, count: int, fresh_after: float = None, timeout: float = CAMERA_FRAME_TIMEOUT) -> list:
+        frames = []
+        for _ in range(count):
+            frames.append(self.take_picture(fresh_after, timeout))
+            # The next frame has to be captured after this one was copied, so no frame is sent twice.
+            fresh_after = time.monotonic()
+        return frames
+
+    # Freshest frame captured at or after fresh_after (time.monotonic()), defaults to now.
+    def take_picture(self, fresh_after: float = None, timeout: float = CAMERA_FRAME_TIMEOUT) -> np.ndarray:
+        fresh_after = time.monotonic() if fresh_after is None else fresh_after
+        with self.new_frame:
+            ready = self.new_frame.wait_for(
+                lambda: self.latest.value >= 0 and self.timestamps[self.latest.value] >= fresh_after, timeout)
+            slot = self.latest.value
+        if not ready:
+            raise TimeoutError(f"No camera frame within {timeout}s.")
+        while True:
+            generation = self.generations[slot]
+            image = self.frame(slot).copy()
+            # Retry if the writer lapped the ring while copying.
+            if generation % 2 == 0 and generation == self.generations[slot]:
+                return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            with self.new_frame:
+                slot = self.latest.value
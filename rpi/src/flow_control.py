@@ -0,0 +1,179 @@
+import time
+import asyncio
+from multiprocessing import Array, Event, Value
+
+from misc.config import STM_ACK_TIMEOUT, STM_ACK_RESENDS, STM_RESEND_TYPES, STM_COMMAND_DELAY, STM_LATENCY_BUCKETS
+from misc.logger import get_logger
+
+log = get_logger("Main")
+
+class LatencyHistogram:
+    """
+    Command-to-DONE latency per STM command type, kept in shared memory so every process can read it.
+    """
+    COMMAND_TYPES = ["W", "S", "I", "P", "TURN", "L"] # L runs the whole of Task 2, DONE comes at the end.
+
+    def __init__(self, buckets: list = STM_LATENCY_BUCKETS) -> None:
+        # Upper bound (seconds) of every bucket, the last bucket catches everything above.
+        self.buckets = buckets
+        self.width = len(buckets) + 1
+        self.counts = Array('i', len(self.COMMAND_TYPES) * self.width)
+        self.totals = Array('d', len(self.COMMAND_TYPES))
+
+    @classmethod
+    def command_type(cls, command: bytes) -> str:
+        # W0100x0000 -> W, anything not straight, setup or Task 2 is a turn.
+        header = command[:1].decode()
+        return header if header in cls.COMMAND_TYPES else "TURN"
+
+    def record(self, command: bytes, latency: float) -> None:
+        row = self.COMMAND_TYPES.index(self.command_type(command))
+        column = len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if latency <= bound:
+                column = index
+                break
+        with self.counts.get_lock():
+            self.counts[row * self.width + column] += 1
+        with self.totals.get_lock():
+            self.totals[row] += latency
+
+    def summary(self) -> dict:
+        summary = {}
+        for row, command_type in enumerate(self.COMMAND_TYPES):
+            counts = self.counts[row * self.width:(row + 1) * self.width]
+            total = sum(counts)
+            summary[command_type] = {
+                "count": total,
+                "mean": self.totals[row] / total if total else 0.0,
+                "buckets": counts,
+            }
+        return summary
+
+    def report(self) -> None:
+        labels = [f"<={bound}s" for bound in self.buckets] + [f">{self.buckets[-1]}s"]
+        log.info("STM command-to-DONE latency:")
+        for command_type, stats in self.summary().items():
+            if not stats["count"]:
+                continue
+            buckets = ", ".join(f"{label}: {count}" for label, count in zip(labels, stats["buckets"]) if count)
+            log.info("  %s: n=%d mean=%.3fs %s", command_type, stats['count'], stats['mean'], buckets)
+
+class STMFlowControl:
+    """
+    Flow control between recv_from_stm and send_to_stm.
+    The sender waits on an Event which recv_from_stm sets when STM_PROTOCOL.DONE arrives.
+    A watchdog times out a lost DONE, resends idempotent commands and then releases the link.
+    DONE carries no command: any DONE while a command is resent acknowledges it, whichever send it answers,
+    but a DONE arriving late for a released command is dropped instead of acknowledging the next command early.
+    """
+    def __init__(self, ack_timeout: float = STM_ACK_TIMEOUT, max_resends: int = STM_ACK_RESENDS,
+                 resend_types: tuple = STM_RESEND_TYPES, command_delay: float = STM_COMMAND_DELAY) -> None:
+        self.ack_timeout = ack_timeout
+        self.max_resends = max_resends
+        self.resend_types = resend_types
+        self.command_delay = command_delay
+
+        self.ready = Event() # STM is ready to receive.
+        self.move_done = Event() # Whole message from the STM queue has been executed.
+        self.ready.set()
+        self.move_done.set()
+
+        self.timeouts = Value('i', 0)
+        self.stale = Value('i', 0) # DONEs of released commands which may still arrive.
+        self.histogram = LatencyHistogram()
+
+    # Called by recv_from_stm on STM_PROTOCOL.DONE.
+    def acknowledge(self) -> None:
+        with self.stale.get_lock():
+            if self.stale.value > 0:
+                self.stale.value -= 1
+                log.debug("Dropped a late DONE, %d more owed.", self.stale.value)
+                return
+        self.set_ready(True)
+
+    # Called after the STM link has been reconnected, the old link's DONEs are gone.
+    def reset(self) -> None:
+        with self.stale.get_lock():
+            self.stale.value = 0
+        self.set_ready(True)
+        self.move_done.set()
+
+    # A command was released without DONE, its DONE may still arrive: drop it rather than take it for the next command.
+    # stale: self.stale when the command was first sent. A DONE dropped since may have been this command's own, then none is owed.
+    def release(self, stale: int) -> None:
+        with self.stale.get_lock():
+            if self.stale.value >= stale:
+                self.stale.value += 1
+
+    def set_ready(self, ready: bool) -> None:
+        if ready:
+            self.ready.set()
+        else:
+            self.ready.clear()
+
+    # Send a single command and block until STM acknowledges it. Returns False if the ack never came.
+    def send(self, stm, command: bytes) -> bool:
+        # Only setup commands are safe to repeat, a repeated movement would move the robot twice.
+        attempts = 1
+        if LatencyHistogram.command_type(command) in self.resend_types:
+            attempts += self.max_resends
+        stale = self.stale.value
+
+        for attempt in range(attempts):
+            self.set_ready(False)
+            time.sleep(self.command_delay)
+            start_time = time.monotonic()
+            stm.send(command)
+            if self.ready.wait(self.ack_timeout):
+                self.histogram.record(command, time.monotonic() - start_time)
+                return True
+
+            with self.timeouts.get_lock():
+                self.timeouts.value += 1
+            log.warning("No DONE from STM for %s after %ss (attempt %d/%d).", command, self.ack_timeout, attempt + 1, attempts)
+
+        # Give up on this command so that the link doesn't stall forever.
+        log.warning("Releasing STM link without DONE for %s.", command)
+        self.release(stale)
+        self.set_ready(True)
+        return False
+
+class AsyncSTMFlowControl(STMFlowControl):
+    """
+    STMFlowControl for AsyncGateway, waits on asyncio events instead of blocking the event loop.
+    Must be created inside the running event loop.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.ready = asyncio.Event()
+        self.move_done = asyncio.Event()
+        self.ready.set()
+        self.move_done.set()
+
+    async def send(self, stm, command: bytes) -> bool:
+        attempts = 1
+        if LatencyHistogram.command_type(command) in self.resend_types:
+            attempts += self.max_resends
+        stale = self.stale.value
+
+        for attempt in range(attempts):
+            self.set_ready(False)
+            await asyncio.sleep(self.command_delay)
+            start_time = time.monotonic()
+            stm.send(command)
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.ack_timeout)
+                self.histogram.record(command, time.monotonic() - start_time)
+                return True
+            except asyncio.TimeoutError:
+                pass
+
+            with self.timeouts.get_lock():
+                self.timeouts.value += 1
+            log.warning("No DONE from STM for %s after %ss (attempt %d/%d).", command, self.ack_timeout, attempt + 1, attempts)
+
+        log.warning("Releasing STM link without DONE for %s.", command)
+        self.release(stale)
+        self.set_ready(True)
+        return False
@@ -0,0 +1,112 @@
+import json
+import time
+import itertools
+import zmq
+
+from misc.config import *
+from misc.image_codec import TRANSPORTS, encode_jpeg, letterbox
+from misc.logger import get_logger
+
+log = get_logger("Main")
+
+class ImageClient:
+    """
+    Client for the Image Processing Server over a DEALER socket.
+    Every frame carries a request id, so several frames can be in flight, each with its own deadline.
+    A request past its deadline resets the socket, so a slow or dead server can't block the caller;
+    the new socket has a new identity, late replies to the old one never arrive.
+    IMAGE_TRANSPORT picks raw arrays or JPEG, the metadata is the same as imagezmq's send_image / send_jpg.
+    A list of frames goes out as one request, with the metadata of each frame under "frames".
+    With letterbox set, frames are scaled and padded to that size first, the server maps its results back.
+    """
+    def __init__(self, connect_to: str, transport: str = IMAGE_TRANSPORT, quality: int = JPEG_QUALITY, timeout: float = IMAGE_REQUEST_TIMEOUT, letterbox: int = IMAGE_LETTERBOX) -> None:
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown image transport: {transport}")
+        self.connect_to = connect_to
+        self.transport = transport
+        self.quality = quality
+        self.letterbox = letterbox
+        self.timeout = timeout
+        self.last_size = 0 # Bytes of the last frame on the wire.
+
+        self.request_ids = itertools.count(1)
+        self.pending = {} # Request id -> deadline.
+        self.replies = {} # Request id -> reply, until it is collected.
+        self.context = zmq.Context()
+        self.socket = None
+        self.connect()
+
+    def connect(self) -> None:
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.connect_to)
+
+    # Drop the socket together with every request in flight.
+    def reset(self) -> None:
+        log.warning("Resetting Image Server connection, dropping %s request(s).", len(self.pending))
+        self.socket.close()
+        self.pending.clear()
+        self.connect()
+
+    def close(self) -> None:
+        self.socket.close()
+        self.context.term()
+
+    # Wire buffer of one frame, and the metadata the server needs to decode it.
+    def encode(self, image) -> tuple:
+        frame_metadata = {}
+        if self.letterbox:
+            image, frame_metadata["letterbox"] = letterbox(image, self.letterbox)
+        if self.transport == "jpeg":
+            return frame_metadata, encode_jpeg(image, self.quality)
+        frame_metadata.update(dtype=str(image.dtype), shape=image.shape)
+        return frame_metadata, image
+
+    # Queue a frame, or a list of frames, without waiting, returns its request id.
+    def submit(self, image_id, image, timeout: float = None) -> int:
+        request_id = next(self.request_ids)
+        if isinstance(image_id, bytes):
+            image_id = image_id.decode(FORMAT)
+        metadata = {"msg": image_id, "id": request_id}
+        if isinstance(image, list):
+            encoded = [self.encode(frame) for frame in image]
+            metadata["frames"] = [frame_metadata for frame_metadata, _ in encoded]
+            buffers = [buffer for _, buffer in encoded]
+        else:
+            frame_metadata, buffer = self.encode(image)
+            metadata.update(frame_metadata)
+            buffers = [buffer]
+        self.last_size = sum(buffer.nbytes for buffer in buffers)
+        # Empty frame first, like a REQ socket, so the server handles both the same way.
+        self.socket.send_multipart([b"", json.dumps(metadata).encode(FORMAT)] + buffers, copy=False)
+        self.pending[request_id] = time.monotonic() + (self.timeout if timeout is None else timeout)
+        return request_id
+
+    # Store every reply which arrives within wait seconds.
+    def poll(self, wait: float) -> None:
+        if not self.socket.poll(max(wait, 0) * 1000):
+            return
+        while True:
+            try:
+                _, request_id, reply = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            request_id = int(request_id)
+            # Replies for requests which were given up on are dropped.
+            if self.pending.pop(request_id, None) is not None:
+                self.replies[request_id] = reply
+
+    # Block until the reply for request_id arrives, or its deadline passes.
+    def result(self, request_id: int) -> bytes:
+        while request_id not in self.replies:
+            if request_id not in self.pending:
+                raise TimeoutError(f"Image request {request_id} was dropped by a reset.")
+            remaining = self.pending[request_id] - time.monotonic()
+            if remaining <= 0:
+                self.reset()
+                raise TimeoutError(f"No reply from Image Server for request {request_id}.")
+            self.poll(remaining)
+        return self.replies.pop(request_id)
+
+    def send(self, image_id, image, timeout: float = None) -> bytes:
+        return self.result(self.submit(image_id, image, timeout))
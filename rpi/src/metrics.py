@@ -0,0 +1,185 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Array, Value
+
+from misc.config import METRICS_HOST, METRICS_PORT, IMAGE_RTT_BUCKETS
+from misc.recorder import LINK, DIRECTION
+from misc.logger import get_logger
+from .flow_control import LatencyHistogram
+
+log = get_logger("Main")
+
+class Histogram:
+    """
+    Histogram of one value (e.g. image round trip time) in shared memory, like LatencyHistogram without command types.
+    """
+    def __init__(self, buckets: list) -> None:
+        # Upper bound (seconds) of every bucket, the last bucket catches everything above.
+        self.buckets = buckets
+        self.counts = Array('i', len(buckets) + 1)
+        self.total = Value('d', 0.0)
+
+    def observe(self, value: float) -> None:
+        column = len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                column = index
+                break
+        with self.counts.get_lock():
+            self.counts[column] += 1
+        with self.total.get_lock():
+            self.total.value += value
+
+# Prometheus histogram lines from per-bucket counts, buckets are cumulative there.
+def histogram_lines(name: str, buckets: list, counts: list, total: float, labels: str = "") -> list:
+    lines, cumulative = [], 0
+    for bound, count in zip(buckets + ["+Inf"], counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    labels = labels.rstrip(",")
+    labels = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{labels} {total}")
+    lines.append(f"{name}_count{labels} {cumulative}")
+    return lines
+
+class Metrics:
+    """
+    Counters and gauges of a runtime, in shared memory so the link processes update them
+    and the main process serves them (MetricsServer):
+        messages per link and direction, reconnections per link, depth of the message queues,
+        STM command-to-DONE latency (the flow control's LatencyHistogram), image server round trip time.
+    Queue depths are read from the queues when scraped, the queues keep their size in shared memory already.
+    """
+    def __init__(self, stm_latency: LatencyHistogram = None, image_rtt_buckets: list = IMAGE_RTT_BUCKETS) -> None:
+        self.messages = Array('l', len(LINK.NAMES) * 2) # Link * 2 + direction.
+        self.reconnects = Array('i', len(LINK.NAMES))
+        self.stm_latency = stm_latency
+        self.image_rtt = Histogram(image_rtt_buckets)
+        self.stm_timeouts = None # Value of the flow control's watchdog timeouts.
+        self.queues = {} # Name -> queue.
+
+    def count(self, link: int, direction: int) -> None:
+        with self.messages.get_lock():
+            self.messages[link * 2 + direction] += 1
+
+    def reconnected(self, link: int) -> None:
+        with self.reconnects.get_lock():
+            self.reconnects[link] += 1
+
+    def watch_queue(self, name: str, queue) -> None:
+        self.queues[name] = queue
+
+    # Device wrapped so that its messages are counted, image server replies timed.
+    def link(self, device, link: int):
+        return MeteredLink(device, self, link)
+
+    # Everything in the Prometheus text format.
+    def render(self) -> str:
+        lines = ["# HELP mdp_link_messages_total Messages on a link, in = device to RPi.", "# TYPE mdp_link_messages_total counter"]
+        for link, name in LINK.NAMES.items():
+            for direction, direction_name in ((DIRECTION.IN, "in"), (DIRECTION.OUT, "out")):
+                lines.append(f'mdp_link_messages_total{{link="{name}",direction="{direction_name}"}} {self.messages[link * 2 + direction]}')
+
+        lines += ["# HELP mdp_link_reconnects_total Reconnections of a link.", "# TYPE mdp_link_reconnects_total counter"]
+        for link, name in LINK.NAMES.items():
+            lines.append(f'mdp_link_reconnects_total{{link="{name}"}} {self.reconnects[link]}')
+
+        lines += ["# HELP mdp_queue_depth Messages waiting in a queue.", "# TYPE mdp_queue_depth gauge"]
+        for name, queue in self.queues.items():
+            try:
+                depth = queue.qsize()
+            except (NotImplementedError, OSError, EOFError):
+                # No qsize on macOS, or the manager behind the queue is gone.
+                continue
+            lines.append(f'mdp_queue_depth{{queue="{name}"}} {depth}')
+
+        if self.stm_latency is not None:
+            lines += ["# HELP mdp_stm_ack_latency_seconds STM command-to-DONE latency.", "# TYPE mdp_stm_ack_latency_seconds histogram"]
+            histogram = self.stm_latency
+            for row, command_type in enumerate(histogram.COMMAND_TYPES):
+                counts = histogram.counts[row * histogram.width:(row + 1) * histogram.width]
+                lines += histogram_lines("mdp_stm_ack_latency_seconds", histogram.buckets, counts, histogram.totals[row], f'command="{command_type}",')
+        if self.stm_timeouts is not None:
+            lines += ["# HELP mdp_stm_ack_timeouts_total DONEs not received within the ack timeout.", "# TYPE mdp_stm_ack_timeouts_total counter",
+                      f"mdp_stm_ack_timeouts_total {self.stm_timeouts.value}"]
+
+        lines += ["# HELP mdp_image_rtt_seconds Image server round trip time.", "# TYPE mdp_image_rtt_seconds histogram"]
+        lines += histogram_lines("mdp_image_rtt_seconds", self.image_rtt.buckets, self.image_rtt.counts[:], self.image_rtt.total.value)
+        return "\n".join(lines) + "\n"
+
+class MeteredLink:
+    """
+    Wraps a device (STM, Android, Algorithm or ImageClient) and counts what goes through recv and send, like RecordedLink.
+    A reply returned by send (the image server's) is counted as incoming and its round trip timed.
+    Everything else is passed through to the device.
+    """
+    def __init__(self, device, metrics: Metrics, link: int) -> None:
+        self.device = device
+        self.metrics = metrics
+        self.link = link
+
+    def __getattr__(self, name: str):
+        # Not found on the wrapper, e.g. connect -> device.connect.
+        if name == "device":
+            raise AttributeError(name)
+        return getattr(self.device, name)
+
+    def recv(self, *args, **kwargs):
+        message = self.device.recv(*args, **kwargs)
+        if message is not None:
+            self.metrics.count(self.link, DIRECTION.IN)
+        return message
+
+    def send(self, message, *args, **kwargs):
+        self.metrics.count(self.link, DIRECTION.OUT)
+        start_time = time.monotonic()
+        reply = self.device.send(message, *args, **kwargs)
+        if reply is not None:
+            self.metrics.image_rtt.observe(time.monotonic() - start_time)
+            self.metrics.count(self.link, DIRECTION.IN)
+        return reply
+
+class MetricsServer:
+    """
+    Serves Metrics on http://host:port/metrics from a thread of the main process, for Prometheus or curl.
+    """
+    def __init__(self, metrics: Metrics, host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self) -> None:
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                log.debug(format, *args)
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as error:
+            # The robot runs without metrics rather than not at all.
+            log.error("Metrics endpoint on %s:%s failed: %s", self.host, self.port, error)
+            return
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="[Metrics Server]", daemon=True).start()
+        log.info("Metrics on http://%s:%s/metrics", self.host, self.server.server_port)
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -1,78 +1,99 @@
 # Stuff
 import ast
-import cv2
 import time
-import imagezmq
-from datetime import datetime
-from multiprocessing import Process, Value, Manager, Queue
-
-# Camera modules
-from picamera import PiCamera
-from picamera.array import PiRGBArray
+import queue
+from multiprocessing import Process, Queue, Event
 
 # Configuration + Protocols
 from misc.config import *
 from misc.protocols import *
 from misc.calibration import *
+from misc.timing import StageTimer
+from misc.recorder import LINK
+from misc.logger import get_logger
 
 # Interfaces
 from .stm import STM
 from .android import Android
 from .algorithm import Algorithm
+from .router import Router, run_sync
+from .robot_state import RobotState
+from .flow_control import STMFlowControl
+from .camera import CameraService, CAMERA_BACKENDS
+from .metrics import Metrics, MetricsServer
+
+log = get_logger("Main")
 
-class MultiProcessing:
+class MultiProcessing(Router):
     """
     Handles the communication between STM, Android, Algorithm and Image Processing Server.
     """    
-    def __init__(self, image_processing_server: str, android_on: bool, stm_on: bool, algo_on: bool, env : str) -> None:
+    def __init__(self, image_processing_server: str, android_on: bool, stm_on: bool, algo_on: bool, env : str, ack_timeout: float = STM_ACK_TIMEOUT, camera: str = CAMERA_BACKEND, pipeline: bool = PIPELINED_EXPLORATION, burst: int = IMAGE_BURST_FRAMES, letterbox: int = IMAGE_LETTERBOX, record: str = RECORD_LOG, serial_port: list = SERIAL_PORT, metrics_port: int = METRICS_PORT) -> None:
     
-        print("[Main] __init__ Multi Processing Communication")
-        self.manager = Manager()
+        log.info("__init__ Multi Processing Communication")
         self.calibration = Calibration(env) # Set calibration mode.
-        print(f"[Main] Running Environment: {env}")
+        log.info("Running Environment: %s", env)
         
-        # Coordinates for correction.
-        self.coord = self.manager.dict()
-        self.coord['obstacle'] = b"0-0"
-        self.coord['target'] = b"(0, 0, 0)"
-
-        self.mode  = Value('i', 0) # 0: Manual, 1: Explore, 2: Path
-        self.image_count = Value('i', 0)
-        self.stm_ready_to_recv  = Value('i', 1) # Represent if STM is ready to receive.
-        self.stm_indv_move_done = Value('i', 1)
-        self.stm = self.android = self.algorithm = self.image_process = None
+        # Mode, image count, coordinates for correction and STM readiness.
+        self.state = RobotState()
+        self.stm_flow = STMFlowControl(ack_timeout=ack_timeout) # STM readiness + ack watchdog.
+        # Counters and gauges shared by the link processes, served on metrics_port (None for off).
+        self.metrics = Metrics(self.stm_flow.histogram)
+        self.metrics.stm_timeouts = self.stm_flow.timeouts
+        self.metrics_server = MetricsServer(self.metrics, port=metrics_port) if metrics_port is not None else None
+        self.shutdown = Event() # Set to stop every link worker.
+        # Pipelined: the image process captures, and correction overlaps the next path request.
+        self.pipeline = pipeline
+        self.burst = burst # Frames per detection request.
+        self.letterbox = letterbox # Model input size to letterbox frames to before sending, 0 for off.
+        self.stage_timer = StageTimer() # Time per obstacle, used by the image process only.
+        self.stm = self.android = self.algorithm = self.image_process = self.camera = None
+        self.image_processing_server = image_processing_server
 
         # STM
         if stm_on:
-            print("[Main] Running with STM interface.") 
-            self.stm = STM(env=env)
+            log.info("Running with STM interface.") 
+            self.stm = STM(serial_port, env=env)
             self.to_stm_message_queue = Queue()
+            self.metrics.watch_queue("to_stm_message_queue", self.to_stm_message_queue)
             self.recv_from_stm_process = Process(target=self.recv_from_stm, name="[STM Recv Process]")
             self.send_to_stm_process = Process(target=self.send_to_stm, name = "[STM Send Process]")
         
         # Android
         if android_on:
-            print("[Main] Running with Android interface.")  
+            log.info("Running with Android interface.")  
             self.android = Android()
             self.to_android_message_queue = Queue()
+            self.metrics.watch_queue("to_android_message_queue", self.to_android_message_queue)
             self.recv_from_android_process = Process(target=self.recv_from_android, name="[Android Recv Process]")
             self.send_to_android_process = Process(target=self.send_to_android, name="[Android Send Process]")
 
         # Algorithm
         if algo_on: 
-            print("[Main] Running with Algorithm interface.") 
+            log.info("Running with Algorithm interface.") 
             self.algorithm = Algorithm()
             self.to_algo_message_queue = Queue()
+            self.metrics.watch_queue("to_algo_message_queue", self.to_algo_message_queue)
             self.recv_from_algorithm_process = Process(target=self.recv_from_algorithm, name="[Algorithm Recv Process]")
             self.send_to_algorithm_process = Process(target=self.send_to_algorithm, name="[Algorithm Send Process]")
 
         # Image Processing
         if image_processing_server is not None:
-            print("[Main] Running with Image Processing.")
+            log.info("Running with Image Processing.")
             self.image_queue = Queue()
-            self.image_processing_server = image_processing_server 
+            self.metrics.watch_queue("image_queue", self.image_queue)
+            # Keeps the camera open for the whole run, take_picture reads its latest frame.
+            self.camera = CameraService(CAMERA_BACKENDS[camera]())
             self.image_process = Process(target=self.image_processing, name="[Image Process]")
 
+        # Log of every link message, replayed by etc/replay.py.
+        self.recorder = None
+        if record is not None:
+            self.record_links(record, {"env": env, "pipeline": pipeline, "burst": burst, "letterbox": letterbox})
+        self.meter_links(self.metrics)
+
+        self.build_dispatch_tables()
+
     # Start all processes -> Called from main.py
     def start(self) -> None:
         try:
@@ -97,56 +118,92 @@ class MultiProcessing:
 
             # Image Processing.
             if self.image_processing_server is not None:
+                self.camera.start()
                 self.image_process.start()
 
-            print('[Main] Multi Process Communication has successfully started.')
+            if self.metrics_server is not None:
+                self.metrics_server.start()
+
+            log.info('Multi Process Communication has successfully started.')
 
         except Exception as error:
-            print(error)
+            log.error("%s", error)
             raise error
         # Continously check if reconnection is needed.
         self.check_process_alive()
 
     # Shut down all processes -> Called from main.py
     def end(self) -> None:
+        # Wake every link worker up and give them a chance to exit on their own.
+        self.shutdown.set()
+        for process in self.link_processes():
+            if process.is_alive():
+                process.join(timeout=PROCESS_JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
         if self.stm is not None: self.stm.disconnect()
         if self.android is not None: self.android.disconnect_all()
         if self.algorithm is not None: self.algorithm.disconnect_all()
-        print("[Main] Multi Process Communication has successfully ended.")
+        if self.camera is not None: self.camera.stop()
+        self.stm_flow.histogram.report()
+        self.state.close(unlink=True)
+        if self.recorder is not None: self.recorder.close()
+        if self.metrics_server is not None: self.metrics_server.stop()
+        log.info("Multi Process Communication has successfully ended.")
+
+    # All link worker processes that have been created.
+    def link_processes(self) -> list:
+        processes = []
+        if self.stm is not None:
+            processes += [self.recv_from_stm_process, self.send_to_stm_process]
+        if self.android is not None:
+            processes += [self.recv_from_android_process, self.send_to_android_process]
+        if self.algorithm is not None:
+            processes += [self.recv_from_algorithm_process, self.send_to_algorithm_process]
+        if self.image_process is not None:
+            processes.append(self.image_process)
+        # Processes which were never started can't be joined.
+        return [process for process in processes if process.pid is not None]
 
     # Restart all processes
     def restart_explore(self) -> None:
-        print("============= [Main Restarting Exploration] =============")
+        log.info("============= Restarting Exploration =============")
         if self.stm is not None:
             # Flush instructions & Reconnect
             while not self.to_stm_message_queue.empty():
                 self.to_stm_message_queue.get_nowait()
-            print("[Main] STM Message Queue has been flushed.")
+            log.info("STM Message Queue has been flushed.")
             self.reconnect_stm()
+            self.stm_flow.histogram.report()
 
         if self.algorithm is not None:
             while not self.to_algo_message_queue.empty():
                 self.to_algo_message_queue.get_nowait()
-            print("[Main] Algorithm Message Queue has been flushed")
+            log.info("Algorithm Message Queue has been flushed")
 
         if self.android is not None:
             while not self.to_android_message_queue.empty():
                 self.to_android_message_queue.get_nowait()
-            print("[Main] Android Message Queue has been flushed")
+            log.info("Android Message Queue has been flushed")
         
         if self.image_process is not None:
             while not self.image_queue.empty():
                 self.image_queue.get_nowait()
-            print("[Main] Image Queue has been flushed")
+            log.info("Image Queue has been flushed")
             # Reset Image detected in the Image Server.
             image = self.take_picture()
-            print("[Main] Taking Picture of Restarting Exploration.")
-            image_sender = imagezmq.ImageSender(connect_to=self.image_processing_server)
-            image_sender.send_image(0, image)
-        print("===========================================================")
+            log.info("Taking Picture of Restarting Exploration.")
+            image_client = self.open_image_client(metered=False)
+            try:
+                image_client.send(0, image)
+            except TimeoutError as error:
+                self.error_message(error)
+            image_client.close()
+        log.info("==================================================")
         
     def check_process_alive(self) -> None:
-        while True:
+        # Sleep between checks instead of spinning, wakes up immediately on shutdown.
+        while not self.shutdown.wait(PROCESS_CHECK_INTERVAL):
             try:
                 # Check STM connection
                 pass 
@@ -165,7 +222,7 @@ class MultiProcessing:
                    self.image_process.start()
                 """
             except Exception as error:
-                print("[Main] Error during reconnection: ",error)
+                log.error("Error during reconnection: %s", error)
                 raise error
 
     """
@@ -178,7 +235,7 @@ class MultiProcessing:
     Potential Redirection: STM, Algorithm
     """
     def recv_from_android(self) -> None:
-        while True:
+        while not self.shutdown.is_set():
             try:
                 raw_message = self.android.recv()
 
@@ -186,43 +243,11 @@ class MultiProcessing:
                     continue
                 
                 for message in raw_message.split(MESSAGE_SEPARATOR):
-                    # Empty message -> Ignore.
-                    if not len(message): 
-                        continue
-                    
-                    if message in AndroidToSTM.MESSAGES:
-                        # Mapping Android -> RPI <-> STM protocol.
-                        if self.stm is None:
-                            print("[Main] No Forwarding, as STM is not set-up.")
-                            continue
-                        
-                        # Set to manual mode -> Manual movement from android.
-                        self.mode.value = 0
-                        self.to_stm_message_queue.put_nowait(AndroidToSTM.MESSAGES[message])
-                        continue
-
-                    elif message == AndroidToRPI.STOP:
-                        self.restart_explore()
-                        continue
-                        
-                    # Forward Android message to Algo
-                    # AND|START/EXPLORE/(R,02,02,0)/(00,10,09,0)/(01,16,03,90)
-                    message_list = message.split(SLASH_SEPARATOR)
-                    if len(message_list) > 1 and message_list[0] == AndroidToRPI.START and message_list[1] == AndroidToAlgorithm.EXPLORE:
-                        if self.algorithm is None:
-                            print("[Main] No Forwarding, as Algo is not set-up.")
-                            continue
-                        # Set to explore mode
-                        print("=============== [Main Starting Exploration] ===============")
-                        self.mode.value = 1
-                        self.image_count.value = len(message_list) - 3
-                        self.to_algo_message_queue.put_nowait(ANDROID_HEADER + message)
-                    else:
-                        print("[Main] No Forwarding : Message from Android: {message}")
+                    self.handle_android_message(message)
 
             except Exception as error:
                 # Peer has reset bluetooth network -> Restart now.
-                print("[Main] Process of reading android has failed")
+                log.error("Process of reading android has failed")
                 self.reconnect_android()
                 self.error_message(error)
     """
@@ -230,13 +255,15 @@ class MultiProcessing:
     Function: Constantly Check if there's anything to Write to Android by checking android_message_queue
     """
     def send_to_android(self) -> None:
-        while True:
+        while not self.shutdown.is_set():
             try:
-                if not self.to_android_message_queue.empty():
-                    message = self.to_android_message_queue.get_nowait()
-                    self.android.send(message)
+                # Block until there is a message, time out to check for shutdown.
+                message = self.to_android_message_queue.get(timeout=QUEUE_TIMEOUT)
+                self.android.send(message)
+            except queue.Empty:
+                continue
             except Exception as error:
-                print('[Main] Process send_to_android has failed')
+                log.error('Process send_to_android has failed')
                 self.error_message(error)
 
     """
@@ -244,12 +271,12 @@ class MultiProcessing:
     Function: Terminate android send/recv process and recreate them.
     """  
     def reconnect_android(self) -> None:
-        print("[Main] Disconnecting Android Process.")
+        log.info("Disconnecting Android Process.")
 
         # Terminate all Android process.
         self.recv_from_android_process.terminate()
         self.send_to_android_process.terminate()
-        print("[Main] Android send/recv processes has been terminated ")
+        log.info("Android send/recv processes has been terminated ")
 
         # Close all Android bluetooth sockets.
         self.android.disconnect_client()
@@ -262,7 +289,8 @@ class MultiProcessing:
         self.send_to_android_process = Process(target=self.send_to_android, name="[Android Send Process]")
         self.recv_from_android_process.start()
         self.send_to_android_process.start()
-        print("[Main] Android send/recv processes has been reconnected.")
+        self.metrics.reconnected(LINK.ANDROID)
+        log.info("Android send/recv processes has been reconnected.")
 
     """
     2. Algorithm Processes (Recv, Send) and function (reconnect_algorithm)
@@ -274,48 +302,17 @@ class MultiProcessing:
     Potential Redirection: Android, RPI, STM
     """
     def recv_from_algorithm(self) -> None:
-        while True:
+        while not self.shutdown.is_set():
             try:
                 raw_message = self.algorithm.recv()
 
                 if raw_message is None: continue
 
                 for raw in raw_message.split(MESSAGE_SEPARATOR):
-                    
-                    message = raw.split(SLASH_SEPARATOR)
-
-                    # MOVEMENTS/10-9/B,B,B,FL,F,F,F,F,F,FL,B,B,F,F,F,BR,F,F,F
-                    if message[0] in AlgorithmToSTM.MESSAGES:
-                        if self.stm is None:
-                            print("[Main] No forwarding, as STM is not set-up.")
-                            continue
-                        # MOVEMENTS
-                        if message[0] == AlgorithmToSTM.MOVEMENTS:
-                            self.coord['obstacle'] = message[1]
-                            print(f"[Main] Current Target Obstacle: {self.coord['obstacle']}")
-                            self.to_stm_message_queue.put_nowait(message[2].split(COMMA_SEPARATOR))
-                        else:    
-                            print("[Main] Algorithm To STM Command Type not recognised.")
-                    # ROBOT/10-9/(11.0, 2.0, -90)/(10.0, 2.0, -90)/(9.0, 2.0, -90)/(12.0, 5.0, 0)/(12.0, 6.0, 0)/(12.0, 7.0, 0)/(12.0, 8.0, 0)/(12.0, 9.0, 0)/(12.0, 10.0, 0)/(9.0, 13.0, 90)/(10.0, 13.0, 90)/(11.0, 13.0, 90)/(10.0, 13.0, 90)/(9.0, 13.0, 90)/(8.0, 13.0, 90)/(11.0, 16.0, 180)/(11.0, 15.0, 180)/(11.0, 14.0, 180)/(11.0, 13.0, 180)
-                    elif message[0] in AlgorithmToAndroid.MESSAGES:
-                        if self.android is None:
-                            print("[Main] No forwarding, as Android is not set-up.")
-                            continue
-                        if message[0] == AlgorithmToAndroid.ROBOT:
-                            # Keept track of the target position, for calibration purposes.
-                            self.coord['target'] = message[-1]
-                            # Relay raw message to android team.
-                            self.to_android_message_queue.put_nowait(AND_HEADER + ALGORITHM_HEADER + raw)
-                    # Take picture of obstacle manually.
-                    elif message[0] == AlgorithmToRPI.OBSTACLE:
-                            image = self.take_picture()
-                            print('[Main] - RPI Picture Taken')
-                            self.image_queue.put_nowait([image, message[1]])
-                    else:
-                        print("[Main] No forwarding, command not recognised.")
+                    self.handle_algorithm_message(raw)
 
             except Exception as error:
-                print("[Main] Error Reading Algorithm Process")
+                log.error("Error Reading Algorithm Process")
                 self.error_message(error)
 
     """
@@ -323,13 +320,15 @@ class MultiProcessing:
     Function: Constantly Check if there's anything to send to algorithm by checking to_algo_message_queue
     """
     def send_to_algorithm(self) -> None:
-        while True:
+        while not self.shutdown.is_set():
             try:
-                if not self.to_algo_message_queue.empty():
-                    message = self.to_algo_message_queue.get_nowait()
-                    self.algorithm.send(message)
+                # Block until there is a message, time out to check for shutdown.
+                message = self.to_algo_message_queue.get(timeout=QUEUE_TIMEOUT)
+                self.algorithm.send(message)
+            except queue.Empty:
+                continue
             except Exception as error:
-                print('[Main] Process send_to_android has failed')
+                log.error('Process send_to_android has failed')
                 self.error_message(error)
 
     """
@@ -338,7 +337,7 @@ class MultiProcessing:
     """ 
     def reconnect_algorithm(self) -> None:
 
-        print("[Main] Disconnecting Algorithm Process.")
+        log.info("Disconnecting Algorithm Process.")
 
         # Terminate all Algorithm process.
         self.recv_from_algorithm_process.terminate()
@@ -352,8 +351,9 @@ class MultiProcessing:
 
         self.recv_from_algorithm_process.start()
         self.send_to_algorithm_process.start()
+        self.metrics.reconnected(LINK.ALGORITHM)
         
-        print("[Main] Android Process has been Reconnected")
+        log.info("Android Process has been Reconnected")
 
     """
     3. STM Processes (Recv, Send) and function (reconnect_stm)
@@ -365,134 +365,41 @@ class MultiProcessing:
     Potential Redirection: Algorithm
     """
     def recv_from_stm(self) -> (None):
-        while True:
+        backoff = STM_READ_BACKOFF
+        while not self.shutdown.is_set():
             try:
+                # Blocks on the serial port for up to STM_READ_TIMEOUT.
                 raw_message = self.stm.recv()
+                backoff = STM_READ_BACKOFF
 
                 if raw_message is None:
                     continue
 
                 for message in raw_message.split(MESSAGE_SEPARATOR):
-
-                    if message is None or message is STM_PROTOCOL.SETUP_DONE:
-                        continue
-                     
-                    if message not in STM_PROTOCOL.MESSAGES:
-                        print(f"[Main] Command is not recognised under STM protocol: {message} Please try again.")
-                        continue
-                    
-                    # STM is ready to receive message.
-                    if message == STM_PROTOCOL.DONE:
-                        self.stm_ready_to_recv.value = 1
-                        print(f"[Main] Receive from STM: {message}")
-                    else:
-                        print(f"[Main] Doesn't match anything: received from STM: {message}")
+                    if self.handle_stm_message(message):
+                        self.stm_flow.acknowledge()
 
             except Exception as error:
-                print('[Main] STM Read Error')
+                # A closed or failing port raises at once, back off instead of spinning on it.
+                log.error('STM Read Error, retrying in %ss', backoff)
                 self.error_message(error)
-                break
-
-            # Set some delay between reading buffer.
-            time.sleep(0.01)
+                self.shutdown.wait(backoff)
+                backoff = min(backoff * 2, STM_READ_BACKOFF_MAX)
 
     """
     3.2 send_to_stm
     Function: Constantly Check if there's anything to send to stm by checking to_stm_message_queue
     """
     def send_to_stm(self) -> None:
-        while True:
+        while not self.shutdown.is_set():
             try:
-                # Send only if STM is ready to receive.
-                if self.to_stm_message_queue.empty() or self.stm_ready_to_recv.value != 1:
-                    continue
-                
-                self.stm_indv_move_done.value = 0
-                message = self.to_stm_message_queue.get_nowait()
-                print(f"[Main] Raw Message from STM's MQ: {message}")
-
-                # E.g. Movement message -> [B, B, BR, F]
-                if isinstance(message, list):
-                    
-                    commands, commands_len = [], []
-                    index, msg_len = 0, len(message)
-                    # Truncating and mapping movement from [B, B, B, BR] -> [[Sxxxxxx], [Dxxx, Sxxx]]
-                    # Reason for commands_len -> need send Android how many unit of movement instead.
-                    while index < msg_len:
-                        curIndex = index
-                        if message[index] == COMMAND_LIST.F:
-                            while curIndex < msg_len and message[curIndex] == COMMAND_LIST.F:
-                                curIndex += 1
-                            commands_len.append(curIndex - index)
-                            commands.append(self.calibration.bundle_movement(0, curIndex - index))
-                            index = curIndex
-                        elif message[index] == COMMAND_LIST.B:
-                            while curIndex < msg_len and message[curIndex] == COMMAND_LIST.B:
-                                curIndex += 1
-                            commands_len.append(curIndex - index)
-                            commands.append(self.calibration.bundle_movement(180, curIndex - index))
-                            index = curIndex
-                        else:
-                            # For BR, BL, FR, FL -> Instant map no need for bundle.
-                            if message[index] not in self.calibration.calibration_map:
-                                print(f"[Main] Message not recognised for STM moveset: {message[index]}")
-                                break
-                            commands.append(self.calibration.calibration_map[message[index]])
-                            commands_len.append(1)
-                            index += 1
-
-                    # Passing the truncated commands to STM and Android.
-                    # commands = [[Sxxxxxx], [Dxxx, Sxxx]]
-                    print(f"[Main] Converted commands: {commands}")
-                    for index, command in enumerate(commands):
-                        
-                        # Send command len to android.
-                        if self.mode.value == 1:
-                            self.to_android_message_queue.put_nowait(AND_HEADER + STM_HEADER + STMToAndroid.DONE + str(commands_len[index]).encode())
-                        
-                        # Send bundled instruction like BR is actually Turn right then Reverse.
-                        for i in range(len(command)):
-                            # Stall until previous command is executed and received call back.
-                            while self.stm_ready_to_recv.value != 1:
-                                continue
-                            self.stm_ready_to_recv.value = 0
-                            time.sleep(0.25)
-                            self.stm.send(command[i])
-                        # Stall until STM completes the last movement.
-                        while self.stm_ready_to_recv.value != 1:
-                            continue
-                            
-                        print("[Main] STM Completed one move.")
-
-                    # Finish one entire movement set, if on Exploration mode -> Take picture time.
-                    if self.mode.value == 1:
-                        if self.image_processing_server is None:
-                            print('[Main] Image processing is not turned on')
-                            self.to_algo_message_queue.put_nowait(RPI_HEADER + RPIToAlgorithm.REQUEST_ROBOT_NEXT + RPIToAlgorithm.NIL)
-                            continue                                
-                        image = self.take_picture()
-                        print(f'[Main] First Picture Taken -> STM completed one movement.')
-                        self.image_queue.put_nowait([image, f"{self.image_count.value}"])
-                    else:
-                        print("[Main] Mode is Manual")
-                else:
-                    # For raw messages -> most likely for  Straight / Reverse.
-                    commands = []
-                    if message[0] == "W".encode():
-                        commands = [self.calibration.STRAIGHT_F_I, self.calibration.STRAIGHT_F_P, message]
-                    else:
-                        commands = [self.calibration.STRAIGHT_R_I, self.calibration.STRAIGHT_R_P, message]
-                    
-                    for msg in commands:
-                        while self.stm_ready_to_recv.value != 1:
-                            continue
-                        self.stm_ready_to_recv.value = 0
-                        time.sleep(0.25)
-                        self.stm.send(msg)
-                self.stm_indv_move_done.value = 1  
-
+                # Block until there is a message, time out to check for shutdown.
+                message = self.to_stm_message_queue.get(timeout=QUEUE_TIMEOUT)
+                run_sync(self.execute_stm_message(message))
+            except queue.Empty:
+                continue
             except Exception as error:
-                print('[Main] Process send_to_stm has failed')
+                log.error('Process send_to_stm has failed')
                 self.error_message(error)
 
     """
@@ -500,7 +407,7 @@ class MultiProcessing:
     Function: Terminate stm send/recv process and recreate them.
     """ 
     def reconnect_stm(self) -> None:
-        print("[Main] Disconnecting STM Process.")
+        log.info("Disconnecting STM Process.")
         # Terminate all Android process.
         self.recv_from_stm_process.terminate()
         self.send_to_stm_process.terminate()
@@ -511,118 +418,54 @@ class MultiProcessing:
         self.send_to_stm_process = Process(target=self.send_to_stm, name="[STM Send Process]")
         self.recv_from_stm_process.start()
         self.send_to_stm_process.start()
-        self.stm_ready_to_recv.value = 1
-        self.stm_indv_move_done.value = 1
-        print("[Main] STM Process has been Reconnected")
+        self.stm_flow.reset()
+        self.metrics.reconnected(LINK.STM)
+        log.info("STM Process has been Reconnected")
 
     """
     4. RPI Functions
     """
-    def take_picture(self) -> None:
-        try:
-            # start_time = datetime.now()
-            # initialize the camera and grab a reference to the raw camera capture
-            camera = PiCamera(resolution=(IMAGE_WIDTH, IMAGE_HEIGHT))
-            camera.rotation = 0
-            # camera.brightness = 50
-            camera.iso = 700
-            rawCapture = PiRGBArray(camera)
-            # allow the camera to warmup
-            time.sleep(0.2)
-            # grab an image from the camera
-            camera.capture(rawCapture, format=IMAGE_FORMAT)
-            image = rawCapture.array
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            camera.close()
-            #print('[Main] Time Take to take picture: ' + str(datetime.now() - start_time) + 'seconds')
-        except Exception as error:
-            print("[Main] Failed to Take Picture.")
-            self.error_message(error)
-        return image
+    # Take picture of obstacle manually.
+    def capture_obstacle(self, obstacle_id: bytes) -> None:
+        requested_at = time.monotonic()
+        if self.pipeline:
+            self.image_queue.put_nowait([None, obstacle_id, requested_at])
+            return
+        frames = self.take_burst()
+        log.info('RPI Picture Taken')
+        self.image_queue.put_nowait([frames, obstacle_id, requested_at])
 
     def image_processing(self) -> None:
-        # initialize the ImageSender object with the socket address of the server
-        image_sender = imagezmq.ImageSender(connect_to=self.image_processing_server)
-        while True:
+        # initialize the ImageClient object with the socket address of the server
+        image_client = self.open_image_client(letterbox=self.letterbox)
+        while not self.shutdown.is_set():
             try:
-                if self.image_queue.empty():
-                    continue
-                
-                # Each image has 4 tries.
-                rebound = 0
-                image_message =  self.image_queue.get_nowait()
-                for cur_try in range(4):
-                    start_time = datetime.now()
-                    print(f"[Main] Sending Image to Server -> Tries: {cur_try + 1}")
-                    reply = image_sender.send_image(image_message[1], image_message[0]).decode(FORMAT)
-                    print(f'[Main] Time taken to process image: {str(datetime.now() - start_time)} seconds')
-                    
-                    if reply == "NIL":
-                        # Move backwards command
-                        print('[Main] Failed to detect image, retrying now.')
-                        self.mode.value = 0
-                        self.stm_indv_move_done.value = 0
-                        self.to_stm_message_queue.put_nowait([COMMAND_LIST.B])
-
-                        # Stall until movement is done.
-                        while self.stm_indv_move_done.value != 1:
-                            continue
-                        
-                        # Retake image and repeat.
-                        rebound = cur_try + 1
-                        image = self.take_picture()
-                        image_message = [image, f"{self.image_count.value}"]
-
-                    else:
-                        image_id, distance = reply.split("/")
-                        distance = float(distance)
-                        print(f"[Main] Detected Image: {image_id}, Distance away: {distance}")
-                        # Update Android with the image detected.
-                        self.to_android_message_queue.put_nowait(AND_HEADER + RPI_HEADER + f"TARGET/{image_id}".encode(FORMAT))
-                        self.image_count.value -= 1
-                        # Exploration is done -> Thats the final picture.
-                        if self.image_count.value == 0:
-                            self.to_android_message_queue.put_nowait(AND_HEADER + RPI_HEADER + RPIToAndroid.FINISH_EXPLORE)
-                            self.restart_explore()
-                            break
-
-                        # Move forward to offset the difference.
-                        if distance >= self.calibration.MINUS_UNIT:
-                            # Move Forward with the distance.
-                            self.stm_indv_move_done.value = 0
-                            self.to_stm_message_queue.put_nowait(self.calibration.bundle_movement_raw(0, distance / 21))
-
-                        # Stall until movement is done.
-                        while self.stm_indv_move_done.value != 1:
-                            continue
-                        
-                        # Request for next moveset from Algorithm
-                        self.to_algo_message_queue.put_nowait(RPI_HEADER + RPIToAlgorithm.REQUEST_ROBOT_NEXT + RPIToAlgorithm.NIL)
-                        rebound = 0
-                        self.mode.value = 1
-                        break
-
-                # Gives up on detecting image -> Forward again.
-                if rebound != 0:
-                    # Can't detect the final image -> Just stop.
-                    if self.image_count.value == 1:
-                        self.to_android_message_queue.put_nowait(AND_HEADER + RPI_HEADER + RPIToAndroid.FINISH_EXPLORE)
-                        self.restart_explore()
-                        break
-                    # Time to move forward and request next step.
-                    self.mode.value = 0
-                    self.image_count.value -= 1
-                    self.stm_indv_move_done.value = 0
-                    self.to_stm_message_queue.put_nowait([COMMAND_LIST.F] * rebound)
-                    # Stall until movement is done.
-                    while self.stm_indv_move_done.value != 1:
-                        continue
-                    self.mode.value = 1
-                    self.to_algo_message_queue.put_nowait(RPI_HEADER + RPIToAlgorithm.REQUEST_ROBOT_NEXT + RPIToAlgorithm.NIL)
-       
+                # Block until there is an image, time out to check for shutdown.
+                # [frames, image id, time of the request], frames is None when this process has to capture them.
+                frames, image_id, requested_at = self.image_queue.get(timeout=QUEUE_TIMEOUT)
+                run_sync(self.process_image(image_client, frames, image_id, requested_at))
+            except queue.Empty:
+                continue
             except Exception as error:
-                print('[Main] Error - Image processing failed')
+                log.error('Error - Image processing failed')
                 self.error_message(error)
-                    
-    def error_message(self, message : str) -> None:
-        print(f"[Error Message]: {message}")
\ No newline at end of file
+
+    """
+    5. Hooks of the shared STM and image steps (Router), blocking in the calling process.
+    """
+    async def blocking(self, function, *args):
+        return function(*args)
+
+    async def move(self, message) -> None:
+        self.stm_flow.move_done.clear()
+        self.to_stm_message_queue.put_nowait(message)
+        self.wait_move_done()
+
+    async def send_command(self, command: bytes) -> None:
+        self.stm_flow.send(self.stm, command)
+
+    # Sleep until send_to_stm has executed the whole queued move, or until shutdown.
+    def wait_move_done(self) -> None:
+        while not self.stm_flow.move_done.wait(QUEUE_TIMEOUT):
+            if self.shutdown.is_set():
+                return
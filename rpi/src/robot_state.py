@@ -0,0 +1,134 @@
+import os
+import struct
+from contextlib import contextmanager
+from multiprocessing import Lock
+from multiprocessing.shared_memory import SharedMemory
+
+from misc.logger import get_logger
+
+log = get_logger("Main")
+
+class RobotState:
+    """
+    Robot state shared between all link processes through one shared memory block.
+    Writers take a lock and bump a sequence number around every write (seqlock),
+    readers never lock, they retry if a write happened while they were reading.
+    The lock holder's pid is kept next to the sequence. A writer terminate()d mid-write (reconnect_*)
+    leaves the sequence odd and the lock taken, once its pid is confirmed dead the next locker takes the lock over.
+
+    Layout: sequence | owner | mode | image_count | obstacle | target
+    """
+    SEQUENCE = struct.Struct("<Q")
+    OWNER = struct.Struct("<i") # Pid of the lock holder, 0 when free. Follows the sequence number.
+    FIELDS = struct.Struct("<ii32p64p") # Follows the owner.
+    OFFSET = SEQUENCE.size + OWNER.size
+    NAMES = ("mode", "image_count", "obstacle", "target")
+    LENGTHS = {"obstacle": 31, "target": 63} # Longest value of the p fields, one byte holds the length.
+    RETRIES = 1000 # Lock-free reads before snapshot falls back to the lock.
+    LOCK_TIMEOUT = 1.0 # A write takes microseconds, past this the holder is checked for being alive.
+
+    def __init__(self) -> None:
+        self.memory = SharedMemory(create=True, size=self.OFFSET + self.FIELDS.size)
+        self.buffer = self.memory.buf
+        self.lock = Lock()
+        self.takeover = Lock() # Only one process takes over from a dead holder.
+        # 0: Manual, 1: Explore, 2: Path
+        self.write(mode=0, image_count=0, obstacle=b"0-0", target=b"(0, 0, 0)")
+
+    # Consistent copy of every field, without taking the lock unless a write does not finish.
+    def snapshot(self) -> dict:
+        for _ in range(self.RETRIES):
+            (before,) = self.SEQUENCE.unpack_from(self.buffer, 0)
+            if before & 1:
+                continue # Write in progress.
+            values = self.FIELDS.unpack_from(self.buffer, self.OFFSET)
+            (after,) = self.SEQUENCE.unpack_from(self.buffer, 0)
+            if before == after:
+                return dict(zip(self.NAMES, values))
+        with self.locked():
+            return self.read_locked()
+
+    # Lock of the writers. A slow holder is waited for, a dead one's lock is released on its behalf.
+    @contextmanager
+    def locked(self):
+        while not self.lock.acquire(timeout=self.LOCK_TIMEOUT):
+            (owner,) = self.OWNER.unpack_from(self.buffer, self.SEQUENCE.size)
+            if owner == 0 or alive(owner):
+                log.warning("RobotState lock held for over %ss by pid %d, still waiting.", self.LOCK_TIMEOUT, owner)
+                continue
+            with self.takeover:
+                # Another process may have taken over already, then the owner has changed.
+                if self.OWNER.unpack_from(self.buffer, self.SEQUENCE.size)[0] == owner:
+                    log.error("RobotState lock holder pid %d is dead, taking over.", owner)
+                    self.OWNER.pack_into(self.buffer, self.SEQUENCE.size, 0)
+                    self.lock.release()
+        self.OWNER.pack_into(self.buffer, self.SEQUENCE.size, os.getpid())
+        try:
+            # Even again if a dead holder left it odd, so that readers stop falling back to the lock.
+            (sequence,) = self.SEQUENCE.unpack_from(self.buffer, 0)
+            if sequence & 1:
+                self.SEQUENCE.pack_into(self.buffer, 0, sequence + 1)
+            yield
+        finally:
+            self.OWNER.pack_into(self.buffer, self.SEQUENCE.size, 0)
+            self.lock.release()
+
+    def write(self, **fields) -> None:
+        with self.locked():
+            self.write_locked(fields)
+
+    # Atomic read-modify-write of an integer field, returns the new value.
+    def add(self, name: str, delta: int) -> int:
+        with self.locked():
+            value = self.read_locked()[name] + delta
+            self.write_locked({name: value})
+        return value
+
+    def read_locked(self) -> dict:
+        return dict(zip(self.NAMES, self.FIELDS.unpack_from(self.buffer, self.OFFSET)))
+
+    def write_locked(self, fields: dict) -> None:
+        for name, length in self.LENGTHS.items():
+            if name in fields and len(fields[name]) > length:
+                log.warning("RobotState %s truncated to %d bytes: %s", name, length, fields[name])
+        values = self.read_locked()
+        values.update(fields)
+        (sequence,) = self.SEQUENCE.unpack_from(self.buffer, 0)
+        self.SEQUENCE.pack_into(self.buffer, 0, sequence + 1)
+        self.FIELDS.pack_into(self.buffer, self.OFFSET, *[values[name] for name in self.NAMES])
+        self.SEQUENCE.pack_into(self.buffer, 0, sequence + 2)
+
+    # Release the block, unlink only from the process which created it.
+    def close(self, unlink: bool = False) -> None:
+        self.buffer = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+    # Processes started with spawn re-attach to the block by name.
+    def __getstate__(self) -> dict:
+        return {"memory": self.memory, "lock": self.lock, "takeover": self.takeover}
+
+    def __setstate__(self, state: dict) -> None:
+        self.memory, self.lock, self.takeover = state["memory"], state["lock"], state["takeover"]
+        self.buffer = self.memory.buf
+
+# Whether a process is still running, a terminated child nobody has joined yet is a zombie.
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return True
+
+def field(name: str) -> property:
+    return property(lambda self: self.snapshot()[name], lambda self, value: self.write(**{name: value}))
+
+for name in RobotState.NAMES:
+    setattr(RobotState, name, field(name))
@@ -0,0 +1,388 @@
+import time
+from datetime import datetime
+
+# Configuration + Protocols
+from misc.config import *
+from misc.protocols import *
+from misc.dispatch import Dispatcher
+from misc.recorder import Recorder, RecordedLink, LINK
+from misc.logger import get_logger
+from .image_client import ImageClient
+
+log = get_logger("Main")
+
+class Router:
+    """
+    Routing shared by MultiProcessing and AsyncGateway.
+    Each handler takes one message from a link and forwards it onto the message queues,
+    so both runtimes route messages exactly the same way.
+
+    Requires: stm, android, algorithm, calibration, state, the message queues,
+    restart_explore() and capture_obstacle(). Call build_dispatch_tables() before routing.
+    The STM and image steps (5.) also need stm_flow, stage_timer, pipeline and the hooks
+    blocking(), move() and send_command().
+    With record_links(), every message on the links is logged for etc/replay.py.
+    With meter_links(), every message on the links is counted in self.metrics.
+    """
+
+    # Compile the dispatch tables once, called at the end of the runtime's __init__.
+    # Links which are not set-up are resolved here instead of on every message.
+    def build_dispatch_tables(self) -> None:
+        self.android_dispatch = Dispatcher(default=self.on_android_unknown)
+        self.android_dispatch.on_message([b""], self.on_empty) # Empty message -> Ignore.
+        self.android_dispatch.on_message(AndroidToSTM.MESSAGES, self.on_android_to_stm if self.stm is not None else self.on_no_stm)
+        self.android_dispatch.on_message([AndroidToRPI.STOP], self.on_android_stop)
+        self.android_dispatch.on_header([AndroidToRPI.START], self.on_android_start)
+
+        self.algorithm_dispatch = Dispatcher(default=self.on_algorithm_unknown)
+        self.algorithm_dispatch.on_header(AlgorithmToSTM.MESSAGES, self.on_algorithm_to_stm if self.stm is not None else self.on_no_stm)
+        self.algorithm_dispatch.on_header(AlgorithmToAndroid.MESSAGES, self.on_algorithm_to_android if self.android is not None else self.on_no_android)
+        self.algorithm_dispatch.on_header([AlgorithmToRPI.OBSTACLE], self.on_algorithm_obstacle)
+
+        # handle_android_message / handle_algorithm_message route straight into the compiled tables.
+        self.handle_android_message = self.android_dispatch.compile()
+        self.handle_algorithm_message = self.algorithm_dispatch.compile()
+
+    def on_empty(self, message: bytes) -> None:
+        pass
+
+    def on_no_stm(self, message: bytes) -> None:
+        log.warning("No Forwarding, as STM is not set-up.")
+
+    def on_no_android(self, message: bytes) -> None:
+        log.warning("No forwarding, as Android is not set-up.")
+
+    """
+    1.1 Android handlers -> handle_android_message
+    Potential Redirection: STM, Algorithm
+    """
+    def on_android_to_stm(self, message: bytes) -> None:
+        # Mapping Android -> RPI <-> STM protocol.
+        # Set to manual mode -> Manual movement from android.
+        self.state.mode = 0
+        self.to_stm_message_queue.put_nowait(AndroidToSTM.MESSAGES[message])
+
+    def on_android_stop(self, message: bytes) -> None:
+        self.restart_explore()
+
+    # Forward Android message to Algo
+    # AND|START/EXPLORE/(R,02,02,0)/(00,10,09,0)/(01,16,03,90)
+    def on_android_start(self, message: bytes) -> None:
+        # Matched on the START header, so there is always a second field.
+        if message.split(SLASH_SEPARATOR, 2)[1] != AndroidToAlgorithm.EXPLORE:
+            return self.on_android_unknown(message)
+        if self.algorithm is None:
+            log.warning("No Forwarding, as Algo is not set-up.")
+            return
+        # Set to explore mode
+        log.info("=============== Starting Exploration ===============")
+        self.state.mode = 1
+        # One obstacle after START/EXPLORE/<robot>.
+        self.state.image_count = message.count(SLASH_SEPARATOR) - 2
+        self.to_algo_message_queue.put_nowait(ANDROID_HEADER + message)
+
+    def on_android_unknown(self, message: bytes) -> None:
+        log.warning("No Forwarding : Message from Android: %s", message)
+
+    """
+    2.1 Algorithm handlers -> handle_algorithm_message
+    Potential Redirection: Android, RPI, STM
+    """
+    # MOVEMENTS/10-9/B,B,B,FL,F,F,F,F,F,FL,B,B,F,F,F,BR,F,F,F
+    def on_algorithm_to_stm(self, raw: bytes) -> None:
+        message = raw.split(SLASH_SEPARATOR, 2)
+        # MOVEMENTS
+        if message[0] == AlgorithmToSTM.MOVEMENTS:
+            self.state.obstacle = message[1]
+            log.info("Current Target Obstacle: %s", message[1])
+            self.to_stm_message_queue.put_nowait(message[2].split(COMMA_SEPARATOR))
+        else:
+            log.warning("Algorithm To STM Command Type not recognised.")
+
+    # ROBOT/10-9/(11.0, 2.0, -90)/(10.0, 2.0, -90)/(9.0, 2.0, -90)/(12.0, 5.0, 0)/(12.0, 6.0, 0)/(12.0, 7.0, 0)/(12.0, 8.0, 0)/(12.0, 9.0, 0)/(12.0, 10.0, 0)/(9.0, 13.0, 90)/(10.0, 13.0, 90)/(11.0, 13.0, 90)/(10.0, 13.0, 90)/(9.0, 13.0, 90)/(8.0, 13.0, 90)/(11.0, 16.0, 180)/(11.0, 15.0, 180)/(11.0, 14.0, 180)/(11.0, 13.0, 180)
+    def on_algorithm_to_android(self, raw: bytes) -> None:
+        if raw.startswith(AlgorithmToAndroid.ROBOT):
+            # Keept track of the target position, for calibration purposes.
+            self.state.target = raw[raw.rfind(SLASH_SEPARATOR) + 1:]
+            # Relay raw message to android team.
+            self.to_android_message_queue.put_nowait(AND_HEADER + ALGORITHM_HEADER + raw)
+
+    # Take picture of obstacle manually.
+    def on_algorithm_obstacle(self, raw: bytes) -> None:
+        self.capture_obstacle(raw.split(SLASH_SEPARATOR, 2)[1])
+
+    def on_algorithm_unknown(self, raw: bytes) -> None:
+        log.warning("No forwarding, command not recognised.")
+
+    """
+    3.1 handle_stm_message
+    Returns True if STM is ready to receive the next command.
+    """
+    def handle_stm_message(self, message: bytes) -> bool:
+        if message is None or message is STM_PROTOCOL.SETUP_DONE:
+            return False
+
+        if message not in STM_PROTOCOL.MESSAGES:
+            log.warning("Command is not recognised under STM protocol: %s Please try again.", message)
+            return False
+
+        # STM is ready to receive message.
+        if message == STM_PROTOCOL.DONE:
+            log.debug("Receive from STM: %s", message)
+            return True
+
+        log.warning("Doesn't match anything: received from STM: %s", message)
+        return False
+
+    """
+    3.2 expand_movements
+    Truncating and mapping movement from [B, B, B, BR] -> [[Sxxxxxx], [Dxxx, Sxxx]]
+    Reason for commands_len -> need send Android how many unit of movement instead.
+    """
+    def expand_movements(self, message: list) -> tuple:
+        commands, commands_len = [], []
+        index, msg_len = 0, len(message)
+        while index < msg_len:
+            curIndex = index
+            if message[index] == COMMAND_LIST.F:
+                while curIndex < msg_len and message[curIndex] == COMMAND_LIST.F:
+                    curIndex += 1
+                commands_len.append(curIndex - index)
+                commands.append(self.calibration.bundle_movement(0, curIndex - index))
+                index = curIndex
+            elif message[index] == COMMAND_LIST.B:
+                while curIndex < msg_len and message[curIndex] == COMMAND_LIST.B:
+                    curIndex += 1
+                commands_len.append(curIndex - index)
+                commands.append(self.calibration.bundle_movement(180, curIndex - index))
+                index = curIndex
+            else:
+                # For BR, BL, FR, FL -> Instant map no need for bundle.
+                if message[index] not in self.calibration.calibration_map:
+                    log.warning("Message not recognised for STM moveset: %s", message[index])
+                    break
+                commands.append(self.calibration.calibration_map[message[index]])
+                commands_len.append(1)
+                index += 1
+        return commands, commands_len
+
+    # For raw messages -> most likely for  Straight / Reverse.
+    def expand_raw(self, message: bytes) -> list:
+        if message[0] == "W".encode():
+            return [self.calibration.STRAIGHT_F_I, self.calibration.STRAIGHT_F_P, message]
+        return [self.calibration.STRAIGHT_R_I, self.calibration.STRAIGHT_R_P, message]
+
+    """
+    4. RPI Functions
+    """
+    # Freshest frame from the camera service, captured after fresh_after (defaults to now).
+    def take_picture(self, fresh_after: float = None):
+        image = None
+        try:
+            # start_time = datetime.now()
+            image = self.camera.take_picture(fresh_after)
+            #log.info('Time Take to take picture: ' + str(datetime.now() - start_time) + 'seconds')
+        except Exception as error:
+            log.error("Failed to Take Picture.")
+            self.error_message(error)
+        return image
+
+    # Burst of self.burst frames for one detection request, captured after fresh_after (defaults to now).
+    def take_burst(self, fresh_after: float = None):
+        frames = None
+        try:
+            frames = self.camera.take_burst(self.burst, fresh_after)
+        except Exception as error:
+            log.error("Failed to Take Picture.")
+            self.error_message(error)
+        return frames
+
+    # Log every message on the links set-up so far to path, called from the runtime's __init__.
+    def record_links(self, path: str, settings: dict) -> None:
+        log.info("Recording link messages to %s", path)
+        self.recorder = Recorder(path, settings)
+        if self.stm is not None: self.stm = RecordedLink(self.stm, self.recorder, LINK.STM)
+        if self.android is not None: self.android = RecordedLink(self.android, self.recorder, LINK.ANDROID)
+        if self.algorithm is not None: self.algorithm = RecordedLink(self.algorithm, self.recorder, LINK.ALGORITHM)
+
+    # Count every message on the links set-up so far, called from the runtime's __init__ after record_links().
+    def meter_links(self, metrics) -> None:
+        self.metrics = metrics
+        if self.stm is not None: self.stm = metrics.link(self.stm, LINK.STM)
+        if self.android is not None: self.android = metrics.link(self.android, LINK.ANDROID)
+        if self.algorithm is not None: self.algorithm = metrics.link(self.algorithm, LINK.ALGORITHM)
+
+    # Client for the Image Processing Server, logged when recording and counted when metered.
+    # metered=False for the reset on STOP (image id 0), which is not an obstacle's round trip.
+    def open_image_client(self, metered: bool = True, **kwargs):
+        image_client = ImageClient(self.image_processing_server, **kwargs)
+        if self.recorder is not None:
+            image_client = RecordedLink(image_client, self.recorder, LINK.IMAGE)
+        if self.metrics is not None and metered:
+            image_client = self.metrics.link(image_client, LINK.IMAGE)
+        return image_client
+
+    # Stage timings of the last obstacle and of the whole run, called when exploration ends.
+    def report_stages(self) -> None:
+        self.stage_timer.stage("next_path")
+        log.info("Obstacle Stages", **self.stage_timer.finish())
+        self.stage_timer.report()
+
+    def error_message(self, message : str) -> None:
+        log.error("%s", message)
+
+    """
+    5. Shared STM and image steps
+    Coroutines over the runtime's hooks, so both runtimes execute moves and detect images exactly the same way:
+        await self.blocking(function, *args) -> function(*args) without blocking the other links.
+        await self.move(message) -> queue a move for send_to_stm and wait until it has been executed.
+        await self.send_command(command) -> send one STM command through the flow control, until DONE.
+    MultiProcessing's hooks never suspend and it runs the steps with run_sync, AsyncGateway awaits them on its loop.
+    """
+    # One message of to_stm_message_queue, called by send_to_stm.
+    async def execute_stm_message(self, message) -> None:
+        self.stm_flow.move_done.clear()
+        try:
+            log.debug("Raw Message from STM's MQ: %s", message)
+            # E.g. Movement message -> [B, B, BR, F]
+            if isinstance(message, list):
+                commands, commands_len = self.expand_movements(message)
+
+                # Passing the truncated commands to STM and Android.
+                # commands = [[Sxxxxxx], [Dxxx, Sxxx]]
+                log.debug("Converted commands: %s", commands)
+                for index, command in enumerate(commands):
+                    # Send command len to android.
+                    if self.state.mode == 1:
+                        self.to_android_message_queue.put_nowait(AND_HEADER + STM_HEADER + STMToAndroid.DONE + str(commands_len[index]).encode())
+
+                    # Send bundled instruction like BR is actually Turn right then Reverse.
+                    # Each send waits until STM calls back with DONE.
+                    for part in command:
+                        await self.send_command(part)
+                    log.debug("STM Completed one move.")
+
+                # Finish one entire movement set, if on Exploration mode -> Take picture time.
+                if self.state.mode == 1:
+                    await self.request_picture()
+                else:
+                    log.info("Mode is Manual")
+            else:
+                # For raw messages -> most likely for  Straight / Reverse.
+                for msg in self.expand_raw(message):
+                    await self.send_command(msg)
+        finally:
+            # Also on failure, don't leave image processing waiting on a move that will never finish.
+            self.stm_flow.move_done.set()
+
+    async def request_picture(self) -> None:
+        if self.image_processing_server is None:
+            log.warning('Image processing is not turned on')
+            self.to_algo_message_queue.put_nowait(RPI_HEADER + RPIToAlgorithm.REQUEST_ROBOT_NEXT + RPIToAlgorithm.NIL)
+            return
+        acked_at = time.monotonic()
+        if self.pipeline:
+            # Image worker captures a frame newer than the ack, the STM sender moves on.
+            log.info('Picture Requested -> STM completed one movement.')
+            frames = None
+        else:
+            frames = await self.blocking(self.take_burst)
+            log.info('First Picture Taken -> STM completed one movement.')
+        self.image_queue.put_nowait([frames, f"{self.state.image_count}", acked_at])
+
+    # One request of image_queue, called by image_processing.
+    # frames is None when the image worker has to capture them, requested_at is when the picture was asked for.
+    async def process_image(self, image_client, frames, image_id, requested_at: float) -> None:
+        self.stage_timer.start(requested_at)
+        if frames is None:
+            frames = await self.blocking(self.take_burst, requested_at)
+            log.info('RPI Picture Taken')
+        self.stage_timer.stage("capture")
+
+        # Each image has 4 tries.
+        rebound = 0
+        for cur_try in range(4):
+            start_time = datetime.now()
+            log.info("Sending Image to Server -> Tries: %s", cur_try + 1)
+            try:
+                reply = (await self.blocking(image_client.send, image_id, frames)).decode(FORMAT)
+            except TimeoutError as error:
+                # Server is slow or gone, the socket has been reset -> Resend the same frame.
+                log.warning('Image Server did not reply in time.')
+                self.error_message(error)
+                continue
+            log.info("Image processed", seconds=(datetime.now() - start_time).total_seconds(), bytes_sent=image_client.last_size)
+            self.stage_timer.stage("detect")
+
+            if reply == "NIL":
+                # Move backwards command
+                log.error('Failed to detect image, retrying now.')
+                self.state.mode = 0
+                await self.move([COMMAND_LIST.B])
+                self.stage_timer.stage("rebound")
+
+                # Retake image and repeat.
+                rebound = cur_try + 1
+                frames = await self.blocking(self.take_burst)
+                image_id = f"{self.state.image_count}"
+                self.stage_timer.stage("capture")
+                continue
+
+            image_id, distance = reply.split("/")
+            distance = float(distance)
+            log.info("Detected Image: %s, Distance away: %s", image_id, distance)
+            # Update Android with the image detected.
+            self.to_android_message_queue.put_nowait(AND_HEADER + RPI_HEADER + f"TARGET/{image_id}".encode(FORMAT))
+            self.state.add('image_count', -1)
+            # Exploration is done -> Thats the final picture.
+            if self.state.image_count == 0:
+                self.finish_explore()
+                return
+
+            # Move forward to offset the difference.
+            if distance >= self.calibration.MINUS_UNIT:
+                correction = self.calibration.bundle_movement_raw(0, distance / 21)
+                # Pipelined: STM queue is FIFO, the next path can only run after the correction.
+                if self.pipeline:
+                    self.to_stm_message_queue.put_nowait(correction)
+                else:
+                    await self.move(correction)
+                    self.stage_timer.stage("correction")
+
+            self.state.mode = 1
+            self.request_next_path()
+            return
+
+        # Gives up on detecting image -> Forward again.
+        # Can't detect the final image -> Just stop.
+        if self.state.image_count == 1:
+            self.finish_explore()
+            return
+        # Time to move forward and request next step.
+        self.state.mode = 0
+        self.state.add('image_count', -1)
+        # Nothing to undo if every try timed out.
+        if rebound != 0:
+            await self.move([COMMAND_LIST.F] * rebound)
+        self.state.mode = 1
+        self.request_next_path()
+
+    # Request for next moveset from Algorithm
+    def request_next_path(self) -> None:
+        self.to_algo_message_queue.put_nowait(RPI_HEADER + RPIToAlgorithm.REQUEST_ROBOT_NEXT + RPIToAlgorithm.NIL)
+        self.stage_timer.stage("next_path")
+        log.info("Obstacle Stages", **self.stage_timer.finish())
+
+    def finish_explore(self) -> None:
+        self.to_android_message_queue.put_nowait(AND_HEADER + RPI_HEADER + RPIToAndroid.FINISH_EXPLORE)
+        self.report_stages()
+        self.restart_explore()
+
+# Run a coroutine whose awaits never suspend, e.g. the steps above with MultiProcessing's hooks, in the calling process.
+def run_sync(coroutine):
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("Coroutine suspended outside of an event loop.")
@@ -1,51 +1,72 @@
 # Stuff
 import time
-from multiprocessing import Process, Value, Manager
+import queue
+from multiprocessing import Process, Value, Manager, Event
 
 # Configuration + Protocols
 from misc.config import *
 from misc.protocols import *
 from misc.calibration import *
+from misc.recorder import LINK
+from misc.logger import get_logger
+
 # Interfaces
 from .stm import STM
 from .android import Android
 from .ultrasonic import UltraSonic
+from .flow_control import LatencyHistogram
+from .metrics import Metrics, MetricsServer
+
+log = get_logger("Main")
 
 class TASK2:
+    START   = "L0000x0000".encode()
     DONE    = "0000000000".encode()
 
 class SpeedRun:
     """
     Handles the communication between STM, Android, Algorithm and Image Processing Server.
     """    
-    def __init__(self, android_on: bool, stm_on: bool, ultrasonic_on: bool, env : str) -> None:
+    def __init__(self, android_on: bool, stm_on: bool, ultrasonic_on: bool, env : str, serial_port: list = SERIAL_PORT, metrics_port: int = METRICS_PORT) -> None:
     
-        print("[Main] __init__ Multi Processing Communication")
+        log.info("__init__ Multi Processing Communication")
         self.manager = Manager()
-        self.start_task = Value('i', 0)
+        self.start_task = Event() # Set once Android starts Task 2.
+        self.shutdown = Event() # Set to stop every link worker.
+        # Counters and gauges shared by the link processes, served on metrics_port (None for off).
+        # STM latency is the whole of Task 2, from TASK2.START to TASK2.DONE.
+        self.metrics = Metrics(LatencyHistogram())
+        self.metrics_server = MetricsServer(self.metrics, port=metrics_port) if metrics_port is not None else None
+        self.task_started = Value('d', 0.0)
         
         self.stm = self.android = self.ultrasonic = None
 
         # STM
         if stm_on:
-            print("[Main] Running with STM interface.") 
-            self.stm = STM()
+            log.info("Running with STM interface.") 
+            self.stm = STM(serial_port)
             self.to_stm_message_queue = self.manager.Queue()
+            self.metrics.watch_queue("to_stm_message_queue", self.to_stm_message_queue)
             self.recv_from_stm_process = Process(target=self.recv_from_stm, name="[STM Recv Process]")
             self.send_to_stm_process = Process(target=self.send_to_stm, name = "[STM Send Process]")
 
         # Android
         if android_on:
-            print("[Main] Running with Android interface.")  
+            log.info("Running with Android interface.")  
             self.android = Android()
             self.to_android_message_queue = self.manager.Queue()
+            self.metrics.watch_queue("to_android_message_queue", self.to_android_message_queue)
             self.recv_from_android_process = Process(target=self.recv_from_android, name="[Android Recv Process]")
 
         if ultrasonic_on:
-            print("[Main] Running Ultrasonic interface.")
+            log.info("Running Ultrasonic interface.")
             self.ultrasonic = UltraSonic()
             self.recv_from_ultrasonic_process = Process(target=self.recv_from_ultrasonic, name="[Ultra Sonic Recv Process]")
 
+        # Count every message on the links.
+        if self.stm is not None: self.stm = self.metrics.link(self.stm, LINK.STM)
+        if self.android is not None: self.android = self.metrics.link(self.android, LINK.ANDROID)
+
     # Start all processes -> Called from main.py
     def start(self) -> None:
         try:
@@ -61,23 +82,28 @@ class SpeedRun:
             #Ultra Sonic
             if self.ultrasonic is not None:
                 self.recv_from_ultrasonic_process.start()
-            print('[Main] Multi Process Communication has successfully started.')
+            if self.metrics_server is not None:
+                self.metrics_server.start()
+            log.info('Multi Process Communication has successfully started.')
             
         except Exception as error:
-            print(error)
+            log.error("%s", error)
             raise error
         # Continously check if reconnection is needed.
         self.check_process_alive()
 
     # Shut down all processes -> Called from main.py
     def end(self) -> None:
+        self.shutdown.set()
+        self.start_task.set() # Release workers still waiting for the task to start.
         if self.stm is not None: self.stm.disconnect()
         if self.android is not None: self.android.disconnect_all()
-        print("[Main] Multi Process Communication has successfully ended.")
+        if self.metrics_server is not None: self.metrics_server.stop()
+        log.info("Multi Process Communication has successfully ended.")
 
     # Restart all processes
     def restart_speedrun(self) -> None:
-        self.start_task.value = 0
+        self.start_task.clear()
 
         if self.stm is not None:
             # Flush instructions & Reconnect
@@ -87,7 +113,7 @@ class SpeedRun:
             while not self.to_stm_message_queue.empty():
                 self.to_stm_message_queue.get_nowait()
             
-            print("[Main] - STM Message Queue has been flushed.")
+            log.info("STM Message Queue has been flushed.")
             self.recv_from_stm_process = Process(target=self.recv_from_stm, name="[STM Recv Process]")
             self.send_to_stm_process = Process(target=self.send_to_stm, name="[STM Send Process]")
             self.recv_from_stm_process.start()
@@ -96,11 +122,12 @@ class SpeedRun:
         if self.android is not None:
             while not self.to_android_message_queue.empty():
                 self.to_android_message_queue.get_nowait()
-            print("[Main] Android Message Queue flushed")
+            log.info("Android Message Queue flushed")
 
         
     def check_process_alive(self) -> None:
-        while True:
+        # Sleep between checks instead of spinning, wakes up immediately on shutdown.
+        while not self.shutdown.wait(PROCESS_CHECK_INTERVAL):
             try:
                 # Check STM connection
                 if self.stm is not None and (not self.recv_from_stm_process.is_alive() or not self.send_to_stm_process.is_alive()):
@@ -110,7 +137,7 @@ class SpeedRun:
                 if self.android is not None and not self.recv_from_android_process.is_alive():
                     self.reconnect_android()
             except Exception as error:
-                print("[Main] Error during reconnection: ",error)
+                log.error("Error during reconnection: %s", error)
                 raise error
 
     """
@@ -123,7 +150,7 @@ class SpeedRun:
     Potential Redirection: STM, Algorithm
     """
     def recv_from_android(self) -> None:
-        while True:
+        while not self.shutdown.is_set():
             try:
                 raw_message = self.android.recv()
 
@@ -138,20 +165,20 @@ class SpeedRun:
                     message_list = message.split(SLASH_SEPARATOR)
                     
                     # START/EXPLORE/
-                    print(message_list, message_list[0],AndroidToRPI.START )
+                    log.debug("%s %s %s", message_list, message_list[0], AndroidToRPI.START)
                     if message_list[0] == AndroidToRPI.START:
                         # Time to start the Task 2.
-                        self.start_task.value = 1
+                        self.start_task.set()
                         self.to_stm_message_queue.put_nowait("START")
                     elif message == AndroidToRPI.STOP:
                         self.restart_speedrun()
                         continue
                     else:
-                        print(f"[Main] No Forwarding - Not supported command for Task 2 : Message from Android: {message}")
+                        log.warning("No Forwarding - Not supported command for Task 2 : Message from Android: %s", message)
 
             except Exception as error:
                 # Peer has reset bluetooth network -> Restart now.
-                print("[Main] Process of reading android has failed")
+                log.error("Process of reading android has failed")
                 self.error_message(error)
                 self.reconnect_android()
     
@@ -160,11 +187,11 @@ class SpeedRun:
     Function: Terminate android send/recv process and recreate them.
     """  
     def reconnect_android(self) -> None:
-        print("[Main] Disconnecting Android Process.")
+        log.info("Disconnecting Android Process.")
 
         # Terminate all Android process.
         self.recv_from_android_process.terminate()
-        print("[Main] Android send/recv processes has been terminated ")
+        log.info("Android send/recv processes has been terminated ")
 
         # Close all Android bluetooth sockets.
         self.android.disconnect_client()
@@ -175,7 +202,8 @@ class SpeedRun:
         # Recreate all processes as Process cant be restart
         self.recv_from_android_process = Process(target=self.recv_from_android, name="[Android Recv Process]")
         self.recv_from_android_process.start()
-        print("[Main] Android send/recv processes has been reconnected.")
+        self.metrics.reconnected(LINK.ANDROID)
+        log.info("Android send/recv processes has been reconnected.")
 
  
 
@@ -191,7 +219,7 @@ class SpeedRun:
 
     def recv_from_stm(self) -> (None):
         
-        while True:
+        while not self.shutdown.is_set():
 
             try:
                 
@@ -201,14 +229,15 @@ class SpeedRun:
                     continue
 
                 if stm_data == TASK2.DONE:
+                    self.metrics.stm_latency.record(TASK2.START, time.monotonic() - self.task_started.value)
                     # Finish path finding.
                     self.android.send(AND_HEADER + RPI_HEADER + RPIToAndroid.FINISH_PATH)
                     break
                 else:
-                    print(f"[Main] Received from STM, not handling {stm_data}")
+                    log.debug("Received from STM, not handling %s", stm_data)
                     # STM Done some command
             except Exception as error:
-                print('[Main] STM Read Error')
+                log.error('STM Read Error')
                 self.error_message(error)
                 break
 
@@ -218,26 +247,28 @@ class SpeedRun:
     """
     def send_to_stm(self) -> None:
 
-        # Stall until android starts Task 2.
-        while self.start_task.value == 0:
-            continue
+        # Sleep until android starts Task 2.
+        self.start_task.wait()
 
-        while True:
+        while not self.shutdown.is_set():
             try:
-                if not self.to_stm_message_queue.empty():
-                    raw_msg = self.to_stm_message_queue.get_nowait()
-                    print(f"[Main] Raw Message from STM MQ: {raw_msg}")
-                    # Ultrasonic Data -> Send to STM
-                    if raw_msg[0] == "U":
-                        self.stm.send(raw_msg.encode(FORMAT))
-                    # Android send START.
-                    elif raw_msg == "START":
-                        self.stm.send("L0000x0000".encode(FORMAT))
-                    else:
-                        print(raw_msg)
+                # Block until there is a message, time out to check for shutdown.
+                raw_msg = self.to_stm_message_queue.get(timeout=QUEUE_TIMEOUT)
+                log.debug("Raw Message from STM MQ: %s", raw_msg)
+                # Ultrasonic Data -> Send to STM
+                if raw_msg[0] == "U":
+                    self.stm.send(raw_msg.encode(FORMAT))
+                # Android send START.
+                elif raw_msg == "START":
+                    self.task_started.value = time.monotonic()
+                    self.stm.send(TASK2.START)
+                else:
+                    log.warning("Message to STM not recognised: %s", raw_msg)
                 
+            except queue.Empty:
+                continue
             except Exception as error:
-                print('[Main] Process send_to_stm has failed')
+                log.error('Process send_to_stm has failed')
                 self.error_message(error)
 
     """
@@ -245,7 +276,7 @@ class SpeedRun:
     Function: Terminate stm send/recv process and recreate them.
     """ 
     def reconnect_stm(self) -> None:
-        print("[Main] Disconnecting STM Process.")
+        log.info("Disconnecting STM Process.")
         # Terminate all Android process.
         self.recv_from_stm_process.terminate()
         self.send_to_stm_process.terminate()
@@ -256,27 +287,28 @@ class SpeedRun:
         self.send_to_stm_process = Process(target=self.send_to_stm, name="[STM Send Process]")
         self.recv_from_stm_process.start()
         self.send_to_stm_process.start()
-        print("[Main] STM Process has been Reconnected")
+        self.metrics.reconnected(LINK.STM)
+        log.info("STM Process has been Reconnected")
 
     """
     2. Ultra Sonic Processes (Recv)
     """
     def recv_from_ultrasonic(self):
-        while True:
+        while not self.shutdown.is_set():
             try:
-                while self.start_task.value == 0:
-                    continue
+                # Sleep until android starts Task 2.
+                self.start_task.wait()
                 distance = self.ultrasonic.distance()
                 self.to_stm_message_queue.put_nowait(self.us_data_converter(int(distance)))
                 # Time delay 100ms.
                 time.sleep(0.1)
 
             except Exception as error:
-                print('[Main] Error - Ultrasonic read error')
+                log.error('Error - Ultrasonic read error')
                 raise error
     
     def us_data_converter(self, us_data):
         return "U0000x" + str(us_data).rjust(4, '0')
 
     def error_message(self, message : str) -> None:
-        print(f"[Error Message]: {message}")
\ No newline at end of file
+        log.error("%s", message)
\ No newline at end of file
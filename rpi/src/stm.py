@@ -2,14 +2,19 @@
 import time
 import serial
 from misc.protocols import STM_PROTOCOL
-from misc.config import SERIAL_PORT, BAUD_RATE
+from misc.config import SERIAL_PORT, BAUD_RATE, STM_READ_TIMEOUT, STM_MESSAGE_SIZE
+from misc.logger import get_logger
+
+log = get_logger("STM")
 
 class STM:
     def __init__(self, serial_port=SERIAL_PORT, baud_rate=BAUD_RATE, env:str = None) -> None:
         self.env = env
         self.flip = 0
         self.stm = None
+        self.partial = b"" # Bytes of a message that is still arriving.
         self.baud_rate = baud_rate
+        self.serial_ports = serial_port # Candidate ports, tried in turn.
         self.serial_port = serial_port[self.flip]
 
     # Establish connection with STM Board
@@ -17,53 +22,55 @@ class STM:
         retry = True
         while retry:
             try:
-                print(f"[STM] Establishing Connection with STM on Serial Port: {self.serial_port} Baud Rate: {self.baud_rate}")
-                self.stm = serial.Serial(port=self.serial_port, baudrate=self.baud_rate, timeout=None)
+                log.info("Establishing Connection with STM on Serial Port: %s Baud Rate: %s", self.serial_port, self.baud_rate)
+                self.stm = serial.Serial(port=self.serial_port, baudrate=self.baud_rate, timeout=STM_READ_TIMEOUT)
+                self.partial = b""
                 if self.stm is not None:
-                    print(f"[STM] Established connection on Serial Port: {self.serial_port} Baud Rate: {self.baud_rate}")
+                    log.info("Established connection on Serial Port: %s Baud Rate: %s", self.serial_port, self.baud_rate)
                     #if self.env == 'g-outdoor':
                         #self.send(b'G0104x0100')
                         #self.recv()
                     retry = False
             except IOError as error:
-                print(f"[Error] Failed to establish STM Connection: {str(error)}")
+                log.error("Failed to establish STM Connection: %s", error)
                 # Alternate port due to potential port flip due to failed connection.
                 if error.errno == 2:
-                    self.flip ^= 1
-                    self.serial_port = SERIAL_PORT[self.flip]
-                    print(f"[STM] Switching port to {self.serial_port} due to Port Flip.")
+                    self.flip = (self.flip + 1) % len(self.serial_ports)
+                    self.serial_port = self.serial_ports[self.flip]
+                    log.warning("Switching port to %s due to Port Flip.", self.serial_port)
                     time.sleep(1)
                 retry = True
             if retry:
-                print(f"[STM] Retrying STM Connection...")
+                log.warning("Retrying STM Connection...")
     
     def disconnect(self) -> None:
         try:
             if self.stm is not None:
                 self.stm.close()
                 self.stm = None
-                print(f"[STM] STM has been disconnected.")
+                log.info("STM has been disconnected.")
         except Exception as error:
-            print(f"[Error] Failed to disconnect STM: {str(error)}")
+            log.error("Failed to disconnect STM: %s", error)
 
+    # Blocks until a full message arrives or the read times out, raises if the port fails or is closed.
     def recv(self) -> str:
         try:
-            if self.stm.inWaiting() > 0:
-                if self.stm.inWaiting() >= 10:
-                    message = self.stm.read(10).strip()
-                    return message
-                else:
-                    print(f"[!!!!!!] Buffer less than 10 bytes -> {self.stm.read(self.stm.inWaiting())}")
-            return None
+            self.partial += self.stm.read(STM_MESSAGE_SIZE - len(self.partial))
+            if len(self.partial) < STM_MESSAGE_SIZE:
+                # Timed out, keep what has arrived for the next read.
+                return None
+            message, self.partial = self.partial.strip(), b""
+            return message
         except Exception as error:
-            print(f"[Error] Failed to recieve from STM: {str(error)}")
+            log.error("Failed to recieve from STM: %s", error)
+            raise
 
     def send(self, message) -> None:
         try:
-            print(f"[STM] Message to STM: {message}")
+            log.debug("Message to STM: %s", message)
             self.stm.write(message)
         except Exception as error:
-            print(f"[Error] Failed to send to STM: {str(error)}")
+            log.error("Failed to send to STM: %s", error)
 
 # Standalone testing.
 if __name__ == '__main__':
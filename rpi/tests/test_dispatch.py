@@ -0,0 +1,61 @@
+import os
+import sys
+
+# like main.py: run from rpi/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from misc.dispatch import Dispatcher
+
+def recorder(name, calls):
+    def handler(message):
+        calls.append((name, message))
+    return handler
+
+def dispatcher(calls, exact=True):
+    table = Dispatcher(recorder("default", calls))
+    table.on_header([b"ROBOT", b"MOVE"], recorder("header", calls))
+    if exact:
+        table.on_message([b"MOVE/F", b"STOP"], recorder("exact", calls))
+    return table.compile()
+
+def test_exact_message_takes_precedence_over_its_header():
+    calls = []
+    dispatch = dispatcher(calls)
+    dispatch(b"MOVE/F")
+    dispatch(b"MOVE/B")
+    assert calls == [("exact", b"MOVE/F"), ("header", b"MOVE/B")]
+
+def test_header_is_the_bytes_before_the_first_slash():
+    calls = []
+    dispatch = dispatcher(calls)
+    dispatch(b"ROBOT/1/2/N")
+    dispatch(b"ROBOT")
+    dispatch(b"ROBOTS/1")
+    assert calls == [("header", b"ROBOT/1/2/N"), ("header", b"ROBOT"), ("default", b"ROBOTS/1")]
+
+def test_exact_message_without_header():
+    calls = []
+    dispatch = dispatcher(calls)
+    dispatch(b"STOP")
+    dispatch(b"STOP/1")
+    assert calls == [("exact", b"STOP"), ("default", b"STOP/1")]
+
+def test_headers_only_table():
+    calls = []
+    dispatch = dispatcher(calls, exact=False)
+    dispatch(b"MOVE/F")
+    dispatch(b"UNKNOWN")
+    assert calls == [("header", b"MOVE/F"), ("default", b"UNKNOWN")]
+
+def test_compiled_table_is_frozen():
+    calls = []
+    table = Dispatcher(recorder("default", calls))
+    dispatch = table.compile()
+    table.on_header([b"MOVE"], recorder("header", calls))
+    dispatch(b"MOVE/F")
+    assert calls == [("default", b"MOVE/F")]
+
+def test_handler_result_is_returned():
+    table = Dispatcher(lambda message: None)
+    table.on_message([b"STOP"], lambda message: message.lower())
+    assert table.compile()(b"STOP") == b"stop"
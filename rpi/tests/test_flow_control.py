@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+
+# like main.py: run from rpi/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.flow_control import STMFlowControl, AsyncSTMFlowControl
+
+TIMEOUT = 0.2
+
+class ScriptedSTM:
+    """
+    STM whose n-th send is answered with a DONE after delays[n] seconds, never when it is None.
+    """
+    def __init__(self, flow, delays):
+        self.flow = flow
+        self.delays = list(delays)
+        self.sent = []
+
+    def send(self, command):
+        self.sent.append(command)
+        delay = self.delays.pop(0) if self.delays else 0.01
+        if delay is not None:
+            threading.Timer(delay, self.flow.acknowledge).start()
+
+def flow_control(cls=STMFlowControl):
+    return cls(ack_timeout=TIMEOUT, max_resends=1, resend_types=("I", "P"), command_delay=0)
+
+def test_resend_recovers_a_lost_done():
+    flow = flow_control()
+    stm = ScriptedSTM(flow, [None, 0.01, 0.01])
+    assert flow.send(stm, b"I0900x0100")
+    assert stm.sent == [b"I0900x0100"] * 2
+    assert flow.timeouts.value == 1 and flow.stale.value == 0
+
+    # The next command is acknowledged by its own DONE, right away.
+    start_time = time.monotonic()
+    assert flow.send(stm, b"S0013x0000")
+    assert time.monotonic() - start_time < TIMEOUT
+    assert flow.timeouts.value == 1
+
+def test_late_done_during_resend_acknowledges_the_command():
+    flow = flow_control()
+    stm = ScriptedSTM(flow, [TIMEOUT * 1.5, None])
+    start_time = time.monotonic()
+    assert flow.send(stm, b"P1200x2100")
+    assert TIMEOUT < time.monotonic() - start_time < TIMEOUT * 2
+    assert flow.stale.value == 0
+
+def test_late_done_of_a_released_command_is_dropped():
+    flow = flow_control()
+    # The movement's DONE comes just after the next command has been sent, which answers later.
+    stm = ScriptedSTM(flow, [TIMEOUT * 1.1, TIMEOUT * 0.5])
+    assert not flow.send(stm, b"S0013x0000")
+    assert flow.stale.value == 1
+
+    start_time = time.monotonic()
+    assert flow.send(stm, b"W0013x0000")
+    assert time.monotonic() - start_time >= TIMEOUT * 0.45
+    assert flow.stale.value == 0
+
+def test_lost_done_of_a_released_command_costs_one_timeout():
+    flow = flow_control()
+    stm = ScriptedSTM(flow, [None, 0.01, 0.01, 0.01])
+    assert not flow.send(stm, b"S0013x0000")
+    # Its DONE is taken for the released one's, then nothing more is owed.
+    assert not flow.send(stm, b"W0013x0000")
+    assert flow.stale.value == 0
+    assert flow.send(stm, b"W0013x0000")
+    assert flow.send(stm, b"S0013x0000")
+    assert flow.timeouts.value == 2
+
+def test_reset_forgets_owed_dones():
+    flow = flow_control()
+    stm = ScriptedSTM(flow, [None])
+    assert not flow.send(stm, b"S0013x0000")
+    flow.reset()
+    assert flow.stale.value == 0
+    assert flow.send(stm, b"W0013x0000")
+
+def test_async_resend_recovers_a_lost_done():
+    async def run():
+        flow = flow_control(AsyncSTMFlowControl)
+        loop = asyncio.get_running_loop()
+        stm = ScriptedSTM(flow, [None, 0.01])
+        # DONEs arrive on the event loop, like recv_from_stm.
+        stm.flow = type("Loop", (), {"acknowledge": lambda self: loop.call_soon_threadsafe(flow.acknowledge)})()
+        assert await flow.send(stm, b"I0900x0100")
+        assert flow.timeouts.value == 1 and flow.stale.value == 0
+    asyncio.run(run())
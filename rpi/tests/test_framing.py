@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+# like main.py: run from rpi/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from misc.framing import FRAMING, FrameCodec
+
+MESSAGES = [b"ROBOT/1/2/N", b"MOVE/F", b"TARGET/3/11"]
+
+def drain(codec):
+    messages = []
+    while (message := codec.next()) is not None:
+        messages.append(message)
+    return messages
+
+def encoded(codec, messages=MESSAGES):
+    return b"".join(codec.encode(message) for message in messages)
+
+@pytest.mark.parametrize("mode", [FRAMING.DELIMITER, FRAMING.LENGTH])
+def test_glued_read(mode):
+    codec = FrameCodec(mode)
+    assert codec.feed(encoded(codec)) == len(MESSAGES)
+    assert drain(codec) == MESSAGES
+
+@pytest.mark.parametrize("mode", [FRAMING.DELIMITER, FRAMING.LENGTH])
+def test_split_reads(mode):
+    codec = FrameCodec(mode)
+    stream = encoded(codec)
+    # One byte per read, nothing comes out before a message is complete.
+    received = []
+    for index in range(len(stream)):
+        codec.feed(stream[index:index + 1])
+        received += drain(codec)
+    assert received == MESSAGES
+    assert len(codec.buffer) == 0
+
+@pytest.mark.parametrize("mode", [FRAMING.DELIMITER, FRAMING.LENGTH])
+def test_message_split_across_glued_reads(mode):
+    codec = FrameCodec(mode)
+    stream = encoded(codec)
+    middle = len(codec.encode(MESSAGES[0])) + 3
+    assert codec.feed(stream[:middle]) == 1
+    assert codec.feed(stream[middle:]) == 3
+    assert drain(codec) == MESSAGES
+
+def test_raw_is_one_message_per_read():
+    codec = FrameCodec(FRAMING.RAW)
+    codec.feed(b"MOVE/F\n")
+    codec.feed(b"  ")
+    codec.feed(b"ROBOT/1/2/N")
+    assert drain(codec) == [b"MOVE/F", b"ROBOT/1/2/N"]
+    assert codec.encode(b"MOVE/F") == b"MOVE/F"
+
+def test_delimiter_straddling_two_reads():
+    codec = FrameCodec(FRAMING.DELIMITER, delimiter=b"\r\n")
+    assert codec.feed(b"MOVE/F\r") == 0
+    assert codec.feed(b"\nROBOT/1/2/N\r\n") == 2
+    assert drain(codec) == [b"MOVE/F", b"ROBOT/1/2/N"]
+
+def test_oversized_length_prefix():
+    codec = FrameCodec(FRAMING.LENGTH, max_size=16)
+    with pytest.raises(ValueError):
+        codec.feed(FrameCodec.LENGTH_HEADER.pack(17) + b"x")
+    # The buffer is dropped, the next frame decodes.
+    codec.feed(codec.encode(b"MOVE/F"))
+    assert drain(codec) == [b"MOVE/F"]
+
+def test_oversized_delimited_frame():
+    codec = FrameCodec(FRAMING.DELIMITER, max_size=16)
+    with pytest.raises(ValueError):
+        codec.feed(b"x" * 17)
+    codec.feed(codec.encode(b"MOVE/F"))
+    assert drain(codec) == [b"MOVE/F"]
+
+def test_reset_drops_partial_message():
+    codec = FrameCodec(FRAMING.LENGTH)
+    codec.feed(codec.encode(b"MOVE/F")[:5])
+    codec.reset()
+    codec.feed(codec.encode(b"ROBOT/1/2/N"))
+    assert drain(codec) == [b"ROBOT/1/2/N"]
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        FrameCodec("json")
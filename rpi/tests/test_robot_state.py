@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import multiprocessing
+
+# like main.py: run from rpi/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.robot_state import RobotState
+
+def hold_lock(state, seconds, started):
+    # Like a writer: the lock and the owner taken, the sequence odd mid-write.
+    with state.locked():
+        (sequence,) = state.SEQUENCE.unpack_from(state.buffer, 0)
+        state.SEQUENCE.pack_into(state.buffer, 0, sequence + 1)
+        started.set()
+        time.sleep(seconds)
+        state.SEQUENCE.pack_into(state.buffer, 0, sequence + 2)
+
+def start_holder(state, seconds):
+    started = multiprocessing.Event()
+    process = multiprocessing.Process(target=hold_lock, args=(state, seconds, started))
+    process.start()
+    started.wait()
+    return process
+
+def test_fields_round_trip():
+    state = RobotState()
+    try:
+        state.mode = 2
+        state.obstacle = b"10-9"
+        assert state.add("image_count", 3) == 3
+        assert state.snapshot() == {"mode": 2, "image_count": 3, "obstacle": b"10-9", "target": b"(0, 0, 0)"}
+    finally:
+        state.close(unlink=True)
+
+def test_slow_holder_is_waited_for():
+    state = RobotState()
+    try:
+        process = start_holder(state, state.LOCK_TIMEOUT * 1.5)
+        state.mode = 1
+        process.join()
+        # The holder released its own lock, nobody else did.
+        assert process.exitcode == 0
+        assert state.mode == 1
+        assert state.lock.acquire(timeout=0)
+        state.lock.release()
+    finally:
+        state.close(unlink=True)
+
+def test_dead_holder_is_taken_over():
+    state = RobotState()
+    try:
+        process = start_holder(state, 60)
+        # Not joined, a zombie like the processes reconnect_* terminates.
+        process.terminate()
+        time.sleep(0.2)
+        assert state.snapshot()["mode"] == 0
+        state.mode = 2
+        assert state.mode == 2
+        (sequence,) = state.SEQUENCE.unpack_from(state.buffer, 0)
+        assert sequence % 2 == 0
+        process.join()
+    finally:
+        state.close(unlink=True)